@@ -25,6 +25,9 @@ const createAssistantMessage = (message, is_summary = false) => ({
   is_summary,
 });
 
+const createRequestId = () =>
+  `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
 export const AIAssistant = () => {
   const daily = useDaily();
   const [chatHistory, setChatHistory] = useState([]);
@@ -39,6 +42,12 @@ export const AIAssistant = () => {
   const audioMsgRef = useRef(null);
   const audioErrorRef = useRef(null);
 
+  /**
+   * Streamed answers being assembled, keyed by request id.
+   * Each holds the next expected sequence number and the content so far.
+   */
+  const streamsRef = useRef({});
+
   /**
    * Reset summary button state after 60 seconds, in case no summary was sent from server.
    */
@@ -83,9 +92,47 @@ export const AIAssistant = () => {
       if (err) {
         playAudioError();
       }
+      if (kind === "ai-summary-delta" || kind === "ai-query-delta") {
+        const stream = streamsRef.current[data.id] ?? { seq: 0, content: "" };
+        /**
+         * If we missed part of the stream, stop assembling it and
+         * wait for the full answer instead.
+         */
+        if (data.seq !== stream.seq) return;
+        stream.seq += 1;
+        stream.content += data.delta;
+        streamsRef.current[data.id] = stream;
+        const content = stream.content;
+        setChatHistory((prev) => {
+          const idx = prev.findIndex((m) => m.stream_id === data.id);
+          if (idx === -1) {
+            return [
+              ...prev,
+              {
+                ...createAssistantMessage(
+                  content,
+                  kind === "ai-summary-delta",
+                ),
+                stream_id: data.id,
+              },
+            ];
+          }
+          const next = [...prev];
+          next[idx] = { ...prev[idx], content };
+          return next;
+        });
+        return;
+      }
       const msg = err ?? data.data;
+      /**
+       * The full answer replaces any partial answer streamed so far.
+       */
+      if (data.id) delete streamsRef.current[data.id];
+      const dropStreamed = (prev) =>
+        data.id ? prev.filter((m) => m.stream_id !== data.id) : prev;
       if (kind === "ai-summary") {
-        setChatHistory((prev) => {
+        setChatHistory((streamed) => {
+          const prev = dropStreamed(streamed);
           const summaries = prev.filter(
             (m) => m.role === "assistant" && m.is_summary,
           );
@@ -121,7 +168,10 @@ export const AIAssistant = () => {
         return;
       }
       if (kind === "ai-query") {
-        setChatHistory((prev) => [...prev, createAssistantMessage(msg)]);
+        setChatHistory((prev) => [
+          ...dropStreamed(prev),
+          createAssistantMessage(msg),
+        ]);
         setIsPrompting(false);
         playAudioMsg();
         return;
@@ -166,6 +216,8 @@ export const AIAssistant = () => {
           kind: "assist",
           task: "query",
           query: query,
+          stream: true,
+          id: createRequestId(),
         },
         "*",
       );
@@ -186,6 +238,8 @@ export const AIAssistant = () => {
           kind: "assist",
           task: "summary",
           broadcast: true,
+          stream: true,
+          id: createRequestId(),
         },
         "*",
       );
@@ -20,18 +20,46 @@ const REFRESH_INTERVAL = 30000;
 export const Transcript = ({ roomUrl }) => {
   const daily = useDaily();
   const unhandledLines = useRef(0);
+  // Sequence number of the next transcript segment we expect from the server.
+  const cursor = useRef(0);
   const [transcript, setTranscript] = useState("");
 
   const [transcriptHeight, setTranscriptHeight] = useState(0);
   const transcriptRef = useRef(null);
 
+  const requestTranscript = useCallback(() => {
+    unhandledLines.current = 0;
+    daily.sendAppMessage({
+      "kind": "assist",
+      "task": "transcript",
+      "since": cursor.current,
+      "subscribe": true,
+    }, "*");
+  }, [daily]);
+
   useDailyEvent(
     "app-message",
     useCallback((ev) => {
       const data = ev?.data;
       if (data?.kind !== "ai-transcript") return;
-      setTranscript(data.data);
-    }, []),
+      // Servers that don't support cursors send the whole transcript.
+      if (!data.segments) {
+        setTranscript(data.data ?? "");
+        return;
+      }
+      if (data.since > cursor.current) {
+        // We missed some segments, so ask for everything after our cursor.
+        requestTranscript();
+        return;
+      }
+      // Skip any segments we already have.
+      const segments = data.segments.slice(cursor.current - data.since);
+      if (segments.length === 0) return;
+      cursor.current = data.next;
+      setTranscript((prev) =>
+        [prev, ...segments].filter(Boolean).join("\n\n"),
+      );
+    }, [requestTranscript]),
   );
 
   useTranscription({
@@ -40,13 +68,6 @@ export const Transcript = ({ roomUrl }) => {
     }, []),
   });
 
-  const requestTranscript = () => {
-    unhandledLines.current = 0;
-    daily.sendAppMessage({
-      "kind": "assist",
-      "task": "transcript",
-    }, "*");
-  };
   useEffect(() => {
     daily?.on("transcription-error", (ev) => {
       console.error("Transcription failed. Attempting to restart", ev)
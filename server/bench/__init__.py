@@ -0,0 +1,2 @@
+"""Offline benchmarks for the AI assistant server. Each module can be run
+directly, e.g. `python -m server.bench.memory_store`."""
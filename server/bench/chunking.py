@@ -0,0 +1,72 @@
+"""Benchmarks chunks per meeting for the token-based chunker against the
+previous textwrap-based one, which measured chunk size in characters.
+
+Run with `python -m server.bench.chunking`."""
+import argparse
+import random
+import statistics
+import textwrap
+import time
+
+from server.store.memory import _part_spec_token_count, chunk, count_tokens
+
+
+def legacy_chunk(input: str, target_chunk_size=500, prefix: str = "",
+                 model_name="gpt-4-1106-preview") -> list[str]:
+    """Chunks input the way memory.chunk used to."""
+    prefix_token_count = count_tokens(prefix, model_name=model_name)
+    chunks = textwrap.wrap(
+        input,
+        target_chunk_size -
+        prefix_token_count -
+        _part_spec_token_count(model_name))
+    if len(chunks) == 1:
+        return [f'{prefix}{chunks[0]}']
+    return [f'{prefix}[Part {i+1}/{len(chunks)}]: {c}'
+            for i, c in enumerate(chunks)]
+
+
+def synthetic_clean_transcript(minutes: int, seed: int = 0) -> str:
+    """Returns a cleaned-up transcript of roughly the given length,
+    at ~150 spoken words per minute."""
+    rng = random.Random(seed)
+    speakers = ["Alice", "Bob", "Carol", "Dmitri", "Eun-ji"]
+    words = ("the we should ship release customer budget roadmap design "
+             "review next week action item follow up owner timeline risk "
+             "metrics launch team plan agree decision question").split()
+    turns = []
+    remaining = minutes * 150
+    while remaining > 0:
+        sentences = []
+        for _ in range(rng.randint(1, 5)):
+            n = rng.randint(5, 20)
+            remaining -= n
+            sentence = " ".join(rng.choice(words) for _ in range(n))
+            sentences.append(sentence.capitalize() + rng.choice(".?!"))
+        turns.append(f"{rng.choice(speakers)}: {' '.join(sentences)}")
+    return "\n\n".join(turns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--minutes", type=int, nargs="+", default=[30, 60, 240])
+    parser.add_argument("--chunk_size", type=int, default=500)
+    args = parser.parse_args()
+
+    prefix = "[Timestamp 1700000000.0]: "
+    print(f"{'minutes':>7} {'chunker':>8} {'chunks':>7} {'mean tokens':>12} "
+          f"{'max tokens':>11} {'time (ms)':>10}")
+    for minutes in args.minutes:
+        text = synthetic_clean_transcript(minutes)
+        for name, fn in (("textwrap", legacy_chunk), ("tokens", chunk)):
+            start = time.perf_counter()
+            chunks = fn(text, target_chunk_size=args.chunk_size, prefix=prefix)
+            elapsed = (time.perf_counter() - start) * 1000
+            sizes = [count_tokens(c) for c in chunks]
+            print(f"{minutes:>7} {name:>8} {len(chunks):>7} "
+                  f"{statistics.mean(sizes):>12.0f} {max(sizes):>11} "
+                  f"{elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Compares transcript cleanup prompts built by the turn-merging prompt
+builder against the previous one-message-per-line prompts, on a replayed
+transcript split into short fragments the way live transcription
+delivers it.
+
+Run with `python -m server.bench.cleanup_prompt`."""
+import argparse
+import statistics
+from collections import deque
+from datetime import datetime
+
+from server.bench.replay import load_transcript, synthetic_transcript
+from server.llm.prompt import MESSAGE_OVERHEAD_TOKENS, RawContext, pop_batch, \
+    render_turns
+from server.store.memory import count_tokens
+
+
+def fragments(rows: list[dict], words: int, interval: float) -> list[RawContext]:
+    """Splits each transcript row into fragments of the given number of
+    words, received the given number of seconds apart."""
+    items = []
+    at = datetime(2024, 1, 1, 10).timestamp()
+    for row in rows:
+        row_words = row["text"].split()
+        for i in range(0, len(row_words), words):
+            items.append(RawContext(" ".join(row_words[i:i + words]), at,
+                                    row["speaker"], "voice"))
+            at += interval
+    return items
+
+
+def legacy_content(item: RawContext) -> str:
+    """Renders an item the way OpenAIAssistant used to."""
+    timestamp = datetime.fromtimestamp(item.received_at).strftime(
+        '%Y-%m-%d %H:%M:%S.%f')
+    return f"[Name: {item.speaker} | {item.source} | Sent at {timestamp}] {item.text}"
+
+
+def legacy_batches(items: list[RawContext], target: int) -> list[list[str]]:
+    """Batches items the way OpenAIAssistant used to: by rendered line
+    tokens, carrying on until a line with a period."""
+    ctx = deque(legacy_content(i) for i in items)
+    batches = []
+    while ctx:
+        batch = []
+        tokens = 0
+        while ctx and tokens < target:
+            batch.append(ctx.popleft())
+            tokens += count_tokens(batch[-1])
+        while ctx and tokens < 2 * target and "." not in batch[-1]:
+            batch.append(ctx.popleft())
+            tokens += count_tokens(batch[-1])
+        batches.append(batch)
+    return batches
+
+
+def new_batches(items: list[RawContext], target: int) -> list[list[str]]:
+    ctx = deque(items)
+    batches = []
+    while ctx:
+        batch, _ = pop_batch(ctx, target)
+        batches.append(render_turns(batch))
+    return batches
+
+
+def prompt_tokens(messages: list[str]) -> int:
+    return sum(count_tokens(m) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def report(name: str, batches: list[list[str]], lines: int) -> int:
+    tokens = [prompt_tokens(b) for b in batches]
+    print(f"{name:>8} {len(batches):>8} {statistics.mean(tokens):>12.0f} "
+          f"{lines / len(batches):>12.1f} {sum(tokens) / lines:>12.1f} "
+          f"{sum(tokens):>10}")
+    return sum(tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transcript", type=str, default=None,
+                        help="JSONL file of transcription lines to replay")
+    parser.add_argument("--lines", type=int, default=600,
+                        help="Lines of synthetic transcript")
+    parser.add_argument("--fragment_words", type=int, default=5,
+                        help="Words per transcription fragment")
+    parser.add_argument("--interval", type=float, default=0.8,
+                        help="Seconds between fragments")
+    parser.add_argument("--batch_tokens", type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = load_transcript(args.transcript) if args.transcript \
+        else synthetic_transcript(args.lines)
+    items = fragments(rows, args.fragment_words, args.interval)
+
+    print(f"{'prompt':>8} {'batches':>8} {'tokens/batch':>12} "
+          f"{'lines/batch':>12} {'tokens/line':>12} {'total':>10}")
+    legacy = report("legacy", legacy_batches(items, args.batch_tokens), len(items))
+    merged = report("merged", new_batches(items, args.batch_tokens), len(items))
+    print(f"prompt tokens per transcribed line reduced by {1 - merged / legacy:.0%}")
+
+
+if __name__ == "__main__":
+    main()
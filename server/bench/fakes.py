@@ -0,0 +1,270 @@
+"""Module providing deterministic local stand-ins for third-party services,
+for use in benchmarks and tests."""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import numpy
+
+
+class FakeEmbeddings:
+    """Stands in for the OpenAI embeddings API. Each input is embedded as a
+    bag of hashed words, so inputs sharing words are similar."""
+
+    def __init__(self, dims: int = 1536, latency: float = 0):
+        self.dims = dims
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, input, model: str = None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(input, str):
+            input = [input]
+        data = [SimpleNamespace(embedding=self.embed(i).tolist())
+                for i in input]
+        return SimpleNamespace(data=data)
+
+    def embed(self, text: str) -> numpy.ndarray:
+        """Returns the embedding vector for the given text."""
+        vec = numpy.zeros(self.dims, dtype=numpy.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+            vec[int.from_bytes(digest, "little") % self.dims] += 1
+        if not vec.any():
+            vec[0] = 1
+        return vec
+
+
+class FakeChatCompletions:
+    """Stands in for the OpenAI chat completions API. Answers with the text
+    of the user messages it was given."""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, model: str, messages: list, **kwargs):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = "\n".join(m["content"] for m in messages
+                            if m["role"] == "user")
+        choice = SimpleNamespace(
+            index=0, finish_reason="stop",
+            message=SimpleNamespace(role="assistant", content=content))
+        return SimpleNamespace(choices=[choice])
+
+
+class FakeOpenAI:
+    """Stands in for the OpenAI client."""
+
+    def __init__(self, dims: int = 1536, latency: float = 0):
+        self.embeddings = FakeEmbeddings(dims, latency)
+        self.chat = SimpleNamespace(completions=FakeChatCompletions(latency))
+
+
+class StubOpenAIServer:
+    """Serves a minimal, deterministic subset of the OpenAI HTTP API on
+    localhost: chat completions echo the last message, word by word if
+    streamed, and embeddings are computed by FakeEmbeddings."""
+
+    def __init__(self, dims: int = 1536, latency: float = 0, fail_first: int = 0):
+        self.embedder = FakeEmbeddings(dims)
+        self.latency = latency
+        self.fail_first = fail_first
+        self.invalid_keys = set()
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> StubOpenAIServer:
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, path: str, body: dict,
+               api_key: str = None) -> tuple[int, dict | list[dict]]:
+        """Returns the status code and response body for the given request.
+        Streamed responses are returned as a list of events."""
+        with self._lock:
+            self.requests += 1
+            if self.requests <= self.fail_first:
+                return 500, {"error": {"message": "stub failure"}}
+        if api_key in self.invalid_keys:
+            return 401, {"error": {"message": "Incorrect API key provided"}}
+        if self.latency:
+            time.sleep(self.latency)
+
+        if path.endswith("/chat/completions"):
+            content = body["messages"][-1]["content"]
+            if body.get("stream"):
+                return 200, self._stream_chunks(body, f"Echo: {content}")
+            return 200, {
+                "id": f"chatcmpl-{self.requests}",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": f"Echo: {content}"},
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        if path.endswith("/embeddings"):
+            inputs = body["input"]
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            return 200, {
+                "object": "list",
+                "model": body["model"],
+                "data": [{"object": "embedding", "index": i,
+                          "embedding": self.embedder.embed(text).tolist()}
+                         for i, text in enumerate(inputs)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        if path.endswith("/models"):
+            return 200, {"object": "list", "data": []}
+        return 404, {"error": {"message": f"Unknown path {path}"}}
+
+    def _stream_chunks(self, body: dict, answer: str) -> list[dict]:
+        words = answer.split(" ")
+        deltas = [{"content": w if i == 0 else f" {w}"}
+                  for i, w in enumerate(words)]
+        deltas[0]["role"] = "assistant"
+        chunks = [{"index": 0, "delta": d, "finish_reason": None}
+                  for d in deltas]
+        chunks.append({"index": 0, "delta": {}, "finish_reason": "stop"})
+        return [{
+            "id": f"chatcmpl-{self.requests}",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": body["model"],
+            "choices": [c],
+        } for c in chunks]
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                self._respond(*stub.handle(self.path, {}, self._api_key()))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                self._respond(*stub.handle(self.path, body, self._api_key()))
+
+            def _api_key(self) -> str | None:
+                auth = self.headers.get("Authorization", "")
+                return auth.removeprefix("Bearer ") or None
+
+            def _respond(self, code: int, body: dict | list[dict]):
+                content_type = "application/json"
+                if isinstance(body, list):
+                    content_type = "text/event-stream"
+                    events = [json.dumps(e) for e in body] + ["[DONE]"]
+                    data = "".join(f"data: {e}\n\n" for e in events).encode()
+                else:
+                    data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class FakeCallClient:
+    """Stands in for daily.CallClient. Joins immediately, with one remote
+    participant already present, and records the app messages it sends."""
+
+    def __init__(self, event_handler=None):
+        self.event_handler = event_handler
+        self.sent_messages = []
+        self._lock = threading.Lock()
+        self._participants = {
+            "local": {"id": "bot", "info": {"userName": "Daily AI Assistant"}},
+        }
+        self.add_participant("participant-0", "Participant 0")
+
+    def add_participant(self, participant_id: str, user_name: str) -> dict:
+        participant = {"id": participant_id, "info": {"userName": user_name}}
+        with self._lock:
+            self._participants[participant_id] = participant
+        return participant
+
+    def remove_participant(self, participant_id: str) -> dict:
+        with self._lock:
+            return self._participants.pop(participant_id)
+
+    def update_subscription_profiles(self, profiles):
+        pass
+
+    def join(self, url: str, token: str = None, completion=None):
+        if completion:
+            completion({"participants": {"local": {"id": "bot"}}}, None)
+
+    def set_user_name(self, user_name: str):
+        pass
+
+    def participants(self) -> dict:
+        with self._lock:
+            return dict(self._participants)
+
+    def participant_counts(self) -> dict:
+        with self._lock:
+            return {"present": len(self._participants), "hidden": 0}
+
+    def send_app_message(self, message, participant: str = None, completion=None):
+        with self._lock:
+            self.sent_messages.append((message, participant))
+        if completion:
+            completion(None)
+
+    def leave(self, completion=None):
+        if completion:
+            completion(None)
+
+    def release(self):
+        pass
+
+
+def install_fake_call_client():
+    """Makes sessions created in this process use FakeCallClient. Can be
+    used as a worker process initializer."""
+    from server.call import session
+    session.CallClient = FakeCallClient
@@ -0,0 +1,79 @@
+"""Benchmarks the transcription ingestion path, pushing messages through
+Session.on_transcription_message with a fake call client, and comparing
+the participant name cache against the previous per-line lookup.
+
+Run with `python -m server.bench.ingestion`."""
+import argparse
+import contextlib
+import io
+import time
+from datetime import datetime
+from unittest import mock
+
+from server.bench.fakes import FakeCallClient
+from server.call.loop import SessionLoop
+from server.call.session import Session
+from server.config import BotConfig
+
+
+def legacy_on_transcription_message(session: Session, message):
+    """Handles a transcription message the way Session used to: copying the
+    participant list and formatting the date and time for every line."""
+    try:
+        participant_id = message["participantId"]
+        participant = session._call_client.participants()[participant_id]
+        participant_user_name = participant["info"]["userName"]
+        user_name = f'Name: {participant_user_name}'
+    except Exception as e:
+        session._logger.error("Failed to get speaker's name: %s", e)
+        user_name = "Name: Unknown"
+    text = message["text"]
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+    metadata = [user_name, 'voice', f"Sent at {timestamp}"]
+    session._assistant.register_new_context(text, metadata)
+
+
+def run(handler, session: Session, messages: list[dict]) -> float:
+    """Returns how many messages per second the given handler processes."""
+    session._assistant._raw_context.clear()
+    start = time.perf_counter()
+    for message in messages:
+        handler(message)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--participants", type=int, nargs="+",
+                        default=[2, 50, 500])
+    parser.add_argument("--messages", type=int, default=50000)
+    args = parser.parse_args()
+
+    loop = SessionLoop()
+    loop.start()
+    print(f"{'participants':>12} {'legacy msg/s':>14} {'cached msg/s':>14} {'speedup':>8}")
+    with mock.patch("server.call.session.CallClient", FakeCallClient):
+        for n in args.participants:
+            with contextlib.redirect_stdout(io.StringIO()):
+                session = Session(BotConfig(
+                    "fake_key", None, f"https://example.daily.co/ingest-{n}"), loop)
+            call_client: FakeCallClient = session._call_client
+            for i in range(1, n):
+                participant = call_client.add_participant(
+                    f"participant-{i}", f"Participant {i}")
+                session.on_participant_joined(participant)
+            messages = [{"participantId": f"participant-{i % n}",
+                         "text": f"This is line {i} of the meeting."}
+                        for i in range(args.messages)]
+
+            legacy = run(lambda m: legacy_on_transcription_message(session, m),
+                         session, messages)
+            cached = run(session.on_transcription_message, session, messages)
+            print(f"{n:>12} {legacy:>14.0f} {cached:>14.0f} {cached / legacy:>7.1f}x")
+            with contextlib.redirect_stdout(io.StringIO()):
+                session.shutdown()
+    loop.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Benchmarks MemoryStore similarity ranking against the previous
+per-embedding Python loop.
+
+Run with `python -m server.bench.memory_store`."""
+import argparse
+import itertools
+import time
+
+import numpy
+
+from server.bench.fakes import FakeOpenAI
+from server.store.memory import MemoryStore, _normalize
+
+
+def legacy_rank(query: list[float], embeddings: list[list[float]]) -> list[int]:
+    """Ranks embeddings the way MemoryStore.gather_context used to: one
+    cosine similarity call per stored embedding, then a full sort."""
+    sims = []
+    for i, embedding in enumerate(embeddings):
+        sim = numpy.dot(query, embedding) / \
+            (numpy.linalg.norm(query) * numpy.linalg.norm(embedding))
+        sims.append((sim, i))
+    sims.sort(key=lambda x: x[0], reverse=True)
+    return [x[1] for x in sims]
+
+
+def vectorized_rank(store: MemoryStore, query: list[float], k: int) -> list[int]:
+    """Ranks the store's embeddings the way gather_context does now."""
+    q = _normalize(numpy.array(query, dtype=numpy.float32))
+    sims = store._embeddings[:store._size] @ q
+    return list(itertools.islice(store._rank(sims), k))
+
+
+def timed(fn, repeat: int) -> float:
+    """Returns the best wall-clock time of the given function in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1_000, 10_000, 100_000])
+    parser.add_argument("--dims", type=int, default=256,
+                        help="Embedding dimensions (ada-002 uses 1536)")
+    parser.add_argument("--k", type=int, default=64,
+                        help="Number of ranked results to consume")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(0)
+    print(f"{'chunks':>8} {'loop (ms)':>12} {'vectorized (ms)':>16} {'speedup':>8}")
+    for size in args.sizes:
+        vectors = rng.standard_normal((size, args.dims), dtype=numpy.float32)
+        query = rng.standard_normal(args.dims, dtype=numpy.float32).tolist()
+
+        store = MemoryStore(FakeOpenAI(args.dims))
+        store._reserve(size, args.dims)
+        store._embeddings[:size] = _normalize(vectors)
+        store._size = size
+
+        embeddings = vectors.tolist()
+        loop_ms = timed(lambda: legacy_rank(query, embeddings), args.repeat)
+        vec_ms = timed(lambda: vectorized_rank(store, query, args.k), args.repeat)
+        print(f"{size:>8} {loop_ms:>12.2f} {vec_ms:>16.3f} {loop_ms / vec_ms:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
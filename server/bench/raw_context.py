@@ -0,0 +1,79 @@
+"""Measures the memory taken by queued raw context, comparing the compact
+RawContext records against the previous pre-rendered message dicts.
+
+Run with `python -m server.bench.raw_context`."""
+import argparse
+import dataclasses
+import gc
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+from server.bench.replay import synthetic_transcript
+from server.llm.openai_assistant import OpenAIAssistant
+
+
+@dataclasses.dataclass
+class LegacyRawContext:
+    """RawContext as it used to be, holding a rendered message"""
+    message: dict
+    received_at: float
+    speaker: str | None = None
+
+
+def legacy_register(queue: deque, text: str, speaker: str):
+    """Queues a line the way OpenAIAssistant used to: rendering its
+    metadata up front."""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+    metadata = [f"Name: {speaker}", 'voice', f"Sent at {timestamp}"]
+    content = f"[{' | '.join(metadata)}] {text}"
+    name = None
+    for m in metadata:
+        if m.startswith("Name: "):
+            name = m[len("Name: "):]
+            break
+    queue.append(LegacyRawContext(
+        {"content": content, "role": "user"}, time.time(), name))
+
+
+def measure(fill) -> int:
+    """Returns how many bytes the objects created by fill stay allocated."""
+    gc.collect()
+    tracemalloc.start()
+    kept = fill()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=10_000)
+    args = parser.parse_args()
+
+    # Lines are generated while measuring, since each arrives as new
+    # strings from Daily and is only kept if the queue keeps it.
+    def fill_legacy():
+        queue = deque()
+        for row in synthetic_transcript(args.lines):
+            legacy_register(queue, row["text"], row["speaker"])
+        return queue
+
+    def fill_compact():
+        oai = OpenAIAssistant("fake_key")
+        for row in synthetic_transcript(args.lines):
+            oai.register_new_line(row["text"], row["speaker"], "voice",
+                                  time.time())
+        return oai
+
+    legacy = measure(fill_legacy)
+    compact = measure(fill_compact)
+    print(f"{'lines':>8} {'legacy (KB)':>12} {'compact (KB)':>13} {'saved':>7}")
+    print(f"{args.lines:>8} {legacy / 1024:>12.0f} {compact / 1024:>13.0f} "
+          f"{1 - compact / legacy:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
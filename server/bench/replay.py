@@ -0,0 +1,273 @@
+"""Replays recorded or synthetic transcription streams into sessions, using
+fake Daily call clients and a local stub OpenAI server with configurable
+latency, and reports end-to-end metrics: transcript lag, summary and query
+latency, memory per session, and thread count.
+
+Needs no network access, apart from tiktoken's encoding file, which can be
+provided ahead of time through TIKTOKEN_CACHE_DIR.
+
+Recorded transcripts are JSONL files with one transcription line per row,
+e.g. {"speaker": "Liza", "text": "Let's get started."}.
+
+Run with `python -m server.bench.replay`."""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import statistics
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from server.bench.fakes import FakeCallClient, StubOpenAIServer
+from server.bench.sessions import rss_mb
+from server.call.operator import Operator
+from server.call.session import Session
+from server.config import BotConfig, Capacity
+from server.llm import clients
+from server.llm.clients import ClientSettings
+
+
+class TimedCallClient(FakeCallClient):
+    """Fake call client which lets callers wait for the next app message
+    of a given kind sent to a given participant."""
+
+    def __init__(self, event_handler=None):
+        super().__init__(event_handler)
+        self._sent = threading.Condition(self._lock)
+
+    def send_app_message(self, message, participant: str = None, completion=None):
+        super().send_app_message(message, participant, completion)
+        with self._sent:
+            self._sent.notify_all()
+
+    def wait_for(self, kind: str, participant: str, after: int,
+                 timeout: float) -> int | None:
+        """Waits for a message of the given kind to the given participant
+        among messages sent after the given count. Returns the message
+        count at the time, or None on timeout."""
+        deadline = time.perf_counter() + timeout
+        with self._sent:
+            while True:
+                for msg, p in self.sent_messages[after:]:
+                    if msg.get("kind") == kind and p in (participant, None):
+                        return len(self.sent_messages)
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._sent.wait(remaining)
+
+
+def synthetic_transcript(lines: int) -> list[dict]:
+    """Returns a synthetic meeting, with a few speakers taking turns."""
+    speakers = ["Liza", "Tasha", "Ben", "Omar"]
+    topics = ["the budget", "the launch date", "hiring", "the roadmap",
+              "customer feedback", "the offsite"]
+    rows = []
+    for i in range(lines):
+        topic = topics[(i // 12) % len(topics)]
+        rows.append({
+            "speaker": speakers[(i // 3) % len(speakers)],
+            "text": f"About {topic}, point {i} is that we should follow up by Friday.",
+        })
+    return rows
+
+
+def load_transcript(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentiles(values: list[float]) -> tuple[float, float, float]:
+    """Returns the median, 95th percentile and maximum of the given values."""
+    if not values:
+        return 0, 0, 0
+    if len(values) == 1:
+        return values[0], values[0], values[0]
+    cuts = statistics.quantiles(values, n=20, method="inclusive")
+    return statistics.median(values), cuts[18], max(values)
+
+
+class Replay:
+    """Runs one replay and collects its measurements."""
+
+    def __init__(self, args: argparse.Namespace, rows: list[dict], log_dir: str):
+        self.args = args
+        self.rows = rows
+        self.log_dir = log_dir
+        self.lags: list[float] = []
+        self.summary_latencies: list[float] = []
+        self.query_latencies: list[float] = []
+        self.timeouts = 0
+        self._done = threading.Event()
+
+    def run(self) -> dict:
+        args = self.args
+        operator = Operator(Capacity(max_sessions=args.sessions,
+                                     max_transcript_backlog=1_000_000))
+        base_rss = rss_mb()
+        sessions = [self._start_session(operator, i)
+                    for i in range(args.sessions)]
+
+        sampler = threading.Thread(target=self._sample_lag, args=(sessions,))
+        sampler.start()
+        requesters = [threading.Thread(target=self._request, args=(s, i))
+                      for i, s in enumerate(sessions)]
+        for t in requesters:
+            t.start()
+
+        start = time.perf_counter()
+        self._feed(sessions)
+        fed = time.perf_counter()
+        drained = self._wait_for_drain(sessions)
+        self._done.set()
+        for t in requesters + [sampler]:
+            t.join()
+
+        result = {
+            "sessions": args.sessions,
+            "lines_per_session": len(self.rows),
+            "replay_seconds": fed - start,
+            "drain_seconds": drained - fed if drained else None,
+            "threads": threading.active_count(),
+            "rss_per_session_mb": (rss_mb() - base_rss) / args.sessions,
+            "request_timeouts": self.timeouts,
+        }
+        for name, values in [("transcript_lag_seconds", self.lags),
+                             ("summary_latency_seconds", self.summary_latencies),
+                             ("query_latency_seconds", self.query_latencies)]:
+            p50, p95, worst = percentiles(values)
+            result[name] = {"p50": p50, "p95": p95, "max": worst,
+                            "samples": len(values)}
+        operator.shutdown()
+        return result
+
+    def _start_session(self, operator: Operator, i: int) -> Session:
+        config = BotConfig("fake_key", None,
+                           f"https://example.daily.co/replay-{i}",
+                           log_dir_path=self.log_dir)
+        session = operator.create_session(config)
+        session._transcript_cleanup_interval = self.args.cleanup_interval
+        call_client: TimedCallClient = session._call_client
+        for speaker in {row["speaker"] for row in self.rows}:
+            call_client.add_participant(f"speaker-{speaker}", speaker)
+        session.start()
+        session.on_transcription_started({})
+        return session
+
+    def _feed(self, sessions: list[Session]):
+        """Sends every session the transcript, one line per session at a
+        time, at the configured rate."""
+        interval = 1 / self.args.rate
+        next_at = time.perf_counter()
+        for row in self.rows:
+            for session in sessions:
+                session.on_transcription_message({
+                    "participantId": f"speaker-{row['speaker']}",
+                    "text": row["text"],
+                })
+            next_at += interval
+            time.sleep(max(0, next_at - time.perf_counter()))
+
+    def _wait_for_drain(self, sessions: list[Session]) -> float | None:
+        """Waits until every session has cleaned up its whole transcript,
+        returning when that happened."""
+        deadline = time.perf_counter() + self.args.drain_timeout
+        while time.perf_counter() < deadline:
+            if all(s.transcript_backlog == 0 for s in sessions):
+                return time.perf_counter()
+            time.sleep(0.05)
+        return None
+
+    def _sample_lag(self, sessions: list[Session]):
+        while not self._done.wait(0.1):
+            for session in sessions:
+                self.lags.append(session._assistant.get_transcript_lag())
+
+    def _request(self, session: Session, index: int):
+        """Alternates summary and query requests from one participant
+        for the duration of the replay."""
+        call_client: TimedCallClient = session._call_client
+        for n in itertools.count():
+            if self._done.wait(self.args.request_interval):
+                return
+            if n % 2 == 0:
+                data, kind, latencies = {"kind": "assist", "task": "summary"}, \
+                    "ai-summary", self.summary_latencies
+            else:
+                data = {"kind": "assist", "task": "query",
+                        "query": f"What did we decide in request {index}-{n}?"}
+                kind, latencies = "ai-query", self.query_latencies
+            after = len(call_client.sent_messages)
+            start = time.perf_counter()
+            session.on_app_message(data, "participant-0")
+            if call_client.wait_for(kind, "participant-0", after,
+                                    self.args.request_timeout) is None:
+                self.timeouts += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+
+def print_report(result: dict):
+    print(f"sessions: {result['sessions']}, "
+          f"lines per session: {result['lines_per_session']}")
+    print(f"replay: {result['replay_seconds']:.1f}s, drain: "
+          + (f"{result['drain_seconds']:.1f}s" if result["drain_seconds"] is not None
+             else "timed out"))
+    print(f"threads: {result['threads']}, "
+          f"rss per session: {result['rss_per_session_mb']:.1f} MB, "
+          f"request timeouts: {result['request_timeouts']}")
+    print(f"{'metric':<26} {'p50':>8} {'p95':>8} {'max':>8} {'samples':>8}")
+    for name in ["transcript_lag_seconds", "summary_latency_seconds",
+                 "query_latency_seconds"]:
+        m = result[name]
+        print(f"{name:<26} {m['p50']:>8.3f} {m['p95']:>8.3f} "
+              f"{m['max']:>8.3f} {m['samples']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--transcript", type=str, default=None,
+                        help="JSONL file of transcription lines to replay")
+    parser.add_argument("--lines", type=int, default=600,
+                        help="Lines per session of synthetic transcript")
+    parser.add_argument("--rate", type=float, default=20,
+                        help="Transcription lines per second per session")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Stub OpenAI response latency in seconds")
+    parser.add_argument("--cleanup_interval", type=float, default=1,
+                        help="Seconds between transcript cleanups")
+    parser.add_argument("--request_interval", type=float, default=2,
+                        help="Seconds between assist requests per session")
+    parser.add_argument("--request_timeout", type=float, default=30)
+    parser.add_argument("--drain_timeout", type=float, default=60)
+    parser.add_argument("--json", action="store_true",
+                        help="Print results as JSON, e.g. to compare runs")
+    args = parser.parse_args()
+
+    rows = load_transcript(args.transcript) if args.transcript \
+        else synthetic_transcript(args.lines)
+
+    server = StubOpenAIServer(dims=1536, latency=args.latency).start()
+    clients.configure(ClientSettings(base_url=server.url, max_retries=0))
+    try:
+        with tempfile.TemporaryDirectory() as log_dir, \
+                mock.patch("server.call.session.CallClient", TimedCallClient):
+            # Keep the operator's per-session output out of the report.
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = Replay(args, rows, log_dir).run()
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
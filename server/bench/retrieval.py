@@ -0,0 +1,70 @@
+"""Benchmarks MemoryStore.gather_context latency for each retrieval mode,
+against a local stub OpenAI server with configurable embedding latency,
+for both new and repeated queries.
+
+Run with `python -m server.bench.retrieval`."""
+import argparse
+import asyncio
+import statistics
+import time
+
+from server.bench.fakes import StubOpenAIServer
+from server.bench.replay import synthetic_transcript
+from server.llm import clients
+from server.llm.clients import ClientSettings, SharedClient
+from server.store.memory import MemoryStore, Retrieval
+
+
+def user_msg(content: str) -> dict:
+    return {"role": "user", "content": content}
+
+
+async def fill(store: MemoryStore, chunks: int):
+    rows = synthetic_transcript(chunks)
+    for i in range(0, chunks, 100):
+        await store.add([user_msg(f"{r['speaker']}: {r['text']}")
+                         for r in rows[i:i + 100]])
+
+
+async def measure(store: MemoryStore, queries: list[str]) -> float:
+    """Returns the median latency of the given queries in milliseconds."""
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        await store.gather_context(user_msg(q), 4096)
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies) * 1000
+
+
+async def run(args: argparse.Namespace):
+    print(f"{'mode':>8} {'new query (ms)':>15} {'repeated (ms)':>14}")
+    for mode in Retrieval:
+        store = MemoryStore(SharedClient("bench_key"), retrieval=mode)
+        await fill(store, args.chunks)
+        new = [f"What did Ben say about point {i} and the budget?"
+               for i in range(args.queries)]
+        cold = await measure(store, new)
+        warm = await measure(store, new)
+        print(f"{mode.value:>8} {cold:>15.1f} {warm:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--dims", type=int, default=256,
+                        help="Embedding dimensions (ada-002 uses 1536)")
+    parser.add_argument("--latency", type=float, default=0.1,
+                        help="Stub OpenAI response latency in seconds")
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(dims=args.dims, latency=args.latency).start()
+    clients.configure(ClientSettings(base_url=server.url, max_retries=0))
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
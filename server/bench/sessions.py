@@ -0,0 +1,84 @@
+"""Benchmarks thread count and memory use for many concurrent sessions,
+using fake Daily call clients and a local stub OpenAI server.
+
+Run with `python -m server.bench.sessions`."""
+import argparse
+import contextlib
+import io
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from server.bench.fakes import FakeCallClient, StubOpenAIServer
+from server.call.operator import Operator
+from server.config import BotConfig
+from server.llm import clients
+from server.llm.clients import ClientSettings
+
+
+def rss_mb() -> float:
+    """Returns the resident set size of this process in MB."""
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+def run(num_sessions: int, lines_per_session: int, log_dir: str) -> tuple[int, float]:
+    """Starts the given number of sessions, feeds each some transcription
+    and returns the resulting thread count and memory growth."""
+    operator = Operator()
+    base_rss = rss_mb()
+    sessions = []
+    for i in range(num_sessions):
+        config = BotConfig("fake_key", None,
+                           f"https://example.daily.co/bench-{num_sessions}-{i}",
+                           log_dir_path=log_dir)
+        session = operator.create_session(config)
+        session.start()
+        session.on_transcription_started({})
+        sessions.append(session)
+
+    for session in sessions:
+        for j in range(lines_per_session):
+            session.on_transcription_message({
+                "participantId": "participant-0",
+                "text": f"This is line {j} of the meeting.",
+            })
+        session.on_app_message({"kind": "assist", "task": "transcript"},
+                               "participant-0")
+
+    # Give sessions a moment to run their first cleanup.
+    time.sleep(1)
+    threads = threading.active_count()
+    rss = rss_mb() - base_rss
+    operator.shutdown()
+    return threads, rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, nargs="+",
+                        default=[1, 10, 100])
+    parser.add_argument("--lines", type=int, default=50,
+                        help="Transcription lines per session")
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(dims=1536).start()
+    clients.configure(ClientSettings(base_url=server.url))
+
+    print(f"{'sessions':>8} {'threads':>8} {'rss delta (MB)':>15}")
+    with tempfile.TemporaryDirectory() as log_dir, \
+            mock.patch("server.call.session.CallClient", FakeCallClient):
+        for n in args.sessions:
+            # Keep the operator's per-session output out of the report.
+            with contextlib.redirect_stdout(io.StringIO()):
+                threads, rss = run(n, args.lines, log_dir)
+            print(f"{n:>8} {threads:>8} {rss:>15.1f}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmarks session throughput against the number of worker processes
+sessions are sharded over, using fake Daily call clients and an in-process
+fake OpenAI client in each worker.
+
+Each room replays a meeting's transcription, cleans it all up, and answers
+a few custom queries, which exercises tokenization, chunking and similarity
+search. Throughput can only scale up to the number of available CPUs.
+
+Run with `python -m server.bench.sharding`."""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from server.bench.fakes import FakeOpenAI, install_fake_call_client
+from server.call.operator import Operator
+from server.call.sharding import ShardedOperator
+from server.config import BotConfig
+
+
+def init_worker():
+    """Makes sessions in a worker process use fake Daily and OpenAI clients,
+    and keeps the worker's output out of the report."""
+    sys.stdout = open(os.devnull, "w", encoding="utf-8")
+    install_fake_call_client()
+    from server.llm import embeddings, openai_assistant
+    openai_assistant.SharedClient = lambda api_key: FakeOpenAI(dims=256)
+    # Stores embed through the process-wide batcher, which makes its own
+    # client.
+    embeddings.SharedClient = lambda api_key: FakeOpenAI(dims=256)
+
+
+def replay(operator: Operator, room_url: str, lines: int, queries: int) -> int:
+    """Replays a meeting in the given room, returning the length of the
+    resulting clean transcript. Runs in a worker process."""
+    session = operator.get_session_by_room(room_url)
+    for j in range(lines):
+        session.on_transcription_message({
+            "participantId": "participant-0",
+            "text": f"On topic {j % 37} we decided item {j} needs a follow-up by Friday.",
+        })
+    assistant = session._assistant
+
+    async def drain():
+        while assistant.get_transcript_backlog():
+            await assistant.cleanup_transcript()
+        for q in range(queries):
+            await assistant.query(f"What did we decide about topic {q}?")
+
+    session._loop.submit(drain()).result()
+    return len(assistant.get_clean_transcript())
+
+
+def run(num_workers: int, num_rooms: int, lines: int, queries: int,
+        log_dir: str) -> float:
+    """Replays a meeting in each room across the given number of workers,
+    returning rooms replayed per second."""
+    operator = ShardedOperator(num_workers, initializer=init_worker)
+    try:
+        rooms = [f"https://example.daily.co/shard-{num_workers}-{i}"
+                 for i in range(num_rooms)]
+        for room_url in rooms:
+            operator.start_session(BotConfig(
+                "fake_key", None, room_url, log_dir_path=log_dir))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=num_rooms) as pool:
+            list(pool.map(
+                lambda room_url: operator.call(
+                    operator.worker_for(room_url), replay,
+                    room_url, lines, queries),
+                rooms))
+        return num_rooms / (time.perf_counter() - start)
+    finally:
+        operator.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--rooms", type=int, default=16)
+    parser.add_argument("--lines", type=int, default=1000,
+                        help="Transcription lines per room")
+    parser.add_argument("--queries", type=int, default=20,
+                        help="Custom queries per room")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs available")
+    print(f"{'workers':>8} {'rooms/s':>10} {'speedup':>8}")
+    base = None
+    with tempfile.TemporaryDirectory() as log_dir:
+        for n in args.workers:
+            throughput = run(n, args.rooms, args.lines, args.queries, log_dir)
+            base = base or throughput
+            print(f"{n:>8} {throughput:>10.2f} {throughput / base:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Micro-benchmarks the token counting done on the MemoryStore hot paths:
+tokenizer lookup per count, and budget packing in gather_context.
+
+Run with `python -m server.bench.token_counts`."""
+import argparse
+import asyncio
+import time
+
+import tiktoken
+from openai.types.chat import ChatCompletionUserMessageParam
+
+from server.bench.fakes import FakeOpenAI
+from server.store.memory import MemoryStore, count_tokens
+
+
+def legacy_count_tokens(input: str, model_name="gpt-4-1106-preview") -> int:
+    """Counts tokens the way count_tokens used to, looking up the
+    tokenizer on every call."""
+    encoding = tiktoken.encoding_for_model(model_name)
+    return len(encoding.encode(input))
+
+
+def legacy_pack(store: MemoryStore, max_tokens: int) -> int:
+    """Packs every stored param into the budget the way gather_context
+    used to, re-tokenizing each candidate."""
+    remaining_tokens = max_tokens
+    packed = 0
+    for doc in store._params:
+        tokens_used = legacy_count_tokens(doc.get('content'))
+        if remaining_tokens - tokens_used < 0:
+            break
+        remaining_tokens -= tokens_used
+        packed += 1
+    return packed
+
+
+def timed(fn, repeat: int) -> float:
+    """Returns the best wall-clock time of the given function in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=2_000)
+    parser.add_argument("--max_tokens", type=int, default=120_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = "Alice: I think we should ship the release on Thursday. " * 40
+
+    n = 1000
+    legacy_ms = timed(lambda: [legacy_count_tokens(text)
+                      for _ in range(n)], args.repeat)
+    cached_ms = timed(lambda: [count_tokens(text)
+                      for _ in range(n)], args.repeat)
+    print(f"count_tokens x{n}: {legacy_ms:.1f} ms -> {cached_ms:.1f} ms")
+
+    store = MemoryStore(FakeOpenAI(dims=64))
+    asyncio.run(store.add([ChatCompletionUserMessageParam(role="user", content=text)
+                           for _ in range(args.chunks)]))
+    query = ChatCompletionUserMessageParam(role="user", content="release")
+    legacy_ms = timed(lambda: legacy_pack(store, args.max_tokens), args.repeat)
+    stored_ms = timed(lambda: asyncio.run(store.gather_context(
+        query, args.max_tokens)), args.repeat)
+    print(f"gather_context packing over {args.chunks} chunks: "
+          f"{legacy_ms:.1f} ms -> {stored_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
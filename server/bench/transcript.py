@@ -0,0 +1,76 @@
+"""Benchmarks appending to and reading the clean transcript over a
+simulated 4-hour meeting, comparing segment storage against the previous
+string concatenation. Both copy the whole text once per batch that is
+read; segments only do so when the text is read.
+
+Run with `python -m server.bench.transcript`."""
+import argparse
+import time
+from types import SimpleNamespace
+
+from server.llm.transcript import Transcript, TranscriptSegment
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hours", type=float, default=4)
+    parser.add_argument("--interval", type=float, default=15,
+                        help="Seconds between cleaned batches")
+    parser.add_argument("--batch_chars", type=int, default=2000,
+                        help="Characters per cleaned batch")
+    parser.add_argument("--reads_per_batch", type=int, default=1,
+                        help="Transcript reads per batch, e.g. client polls")
+    args = parser.parse_args()
+
+    batches = int(args.hours * 3600 / args.interval)
+    texts = [f"Speaker {i % 5}: " + "x" * args.batch_chars
+             for i in range(batches)]
+
+    # Both sides read the full text after each batch, the way
+    # get_clean_transcript() does. The string was an attribute of the
+    # assistant, so each append copied it.
+    start = time.perf_counter()
+    assistant = SimpleNamespace(clean_transcript="")
+    for text in texts:
+        assistant.clean_transcript += f"\n\n{text}"
+        for _ in range(args.reads_per_batch):
+            len(assistant.clean_transcript)
+    string_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    transcript = Transcript()
+    for i, text in enumerate(texts):
+        transcript.append(TranscriptSegment(
+            text=text, speakers=(f"Speaker {i % 5}",),
+            start_time=i * args.interval, end_time=(i + 1) * args.interval,
+            token_count=args.batch_chars // 4))
+        for _ in range(args.reads_per_batch):
+            len(transcript.text())
+    append_ms = (time.perf_counter() - start) * 1000
+
+    # Holding on to the text read does not change the cost.
+    start = time.perf_counter()
+    held = Transcript()
+    for i, text in enumerate(texts):
+        held.append(TranscriptSegment(
+            text=text, speakers=(f"Speaker {i % 5}",),
+            start_time=i * args.interval, end_time=(i + 1) * args.interval,
+            token_count=args.batch_chars // 4))
+        full = held.text()
+    held_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        transcript.window(max_tokens=4096)
+        transcript.window(start_time=3600, end_time=5400)
+    window_us = (time.perf_counter() - start) * 1000
+
+    print(f"{batches} batches, {len(full) / 1e6:.1f} MB of clean transcript")
+    print(f"{'string appends + full reads:':<37} {string_ms:10.1f} ms")
+    print(f"{'segment appends + text() reads:':<37} {append_ms:10.1f} ms")
+    print(f"{'segment appends + held text() reads:':<37} {held_ms:10.1f} ms")
+    print(f"{'window lookup (avg of 2000):':<37} {window_us / 2:10.3f} us")
+
+
+if __name__ == "__main__":
+    main()
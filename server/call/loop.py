@@ -0,0 +1,54 @@
+"""Module providing the event loop shared by all sessions in the process."""
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Callable, Coroutine
+
+
+class SessionLoop:
+    """Class running a single asyncio event loop on a dedicated thread.
+    Sessions run all of their async work (transcript cleanup, queries) as
+    tasks on this loop, and Daily callbacks hand work off to it."""
+
+    _loop: asyncio.AbstractEventLoop
+    _thread: threading.Thread
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name="session-loop", daemon=True)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Cancels all pending tasks and stops the loop."""
+        if not self._thread.is_alive():
+            return
+        self.submit(self._cancel_all()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """Schedules the given coroutine on the loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def call_soon(self, callback: Callable[..., Any], *args):
+        """Schedules the given callback on the loop from any thread."""
+        self._loop.call_soon_threadsafe(callback, *args)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _cancel_all(self):
+        tasks = [t for t in asyncio.all_tasks(self._loop)
+                 if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
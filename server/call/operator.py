@@ -2,67 +2,187 @@
 querying functionality to HTTP requesters."""
 import threading
 
-import polling2
-from server.config import BotConfig
+from server import metrics
+from server.config import BotConfig, Capacity
+from server.call.loop import SessionLoop
 from server.call.session import Session
+from server.llm.limiter import RunningTotal, llm_calls
+
+
+_active_sessions = metrics.gauge(
+    "operator_active_sessions", "Sessions currently running in this process")
+_rejected_sessions = metrics.counter(
+    "operator_rejected_sessions",
+    "Session requests rejected because the process was at capacity",
+    ("reason",))
+metrics.gauge(
+    "process_threads", "Threads running in this process").set_function(
+    threading.active_count)
+
+
+class CapacityError(Exception):
+    """Raised when a session is requested but the process is at capacity"""
+
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"At capacity: {reason}")
+
+    def __reduce__(self):
+        return CapacityError, (self.reason, self.retry_after)
 
 
 class Operator():
-    _sessions: list[Session]
+    # Active sessions, indexed by room URL and by session ID. Sessions
+    # remove themselves from both when they are destroyed.
+    _sessions_by_room: dict[str, Session]
+    _sessions_by_id: dict[str, Session]
+    # Rooms whose sessions are being created, outside the lock. Each
+    # event is set once the room's session is published, or creation fails.
+    _pending_rooms: dict[str, threading.Event]
     _is_shutting_down: bool
     _lock: threading.Lock
+    _loop: SessionLoop
+    _capacity: Capacity
+    # Transcription lines waiting to be cleaned up across all sessions,
+    # kept up to date by their assistants.
+    _backlog: RunningTotal
 
-    def __init__(self):
+    def __init__(self, capacity: Capacity = None):
         self._is_shutting_down = False
+        self._capacity = capacity or Capacity.from_env()
+        llm_calls.set_limit(self._capacity.max_concurrent_llm_calls)
         self._lock = threading.Lock()
-        self._sessions = []
+        self._sessions_by_room = {}
+        self._sessions_by_id = {}
+        self._pending_rooms = {}
+        self._backlog = RunningTotal()
+
+        # All sessions run their async work on this one loop.
+        self._loop = SessionLoop()
+        self._loop.start()
+
+    def create_session(self, bot_config: BotConfig) -> Session | None:
+        """Creates a session, which includes creating a Daily room.
+        Returns None if the room already has an active session, and
+        raises CapacityError if this process can't take on another one."""
+        room_url = bot_config.daily_room_url
+        with self._lock:
+            if self._is_shutting_down:
+                return None
+
+            # If an active session for given room URL already exists,
+            # don't create a new one
+            existing = self._sessions_by_room.get(room_url)
+            if room_url in self._pending_rooms or \
+                    (existing and not existing.is_destroyed):
+                print("found session:", room_url)
+                return None
+            self._check_capacity()
+            # Reserve the room, so that creating its session, which may
+            # load a store from disk, doesn't hold up other rooms.
+            created = threading.Event()
+            self._pending_rooms[room_url] = created
 
-        self._thread = threading.Thread(target=self.cleanup)
-        self._thread.start()
+        session = None
+        try:
+            # Daily's EventHandler does not accept keyword arguments,
+            # so these must be positional.
+            session = Session(bot_config, self._loop,
+                              self._on_session_destroyed, self._backlog)
+        finally:
+            with self._lock:
+                del self._pending_rooms[room_url]
+                if session and not self._is_shutting_down:
+                    self._sessions_by_room[room_url] = session
+                    self._sessions_by_id[session.session_id] = session
+                    _active_sessions.inc()
+                    published = True
+                else:
+                    published = False
+            created.set()
+        if not published:
+            # The operator shut down while the session was being created.
+            session.shutdown()
+            return None
+        return session
 
-    def create_session(self, bot_config: BotConfig) -> Session:
-        """Creates a session, which includes creating a Daily room."""
+    def start_session(self, bot_config: BotConfig) -> tuple[str | None, bool]:
+        """Creates and starts a session for the configured room, unless the
+        room already has one. Returns the room's session ID, and whether
+        the session was created by this call."""
+        session = self.create_session(bot_config)
+        if session:
+            session.start()
+            return session.session_id, True
+        room_url = bot_config.daily_room_url
+        with self._lock:
+            pending = self._pending_rooms.get(room_url)
+        if pending:
+            pending.wait()
+        session = self.get_session_by_room(room_url)
+        return (session.session_id if session else None), False
 
-        # If an active session for given room URL already exists,
-        # don't create a new one
+    def get_session(self, session_id: str) -> Session | None:
+        """Returns the active session with the given ID, if any."""
         with self._lock:
-            for s in self._sessions:
-                if s.room_url == bot_config.daily_room_url and not s.is_destroyed:
-                    print("found session:", s.room_url)
-                    return None
+            return self._sessions_by_id.get(session_id)
 
-        # Create a new session
-        session = Session(bot_config)
+    def get_session_by_room(self, room_url: str) -> Session | None:
+        """Returns the active session for the given room URL, if any."""
         with self._lock:
-            self._sessions.append(session)
-        return session
+            return self._sessions_by_room.get(room_url)
+
+    def sessions(self) -> list[Session]:
+        """Returns all active sessions."""
+        with self._lock:
+            return list(self._sessions_by_id.values())
+
+    def session_count(self) -> int:
+        with self._lock:
+            return len(self._sessions_by_id)
+
+    def collect_metrics(self) -> list[metrics.Family]:
+        return metrics.REGISTRY.collect()
 
     def shutdown(self):
         """Shuts down all active sessions"""
-        self._is_shutting_down = True
         with self._lock:
-            for session in self._sessions:
-                session.shutdown()
-        self._thread.join()
-
-    def cleanup(self):
-        """Periodically checks for destroyed sessions and removes them from the session list"""
-        polling2.poll(
-            target=self.remove_destroyed_sessions,
-            check_success=lambda done: done is True,
-            poll_forever=True,
-            step=5)
-
-    def remove_destroyed_sessions(self) -> bool:
-        """Removes destroyed sessions from the session list and deinitializes Daily
-        if all sessions are gone and the operator is shutting down."""
+            self._is_shutting_down = True
+            sessions = list(self._sessions_by_id.values())
+            pending = list(self._pending_rooms.values())
+        # Sessions deregister themselves as they shut down,
+        # so this must happen outside the lock.
+        for session in sessions:
+            session.shutdown()
+        # Sessions still being created shut themselves down once they
+        # are, and need the loop to do so.
+        for created in pending:
+            created.wait()
+        self._loop.stop()
+
+    def _check_capacity(self):
+        """Raises CapacityError if another session would overload this
+        process. Must be called with the lock held."""
+        capacity = self._capacity
+        sessions = len(self._sessions_by_id) + len(self._pending_rooms)
+        if sessions >= capacity.max_sessions:
+            _rejected_sessions.labels(reason="sessions").inc()
+            raise CapacityError(
+                f"{sessions} sessions running",
+                capacity.retry_after)
+        backlog = self._backlog.value
+        if backlog >= capacity.max_transcript_backlog:
+            _rejected_sessions.labels(reason="backlog").inc()
+            raise CapacityError(
+                f"{backlog} transcription lines waiting to be cleaned up",
+                capacity.retry_after)
+
+    def _on_session_destroyed(self, session: Session):
+        """Removes the given destroyed session from the registry."""
+        print("Removing destroyed session:", session.room_url)
         with self._lock:
-            if self._is_shutting_down and len(self._sessions) == 0:
-                return True
-
-            # Check each session to see if it's been destroyed.
-            for session in self._sessions:
-                if session.is_destroyed:
-                    print("Removing destroyed session:", session.room_url)
-                    self._sessions.remove(session)
-            return False
+            if self._sessions_by_id.pop(session.session_id, None):
+                _active_sessions.dec()
+            if self._sessions_by_room.get(session.room_url) is session:
+                del self._sessions_by_room[session.room_url]
@@ -5,24 +5,42 @@ import asyncio
 import atexit
 
 import dataclasses
+import functools
 import json
 import logging
 import os.path
 import sys
 import threading
 import time
-from threading import Thread
+import uuid
+from concurrent.futures import Future as ConcurrentFuture
 from asyncio import Future
-from datetime import datetime
 from logging import Handler, Logger
-from typing import Mapping, Any
+from typing import Mapping, Any, Callable
 from urllib.parse import urlparse
 
 from daily import Daily, EventHandler, CallClient
 
+from server import metrics
+from server.call.loop import SessionLoop
 from server.config import BotConfig, get_headless_config
 from server.llm.openai_assistant import OpenAIAssistant
 from server.llm.assistant import Assistant, NoContextError
+from server.llm.limiter import RunningTotal
+
+
+_assist_request_seconds = metrics.histogram(
+    "session_assist_request_seconds",
+    "Time taken to answer summary and query requests, including coalesced waits",
+    ("task",))
+_transcript_backlog = metrics.gauge(
+    "session_transcript_backlog",
+    "Transcription lines waiting to be cleaned up, per session",
+    ("session_id", "room_url"))
+_transcript_lag = metrics.gauge(
+    "session_transcript_lag_seconds",
+    "How long the oldest transcription line waiting to be cleaned up has waited, per session",
+    ("session_id", "room_url"))
 
 
 @dataclasses.dataclass
@@ -34,10 +52,17 @@ class Room:
 
 
 @dataclasses.dataclass
-class Summary:
-    """Class representing a Daily meeting summary"""
-    content: str
-    retrieved_at: time.time()
+class AssistRequest:
+    """Class representing an assist request being answered, along with
+    everyone waiting on the answer"""
+    task: str
+    # Maps each recipient (None for a broadcast) to the ID its answer is
+    # streamed under, or to None if it did not ask for a streamed answer.
+    recipients: dict[str | None, str | None]
+    # Number of partial answers sent so far, and answer text not sent yet.
+    seq: int = 0
+    buffered: str = ""
+    flushed_at: float = 0
 
 
 class Session(EventHandler):
@@ -45,14 +70,29 @@ class Session(EventHandler):
 
     _config: BotConfig
     _assistant: Assistant
-    _summary: Summary | None
-    _session_thread: Thread
-    _transcript_thread: Thread
+    _loop: SessionLoop
+    _transcript_task: ConcurrentFuture | None
+    # In-flight assist requests, keyed by task and normalized query.
+    _pending_requests: dict[tuple[str, str | None], AssistRequest]
+    # Minimum seconds between partial answers sent for a streamed request.
+    _stream_interval: float = 0.1
+    # Participants to push new transcript segments to, and how many
+    # segments have been pushed so far.
+    _transcript_subscribers: set[str]
+    _pushed_segments: int
+    # User names of participants, keyed by participant ID, kept up to date
+    # from participant events so transcription lines don't need to look
+    # up the whole participant list.
+    _participant_names: dict[str, str]
+    _transcript_cleanup_interval: float = 15
 
     # Logging
     _logger: Logger
     _log_handler: Handler
 
+    # Identifies this session to HTTP requesters.
+    _session_id: str
+
     # Daily-related properties
     _id: str | None
     _call_client: CallClient | None
@@ -62,14 +102,26 @@ class Session(EventHandler):
     _is_destroyed: bool
     _is_shutting_down: bool
     _shutdown_timer: threading.Timer | None = None
+    _shutdown_lock: threading.Lock
+    _on_destroy: Callable[[Session], None] | None
 
-    def __init__(self, config: BotConfig):
+    def __init__(self, config: BotConfig, loop: SessionLoop,
+                 on_destroy: Callable[[Session], None] = None,
+                 backlog: RunningTotal = None):
         super().__init__()
         self._is_destroyed = False
         self._is_shutting_down = False
+        self._shutdown_lock = threading.Lock()
+        self._on_destroy = on_destroy
         self._config = config
-        self._summary = None
+        self._loop = loop
+        self._session_id = uuid.uuid4().hex
         self._id = None
+        self._transcript_task = None
+        self._pending_requests = {}
+        self._transcript_subscribers = set()
+        self._pushed_segments = 0
+        self._participant_names = {}
 
         self._room = self._get_room_config(self._config.daily_room_url)
         self._logger = logging.getLogger(self._room.name)
@@ -88,16 +140,30 @@ class Session(EventHandler):
         self._assistant = OpenAIAssistant(
             config.openai_api_key,
             config.openai_model_name,
-            self._logger)
+            self._logger,
+            config.get_store_dir_path(self._room.url),
+            retrieval=config.retrieval,
+            backlog=backlog)
+        # Read only when metrics are collected, so these cost nothing
+        # on the transcription path.
+        # Labelled by session, since rooms on different Daily domains
+        # can share a name.
+        _transcript_backlog.labels(**self._metric_labels()).set_function(
+            self._assistant.get_transcript_backlog)
+        _transcript_lag.labels(**self._metric_labels()).set_function(
+            self._assistant.get_transcript_lag)
 
-        self._session_thread = threading.Thread(target=self._run)
-        self._transcript_thread = threading.Thread(
-            target=self._start_transcript_polling, daemon=True)
         self._logger.info("Initialized session %s", self._room.name)
 
     def start(self):
-        # Start running the thread
-        self._session_thread.start()
+        """Joins the associated Daily room. Transcription and context
+        registration begin once the bot has joined."""
+        room = self._room
+        self._logger.info("Joining Daily room %s", room.url)
+        self._call_client.join(
+            room.url,
+            room.token,
+            completion=self.on_joined_meeting)
 
     @property
     def room_url(self) -> str:
@@ -107,10 +173,22 @@ class Session(EventHandler):
     def id(self) -> str:
         return self._id
 
+    @property
+    def session_id(self) -> str:
+        return self._session_id
+
     @property
     def is_destroyed(self) -> bool:
         return self._is_destroyed
 
+    @property
+    def transcript_backlog(self) -> int:
+        return self._assistant.get_transcript_backlog()
+
+    def _metric_labels(self) -> dict[str, str]:
+        return {"session_id": self._session_id,
+                "room_url": self._config.daily_room_url}
+
     def _get_room_config(self, room_url: str = None) -> Room:
         """Creates a Daily room and uses it to start a session"""
         parsed_url = urlparse(room_url)
@@ -119,65 +197,46 @@ class Session(EventHandler):
         room = Room(url=room_url, name=room_name, token=token)
         return room
 
-    def _run(self):
-        """Waits for at least one person to join the associated Daily room,
-        then joins, starts transcription, and begins registering context."""
-        room = self._room
-        self._logger.info("Joining Daily room %s", room.url)
-        self._call_client.join(
-            room.url,
-            room.token,
-            completion=self.on_joined_meeting)
-        while not self._is_shutting_down:
-            time.sleep(1)
-
     async def _generate_clean_transcript(self) -> bool:
         """Generates a clean transcript from the raw context."""
         if self._is_shutting_down:
             return False
         try:
             await self._assistant.cleanup_transcript()
+            # If we're falling behind, keep cleaning up instead of
+            # waiting for the next interval.
+            while not self._is_shutting_down and \
+                    self._assistant.get_transcript_lag() > self._transcript_cleanup_interval:
+                await self._assistant.cleanup_transcript()
         except Exception as e:
             self._logger.warning(
                 "Failed to generate clean transcript: %s", e)
+        self._push_transcript_segments()
+        self._logger.info(
+            "Transcript backlog: %s items, lag: %.1fs",
+            self._assistant.get_transcript_backlog(),
+            self._assistant.get_transcript_lag())
         return True
 
-    async def _query_assistant(self, custom_query: str = None) -> Future[str]:
+    async def _query_assistant(self, custom_query: str = None,
+                               on_delta: Callable[[str], None] = None) -> Future[str]:
         """Queries the configured assistant with either the given query, or the
         configured assistant's default"""
 
-        want_cached_summary = not bool(custom_query)
-        answer = None
-
-        # If we want a generic summary, and we have a cached one that's less than 15 seconds old,
-        # just return that.
-        if want_cached_summary and self._summary:
-            seconds_since_generation = time.time() - self._summary.retrieved_at
-            if seconds_since_generation < 15:
-                self._logger.info("Returning cached summary")
-                answer = self._summary.content
-
-        # If we don't have a cached summary, or it's too old, query the
-        # assistant.
-        if not answer:
-            self._logger.info("Querying assistant")
-            try:
-                answer = await self._assistant.query(custom_query)
-                # If there was no custom query provided, save this as cached
-                # summary.
-                if want_cached_summary:
-                    self._logger.info("Saving general summary")
-                    self._summary = Summary(
-                        content=answer, retrieved_at=time.time())
-            except NoContextError:
-                answer = (
-                    "I don't have any context saved yet. Please speak to add some context or "
-                    "confirm that transcription is enabled.")
-            except Exception as e:
-                self._logger.error(
-                    "Failed to query assistant: %s", e)
-                answer = (
-                    "Something went wrong while generating the summary. Please check the server logs.")
+        # The assistant caches answers for as long as the context they
+        # were generated from stays the same.
+        self._logger.info("Querying assistant")
+        try:
+            answer = await self._assistant.query(custom_query, on_delta)
+        except NoContextError:
+            answer = (
+                "I don't have any context saved yet. Please speak to add some context or "
+                "confirm that transcription is enabled.")
+        except Exception as e:
+            self._logger.error(
+                "Failed to query assistant: %s", e)
+            answer = (
+                "Something went wrong while generating the summary. Please check the server logs.")
 
         return answer
 
@@ -199,6 +258,16 @@ class Session(EventHandler):
         if kind != "assist":
             return
 
+        # Hand the request off to the session loop, so that the Daily
+        # callback thread isn't blocked while the assistant works.
+        self._loop.submit(self._handle_assist_message(data, sender))
+
+    async def _handle_assist_message(self, data: Mapping[str, Any], sender: str):
+        """Answers the given assist request and sends the answer back.
+        Identical summary and query requests that arrive while one is being
+        answered share its answer, instead of querying the assistant again.
+        Requesters that ask for a streamed answer get partial answers as
+        they are generated, followed by the full answer."""
         query = data.get("query")
 
         recipient = sender
@@ -209,31 +278,145 @@ class Session(EventHandler):
 
         task = data.get("task")
 
+        # Clients that track a transcript cursor only get the segments
+        # they don't have yet.
+        if task == "transcript" and data.get("since") is not None:
+            self._send_transcript_segments(data, recipient)
+            return
+
+        stream_id = None
+        if bool(data.get("stream")):
+            stream_id = str(data.get("id") or uuid.uuid4())
+
+        key = None
+        if task == "summary" or task == "query":
+            key = (task, " ".join(query.split()).lower() if query else None)
+            pending = self._pending_requests.get(key)
+            if pending:
+                self._logger.info("Coalescing %s request", task)
+                pending.recipients[recipient] = stream_id
+                return
+        request = AssistRequest(task, {recipient: stream_id})
+        if key:
+            self._pending_requests[key] = request
+
         answer: str = None
         error: str = None
+        start = time.perf_counter()
         try:
             if task == "summary" or task == "query":
-                answer = asyncio.run(self._query_assistant(query))
+                on_delta = functools.partial(self._stream_delta, request) \
+                    if stream_id else None
+                answer = await self._query_assistant(query, on_delta)
+                self._flush_stream(request)
             elif task == "transcript":
                 answer = self._assistant.get_clean_transcript()
         except Exception as e:
             self._logger.error("Failed to query assistant: %s", e)
             error = "Sorry! I ran into an error. Please try again."
 
-        msg_data = {
-            "kind": f"ai-{task}",
-        }
+        if key:
+            self._pending_requests.pop(key)
+            _assist_request_seconds.labels(task=task).observe(
+                time.perf_counter() - start)
 
-        if answer:
-            msg_data["data"] = answer
+        for r, stream_id in self._answer_recipients(request).items():
+            msg_data = {
+                "kind": f"ai-{task}",
+            }
 
-        if error:
-            msg_data["error"] = error
+            if answer:
+                msg_data["data"] = answer
+
+            if error:
+                msg_data["error"] = error
+
+            # The full answer also completes the stream, for clients
+            # that were assembling it.
+            if stream_id:
+                msg_data["id"] = stream_id
+                msg_data["seq"] = request.seq
+            self._call_client.send_app_message(
+                msg_data,
+                participant=r,
+                completion=self.on_app_message_sent)
+
+    def _answer_recipients(self, request: AssistRequest) -> dict[str | None, str | None]:
+        """Returns who to send answers to the given request to."""
+        # A broadcast reaches everyone, so there's no need to also
+        # answer individual requesters.
+        if None in request.recipients:
+            return {None: request.recipients[None]}
+        return request.recipients
+
+    def _stream_delta(self, request: AssistRequest, delta: str):
+        """Buffers the given piece of a streamed answer, sending what has been
+        buffered if enough time has passed since the last partial answer."""
+        request.buffered += delta
+        if time.monotonic() - request.flushed_at >= self._stream_interval:
+            self._flush_stream(request)
+
+    def _flush_stream(self, request: AssistRequest):
+        """Sends any buffered part of the answer to the given request to
+        everyone who asked for a streamed answer."""
+        if not request.buffered:
+            return
+        for r, stream_id in self._answer_recipients(request).items():
+            if not stream_id:
+                continue
+            self._call_client.send_app_message(
+                {
+                    "kind": f"ai-{request.task}-delta",
+                    "id": stream_id,
+                    "seq": request.seq,
+                    "delta": request.buffered,
+                },
+                participant=r,
+                completion=self.on_app_message_sent)
+        request.seq += 1
+        request.buffered = ""
+        request.flushed_at = time.monotonic()
+
+    def _send_transcript_segments(self, data: Mapping[str, Any], recipient: str | None):
+        """Sends the transcript segments following the requested cursor,
+        and subscribes the requester to new segments if asked to."""
+        try:
+            since = max(int(data.get("since")), 0)
+        except (TypeError, ValueError):
+            since = 0
+        segments = self._assistant.get_transcript_segments(since)
+        if recipient and bool(data.get("subscribe")):
+            self._transcript_subscribers.add(recipient)
         self._call_client.send_app_message(
-            msg_data,
+            {
+                "kind": "ai-transcript",
+                "segments": segments,
+                "since": since,
+                "next": since + len(segments),
+            },
             participant=recipient,
             completion=self.on_app_message_sent)
 
+    def _push_transcript_segments(self):
+        """Pushes segments cleaned up since the last push to subscribers."""
+        segments = self._assistant.get_transcript_segments(
+            self._pushed_segments)
+        if not segments:
+            return
+        since = self._pushed_segments
+        self._pushed_segments += len(segments)
+        msg_data = {
+            "kind": "ai-transcript",
+            "segments": segments,
+            "since": since,
+            "next": self._pushed_segments,
+        }
+        for subscriber in self._transcript_subscribers:
+            self._call_client.send_app_message(
+                msg_data,
+                participant=subscriber,
+                completion=self.on_app_message_sent)
+
     def on_left_meeting(self, error: str = None):
         """Cancels any ongoing shutdown timer and marks this session as destroyed"""
         if error:
@@ -275,16 +458,18 @@ class Session(EventHandler):
             await asyncio.sleep(interval)
 
     def _start_transcript_polling(self):
-        """Starts an asyncio event loop and schedules generate_clean_transcript to run every 15 seconds."""
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(
+        """Schedules generate_clean_transcript to run every
+        _transcript_cleanup_interval seconds on the session loop."""
+        if self._transcript_task:
+            return
+        self._transcript_task = self._loop.submit(
             self._poll_async_func(
-                self._generate_clean_transcript, 15))
+                self._generate_clean_transcript,
+                self._transcript_cleanup_interval))
 
     def on_transcription_started(self, status):
         self._logger.info("Transcription started: %s", status)
-        self._transcript_thread.start()
+        self._start_transcript_polling()
 
     def on_transcription_stopped(self, stopped_by: str, stopped_by_error: str):
         self._logger.info(
@@ -298,29 +483,53 @@ class Session(EventHandler):
 
     def on_transcription_message(self, message):
         """Callback invoked when a transcription message is received."""
+        participant_user_name = self._get_participant_name(
+            message.get("participantId"))
+        if participant_user_name is None:
+            participant_user_name = "Unknown"
+        self._assistant.register_new_line(
+            message["text"], participant_user_name, "voice", time.time())
+
+    def _get_participant_name(self, participant_id: str) -> str | None:
+        """Returns the user name of the given participant, looking it up
+        from the call client only if it isn't cached yet."""
+        name = self._participant_names.get(participant_id)
+        if name is not None:
+            return name
         try:
-            participant_id = message["participantId"]
             participant = self._call_client.participants()[participant_id]
-            participant_user_name = participant["info"]["userName"]
-            user_name = f'Name: {participant_user_name}'
+            name = participant["info"]["userName"]
         except Exception as e:
             self._logger.error("Failed to get speaker's name: %s", e)
-            user_name = "Name: Unknown"
-        text = message["text"]
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
-        metadata = [user_name, 'voice', f"Sent at {timestamp}"]
-        self._assistant.register_new_context(text, metadata)
+            return None
+        self._participant_names[participant_id] = name
+        return name
+
+    def _cache_participant_name(self, participant: Mapping[str, Any]):
+        """Caches the user name of the given participant, if it has one."""
+        name = participant.get("info", {}).get("userName")
+        if name is not None:
+            self._participant_names[participant["id"]] = name
 
     def on_participant_joined(self, participant):
+        self._cache_participant_name(participant)
         # As soon as someone joins, stop shutdown process if one is in progress
         if self._shutdown_timer:
             self._logger.info("Participant joined - cancelling shutdown.")
             self.cancel_shutdown_timer()
 
+    def on_participant_updated(self, participant):
+        """Callback invoked when a participant's details, such as their
+        user name, change."""
+        self._cache_participant_name(participant)
+
     def on_participant_left(self,
                             participant,
                             reason):
         """Callback invoked when a participant leaves the Daily room."""
+        self._participant_names.pop(participant["id"], None)
+        self._loop.call_soon(
+            self._transcript_subscribers.discard, participant["id"])
         self.maybe_start_shutdown()
 
     def on_call_state_updated(self, state: Mapping[str, Any]) -> None:
@@ -355,7 +564,12 @@ class Session(EventHandler):
     def shutdown(self):
         """Shuts down the session, leaving the Daily room, invoking the shutdown callback,
         and cancelling any pending Futures"""
-        self._is_shutting_down = True
+        # The shutdown timer and the operator may both try to shut down
+        # the session; only the first one does.
+        with self._shutdown_lock:
+            if self._is_shutting_down:
+                return
+            self._is_shutting_down = True
 
         self._logger.info(
             f"Session {self._id} shutting down. Active threads: %s",
@@ -365,13 +579,12 @@ class Session(EventHandler):
         self._call_client.leave(self.on_left_meeting)
         self._call_client.release()
 
-        self._session_thread.join()
-        try:
-            self._transcript_thread.join()
-        except Exception as e:
-            self._logger.warning("Failed to join transcript thread: %s", e)
+        if self._transcript_task:
+            self._transcript_task.cancel()
 
         self._assistant.destroy()
+        _transcript_backlog.remove(**self._metric_labels())
+        _transcript_lag.remove(**self._metric_labels())
 
         self._logger.info(
             f"Session {self._id} completely shut down. Active threads: %s",
@@ -380,6 +593,8 @@ class Session(EventHandler):
         self._logger.removeHandler(self._log_handler)
 
         self._is_destroyed = True
+        if self._on_destroy:
+            self._on_destroy(self)
 
     def cancel_shutdown_timer(self):
         """Cancels the live shutdown timer"""
@@ -408,6 +623,8 @@ class Session(EventHandler):
 
 
 def bot_cleanup(session: Session):
+    if session.is_destroyed:
+        return
     session.shutdown()
     while not session.is_destroyed:
         print("Waiting for bot to leave the call")
@@ -419,10 +636,19 @@ def main():
 
     Daily.init()
 
-    session = Session(config)
+    loop = SessionLoop()
+    loop.start()
+
+    session = Session(config, loop)
     atexit.register(bot_cleanup, session)
     session.start()
 
+    # Keep running until the session shuts itself down,
+    # e.g. because everyone left the call.
+    while not session.is_destroyed:
+        time.sleep(1)
+
+    loop.stop()
     Daily.deinit()
 
 
@@ -0,0 +1,222 @@
+"""Module which spreads sessions over several worker processes, each with
+its own Operator, so that CPU work for different rooms does not compete
+for one interpreter lock."""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import multiprocessing
+import threading
+from multiprocessing.connection import Connection
+from typing import Any, Callable
+
+from daily import Daily
+
+from server import metrics
+from server.config import BotConfig
+from server.call.operator import Operator
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to nodes. Each node is placed on the
+    ring many times, so that keys spread evenly and adding or removing a
+    node only moves the keys nearest to it."""
+
+    _hashes: list[int]
+    _nodes: list[int]
+
+    def __init__(self, nodes: list[int], replicas: int = 128):
+        points = sorted((self._hash(f"{node}:{i}"), node)
+                        for node in nodes for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def node_for(self, key: str) -> int:
+        """Returns the node which owns the given key."""
+        if not self._nodes:
+            raise Exception("Hash ring has no nodes")
+        i = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(
+            hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class WorkerError(Exception):
+    """Raised when a worker process fails to run a call, or dies"""
+
+
+_worker_restarts = metrics.counter(
+    "sharding_worker_restarts",
+    "Session worker processes restarted after dying", ("worker",))
+
+
+class ShardedOperator:
+    """Runs sessions in several worker processes. Each room is always routed
+    to the same worker, by consistent hashing of its URL, so each worker's
+    Operator detects duplicate sessions for its own rooms.
+
+    If a worker dies, calls in flight fail with WorkerError, its sessions
+    are lost, and it is restarted for the next call, so its rooms can get
+    new sessions."""
+
+    _workers: list[multiprocessing.Process]
+    _conns: list[Connection]
+    # Guards each worker's process and connection, so that calls don't
+    # interleave with each other or with restarts.
+    _locks: list[threading.Lock]
+    _ring: HashRing
+    _initializer: Callable[[], None] | None
+
+    def __init__(self, num_workers: int,
+                 initializer: Callable[[], None] = None):
+        # Spawn rather than fork, since forking a process with running
+        # threads (or an initialized Daily) is not safe.
+        self._ctx = multiprocessing.get_context("spawn")
+        self._initializer = initializer
+        self._workers = [None] * num_workers
+        self._conns = [None] * num_workers
+        self._locks = [threading.Lock() for _ in range(num_workers)]
+        for i in range(num_workers):
+            self._start_worker(i)
+        self._ring = HashRing(list(range(num_workers)))
+
+    @property
+    def num_workers(self) -> int:
+        return len(self._workers)
+
+    def worker_for(self, room_url: str) -> int:
+        """Returns the index of the worker which owns the given room."""
+        return self._ring.node_for(room_url)
+
+    def start_session(self, bot_config: BotConfig) -> tuple[str | None, bool]:
+        """Starts a session for the configured room on the worker which owns
+        the room, unless the room already has one. Returns the room's
+        session ID, and whether the session was created by this call."""
+        worker = self.worker_for(bot_config.daily_room_url)
+        return self.call(worker, _start_session, bot_config)
+
+    def session_count(self) -> int:
+        """Returns how many sessions run across all workers. Workers that
+        fail to answer are counted as having none."""
+        count = 0
+        for i in range(self.num_workers):
+            try:
+                count += self.call(i, _session_count)
+            except WorkerError as e:
+                print(f"Failed to count sessions of worker {i}: {e}")
+        return count
+
+    def collect_metrics(self) -> list[metrics.Family]:
+        """Returns this process's metrics along with every worker's,
+        labelled with the worker they came from. Workers that fail to
+        answer are left out."""
+        families = metrics.REGISTRY.collect()
+        for i in range(self.num_workers):
+            try:
+                worker_families = self.call(i, _collect_metrics)
+            except WorkerError as e:
+                print(f"Failed to collect metrics of worker {i}: {e}")
+                continue
+            families = metrics.merge(
+                families, worker_families, {"worker": str(i)})
+        return families
+
+    def call(self, worker: int, fn: Callable[..., Any], *args) -> Any:
+        """Runs fn(operator, *args) in the given worker and returns the result,
+        or raises the error it raised. The function and arguments must be
+        picklable. Raises WorkerError if the worker dies."""
+        with self._locks[worker]:
+            if not self._workers[worker].is_alive():
+                self._restart_worker(worker)
+            try:
+                self._conns[worker].send((fn, args))
+                ok, res = self._conns[worker].recv()
+            except (EOFError, OSError) as e:
+                self._restart_worker(worker)
+                raise WorkerError(
+                    f"Worker {worker} died during call: {e!r}") from e
+        if not ok:
+            raise res
+        return res
+
+    def _start_worker(self, worker: int):
+        conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_run_worker, args=(child_conn, self._initializer),
+            name=f"session-worker-{worker}", daemon=True)
+        process.start()
+        child_conn.close()
+        self._workers[worker] = process
+        self._conns[worker] = conn
+
+    def _restart_worker(self, worker: int):
+        """Replaces the given dead or broken worker with a new one. Must be
+        called with the worker's lock held."""
+        print(f"Restarting session worker {worker}")
+        _worker_restarts.labels(worker=str(worker)).inc()
+        process = self._workers[worker]
+        if process.is_alive():
+            process.terminate()
+        process.join(1)
+        self._conns[worker].close()
+        self._start_worker(worker)
+
+    def shutdown(self):
+        """Shuts down all workers, along with their sessions"""
+        for i, conn in enumerate(self._conns):
+            with self._locks[i]:
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+        for worker, conn in zip(self._workers, self._conns):
+            worker.join(10)
+            if worker.is_alive():
+                worker.terminate()
+            conn.close()
+
+
+def _run_worker(conn: Connection, initializer: Callable[[], None] | None):
+    """Runs an Operator, serving calls from the parent process until told
+    to stop."""
+    if initializer:
+        initializer()
+    Daily.init()
+    operator = Operator()
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            if msg is None:
+                break
+            fn, args = msg
+            try:
+                conn.send((True, fn(operator, *args)))
+            except Exception as e:
+                # Pass the error on as is, so that callers can handle
+                # errors such as CapacityError, if it can be pickled.
+                try:
+                    conn.send((False, e))
+                except Exception:
+                    conn.send((False, WorkerError(repr(e))))
+    finally:
+        operator.shutdown()
+        Daily.deinit()
+
+
+def _start_session(operator: Operator,
+                   bot_config: BotConfig) -> tuple[str | None, bool]:
+    return operator.start_session(bot_config)
+
+
+def _session_count(operator: Operator) -> int:
+    return operator.session_count()
+
+
+def _collect_metrics(operator: Operator) -> list[metrics.Family]:
+    return operator.collect_metrics()
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from server.bench.fakes import FakeCallClient
+from server.call.operator import CapacityError, Operator
+from server.call.session import Session
+from server.config import BotConfig, Capacity
+
+
+def room_config(i: int) -> BotConfig:
+    return BotConfig("fake_key", None, f"https://example.daily.co/room-{i}")
+
+
+class OperatorTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("server.call.session.CallClient", FakeCallClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.operator = Operator(Capacity(max_sessions=1000))
+        self.addCleanup(self.operator.shutdown)
+
+    def test_sessions_can_be_looked_up(self):
+        session = self.operator.create_session(room_config(0))
+
+        self.assertIs(self.operator.get_session(session.session_id), session)
+        self.assertIs(self.operator.get_session_by_room(session.room_url),
+                      session)
+        self.assertIsNone(self.operator.create_session(room_config(0)))
+        self.assertEqual(self.operator.sessions(), [session])
+
+    def test_destroyed_session_is_removed(self):
+        session = self.operator.create_session(room_config(0))
+        session.shutdown()
+
+        self.assertIsNone(self.operator.get_session(session.session_id))
+        self.assertIsNone(self.operator.get_session_by_room(session.room_url))
+        replacement = self.operator.create_session(room_config(0))
+        self.assertIsNotNone(replacement)
+        self.assertIsNot(replacement, session)
+
+    def test_concurrent_create_and_destroy(self):
+        rooms = 100
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            # Every room is requested twice, but only gets one session.
+            created = list(pool.map(
+                self.operator.create_session,
+                [room_config(i % rooms) for i in range(2 * rooms)]))
+            sessions = [s for s in created if s]
+            self.assertEqual(len(sessions), rooms)
+            self.assertEqual(self.operator.session_count(), rooms)
+            self.assertEqual(
+                {s.room_url for s in self.operator.sessions()},
+                {room_config(i).daily_room_url for i in range(rooms)})
+
+            # Shut each session down twice, as the shutdown timer and
+            # the operator might, while new rooms are being created.
+            destroyed = pool.map(lambda s: s.shutdown(), sessions * 2)
+            more = list(pool.map(
+                self.operator.create_session,
+                [room_config(rooms + i) for i in range(rooms)]))
+            list(destroyed)
+
+        self.assertEqual(sorted(self.operator.sessions(), key=id),
+                         sorted(more, key=id))
+        for session in sessions:
+            self.assertIsNone(self.operator.get_session(session.session_id))
+
+    def test_slow_session_creation_does_not_block_other_rooms(self):
+        release = threading.Event()
+        slow_url = room_config(0).daily_room_url
+
+        def new_session(config, *args):
+            if config.daily_room_url == slow_url:
+                release.wait(5)
+            return Session(config, *args)
+
+        with mock.patch("server.call.operator.Session", new_session), \
+                ThreadPoolExecutor(max_workers=2) as pool:
+            slow = pool.submit(self.operator.create_session, room_config(0))
+            # Wait for the slow room to be reserved.
+            while not self.operator._pending_rooms:
+                time.sleep(0.01)
+            duplicate = pool.submit(
+                self.operator.start_session, room_config(0))
+
+            start = time.perf_counter()
+            other = self.operator.create_session(room_config(1))
+            self.assertIsNotNone(other)
+            self.assertIs(self.operator.get_session(other.session_id), other)
+            self.assertIsNone(self.operator.create_session(room_config(0)))
+            self.assertLess(time.perf_counter() - start, 1)
+
+            release.set()
+            session = slow.result()
+            # A request for the room while it was being created gets its ID.
+            self.assertEqual(duplicate.result(), (session.session_id, False))
+        self.assertEqual(self.operator.session_count(), 2)
+
+    def test_failed_session_creation_releases_room(self):
+        with mock.patch("server.call.operator.Session",
+                        side_effect=Exception("boom")):
+            with self.assertRaises(Exception):
+                self.operator.create_session(room_config(0))
+        self.assertIsNotNone(self.operator.create_session(room_config(0)))
+
+
+class OperatorCapacityTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("server.call.session.CallClient", FakeCallClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def operator(self, capacity: Capacity) -> Operator:
+        operator = Operator(capacity)
+        self.addCleanup(operator.shutdown)
+        return operator
+
+    def test_sessions_are_limited(self):
+        operator = self.operator(Capacity(max_sessions=2, retry_after=7))
+        sessions = [operator.create_session(room_config(i)) for i in range(2)]
+
+        with self.assertRaises(CapacityError) as cm:
+            operator.create_session(room_config(2))
+        self.assertEqual(cm.exception.retry_after, 7)
+
+        # Capacity frees up as sessions end.
+        sessions[0].shutdown()
+        self.assertIsNotNone(operator.create_session(room_config(2)))
+
+    def test_transcript_backlog_is_limited(self):
+        operator = self.operator(Capacity(max_transcript_backlog=10))
+        session = operator.create_session(room_config(0))
+        for i in range(10):
+            session._assistant.register_new_context(f"line {i}")
+
+        with self.assertRaises(CapacityError):
+            operator.create_session(room_config(1))
+
+    def test_transcript_backlog_total_follows_cleanup(self):
+        operator = self.operator(Capacity(max_transcript_backlog=10))
+        session = operator.create_session(room_config(0))
+        assistant = session._assistant
+        assistant._make_openai_request = mock.AsyncMock(return_value="clean")
+        assistant._store.add = mock.AsyncMock()
+        assistant._update_summary_context = mock.AsyncMock()
+        for i in range(10):
+            assistant.register_new_line(f"line {i}.", "Liza")
+        self.assertEqual(operator._backlog.value, 10)
+
+        asyncio.run(assistant.cleanup_transcript())
+        self.assertEqual(operator._backlog.value,
+                         assistant.get_transcript_backlog())
+        self.assertIsNotNone(operator.create_session(room_config(1)))
+
+        # Lines left behind by a session no longer count once it ends.
+        for i in range(10):
+            session.on_transcription_message(
+                {"participantId": "participant-0", "text": f"more {i}"})
+        self.assertGreaterEqual(operator._backlog.value, 10)
+        session.shutdown()
+        self.assertEqual(operator._backlog.value, 0)
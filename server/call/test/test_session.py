@@ -0,0 +1,253 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from server.bench.fakes import FakeCallClient
+from server.call.loop import SessionLoop
+from server.call.session import Session
+from server.config import BotConfig
+
+
+class StubAssistant:
+    """Answers queries after a delay, counting how many it was asked."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.queries = []
+        self.segments = []
+
+    async def query(self, custom_query: str = None, on_delta=None) -> str:
+        self.queries.append(custom_query)
+        answer = f"answer to {custom_query}"
+        if not on_delta:
+            await asyncio.sleep(self.latency)
+            return answer
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.latency / len(words))
+            on_delta(word if i == 0 else f" {word}")
+        return answer
+
+    def get_clean_transcript(self) -> str:
+        return "\n\n".join(self.segments)
+
+    def get_transcript_segments(self, since: int = 0) -> list[str]:
+        return self.segments[since:]
+
+    def get_transcript_backlog(self) -> int:
+        return 0
+
+    def get_transcript_lag(self) -> float:
+        return 0
+
+    async def cleanup_transcript(self):
+        self.segments.append(f"segment {len(self.segments)}")
+
+    def destroy(self):
+        pass
+
+
+class SessionTestCase(unittest.TestCase):
+    """Runs a session with a fake call client and a stub assistant."""
+
+    def setUp(self):
+        patcher = mock.patch("server.call.session.CallClient", FakeCallClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.loop = SessionLoop()
+        self.loop.start()
+        self.addCleanup(self.loop.stop)
+
+        config = BotConfig("fake_key", None, "https://example.daily.co/room")
+        self.session = Session(config, self.loop)
+        self.assistant = StubAssistant(latency=0.3)
+        self.session._assistant = self.assistant
+        self.call_client: FakeCallClient = self.session._call_client
+
+    def fire(self, messages: list[tuple[dict, str]]):
+        """Fires the given app messages from concurrent Daily callback threads."""
+        threads = [threading.Thread(target=self.session.on_app_message, args=m)
+                   for m in messages]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def wait_for_messages(self, count: int):
+        deadline = time.time() + 5
+        while len(self.call_client.sent_messages) < count and time.time() < deadline:
+            time.sleep(0.01)
+        # Allow any unexpected extra messages to arrive.
+        time.sleep(0.1)
+
+
+class SessionAppMessageTests(SessionTestCase):
+    def test_on_app_message_does_not_block(self):
+        start = time.perf_counter()
+        self.session.on_app_message(
+            {"kind": "assist", "task": "summary"}, "p1")
+        self.assertLess(time.perf_counter() - start, self.assistant.latency)
+        self.wait_for_messages(1)
+
+    def test_overlapping_identical_requests_are_coalesced(self):
+        self.fire([({"kind": "assist", "task": "query", "query": "Action items?"}, "p1"),
+                   ({"kind": "assist", "task": "query", "query": "action  items?"}, "p2"),
+                   ({"kind": "assist", "task": "query", "query": "Action items?"}, "p3"),
+                   ({"kind": "assist", "task": "query", "query": "Decisions?"}, "p1")])
+        self.wait_for_messages(4)
+
+        self.assertEqual(sorted(self.assistant.queries),
+                         ["Action items?", "Decisions?"])
+        sent = self.call_client.sent_messages
+        self.assertEqual(sorted(r for _, r in sent), ["p1", "p1", "p2", "p3"])
+        for msg, _ in sent:
+            self.assertEqual(msg["kind"], "ai-query")
+
+    def test_broadcast_answers_all_requesters_once(self):
+        self.fire([({"kind": "assist", "task": "summary"}, "p1"),
+                   ({"kind": "assist", "task": "summary", "broadcast": True}, "p2"),
+                   ({"kind": "assist", "task": "summary"}, "p3")])
+        self.wait_for_messages(1)
+
+        self.assertEqual(len(self.assistant.queries), 1)
+        self.assertEqual(self.call_client.sent_messages, [
+            ({"kind": "ai-summary", "data": "answer to None"}, None)])
+
+    def test_requests_after_answer_are_not_coalesced(self):
+        self.session.on_app_message(
+            {"kind": "assist", "task": "query", "query": "q"}, "p1")
+        self.wait_for_messages(1)
+        self.session.on_app_message(
+            {"kind": "assist", "task": "query", "query": "q"}, "p1")
+        self.wait_for_messages(2)
+
+        self.assertEqual(self.assistant.queries, ["q", "q"])
+
+
+class SessionTranscriptTests(SessionTestCase):
+    def test_legacy_request_gets_full_transcript(self):
+        self.assistant.segments = ["one", "two"]
+        self.session.on_app_message(
+            {"kind": "assist", "task": "transcript"}, "p1")
+        self.wait_for_messages(1)
+
+        self.assertEqual(self.call_client.sent_messages, [
+            ({"kind": "ai-transcript", "data": "one\n\ntwo"}, "p1")])
+
+    def test_cursor_request_gets_new_segments_only(self):
+        self.assistant.segments = ["one", "two", "three"]
+        self.session.on_app_message(
+            {"kind": "assist", "task": "transcript", "since": 1}, "p1")
+        self.wait_for_messages(1)
+
+        self.assertEqual(self.call_client.sent_messages, [
+            ({"kind": "ai-transcript", "segments": ["two", "three"],
+              "since": 1, "next": 3}, "p1")])
+
+    def test_new_segments_are_pushed_to_subscribers(self):
+        self.session.on_app_message(
+            {"kind": "assist", "task": "transcript", "since": 0,
+             "subscribe": True}, "p1")
+        self.session.on_app_message(
+            {"kind": "assist", "task": "transcript", "since": 0}, "p2")
+        self.wait_for_messages(2)
+
+        for _ in range(2):
+            self.loop.submit(
+                self.session._generate_clean_transcript()).result()
+        self.wait_for_messages(4)
+
+        pushed = self.call_client.sent_messages[2:]
+        self.assertEqual(pushed, [
+            ({"kind": "ai-transcript", "segments": ["segment 0"],
+              "since": 0, "next": 1}, "p1"),
+            ({"kind": "ai-transcript", "segments": ["segment 1"],
+              "since": 1, "next": 2}, "p1"),
+        ])
+
+        self.session.on_participant_left({"id": "p1"}, "left")
+        self.loop.submit(self.session._generate_clean_transcript()).result()
+        self.wait_for_messages(4)
+        self.assertEqual(len(self.call_client.sent_messages), 4)
+
+
+class SessionStreamingTests(SessionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session._stream_interval = 0
+
+    def test_streamed_answer_is_assembled_from_deltas(self):
+        self.session.on_app_message(
+            {"kind": "assist", "task": "query", "query": "Action items?",
+             "stream": True, "id": "r1"}, "p1")
+        self.wait_for_messages(5)
+
+        sent = self.call_client.sent_messages
+        deltas, (final, recipient) = sent[:-1], sent[-1]
+        self.assertEqual([m["kind"] for m, _ in deltas],
+                         ["ai-query-delta"] * len(deltas))
+        self.assertEqual([m["seq"] for m, _ in deltas],
+                         list(range(len(deltas))))
+        self.assertEqual({m["id"] for m, _ in deltas}, {"r1"})
+        self.assertEqual("".join(m["delta"] for m, _ in deltas),
+                         "answer to Action items?")
+        self.assertEqual(recipient, "p1")
+        self.assertEqual(final, {"kind": "ai-query", "id": "r1",
+                                 "seq": len(deltas),
+                                 "data": "answer to Action items?"})
+
+    def test_only_streaming_requesters_get_deltas(self):
+        self.fire([({"kind": "assist", "task": "query", "query": "q",
+                     "stream": True, "id": "r1"}, "p1")])
+        self.fire([({"kind": "assist", "task": "query", "query": "q"}, "p2")])
+        self.wait_for_messages(5)
+
+        to_p2 = [m for m, r in self.call_client.sent_messages if r == "p2"]
+        self.assertEqual(to_p2, [{"kind": "ai-query", "data": "answer to q"}])
+        self.assertEqual(self.assistant.queries, ["q"])
+
+
+class SessionParticipantNameTests(SessionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.contexts = []
+        self.assistant.register_new_line = \
+            lambda text, speaker, source, sent_at: self.contexts.append(speaker)
+        self.lookups = mock.patch.object(
+            self.call_client, "participants",
+            wraps=self.call_client.participants).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def transcribe(self, participant_id: str):
+        self.session.on_transcription_message(
+            {"participantId": participant_id, "text": "hello"})
+
+    def test_names_come_from_participant_events(self):
+        self.session.on_participant_joined(
+            {"id": "p1", "info": {"userName": "Liza"}})
+        self.transcribe("p1")
+        self.session.on_participant_updated(
+            {"id": "p1", "info": {"userName": "Liza B"}})
+        self.transcribe("p1")
+
+        self.assertEqual(self.contexts, ["Liza", "Liza B"])
+        self.assertEqual(self.lookups.call_count, 0)
+
+    def test_unknown_participant_is_looked_up_once(self):
+        for _ in range(3):
+            self.transcribe("participant-0")
+        self.assertEqual(self.contexts, ["Participant 0"] * 3)
+        self.assertEqual(self.lookups.call_count, 1)
+
+        self.transcribe("nobody")
+        self.assertEqual(self.contexts[-1], "Unknown")
+
+    def test_name_is_dropped_when_participant_leaves(self):
+        self.session.on_participant_joined(
+            {"id": "p1", "info": {"userName": "Liza"}})
+        self.session.on_participant_left({"id": "p1"}, "left")
+        self.transcribe("p1")
+        self.assertEqual(self.contexts, ["Unknown"])
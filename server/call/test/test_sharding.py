@@ -0,0 +1,98 @@
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from server.bench.fakes import install_fake_call_client
+from server.call.operator import Operator
+from server.call.sharding import HashRing, ShardedOperator, WorkerError
+from server.config import BotConfig
+
+
+def room_url(i: int) -> str:
+    return f"https://example.daily.co/room-{i}"
+
+
+def exit_worker(operator: Operator):
+    os._exit(1)
+
+
+class HashRingTests(unittest.TestCase):
+    def test_keys_spread_evenly(self):
+        ring = HashRing([0, 1, 2, 3])
+        counts = [0] * 4
+        for i in range(4000):
+            counts[ring.node_for(room_url(i))] += 1
+        for count in counts:
+            self.assertGreater(count, 700)
+
+    def test_adding_a_node_only_moves_its_keys(self):
+        before = HashRing([0, 1, 2, 3])
+        after = HashRing([0, 1, 2, 3, 4])
+        moved = 0
+        for i in range(4000):
+            old, new = before.node_for(room_url(i)), after.node_for(room_url(i))
+            if old != new:
+                self.assertEqual(new, 4)
+                moved += 1
+        self.assertLess(moved, 4000 * 0.3)
+
+
+class ShardedOperatorTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.operator = ShardedOperator(
+            2, initializer=install_fake_call_client)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.operator.shutdown()
+
+    def test_duplicate_sessions_are_detected_across_workers(self):
+        configs = [BotConfig("fake_key", None, room_url(i % 10))
+                   for i in range(40)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(self.operator.start_session, configs))
+
+        self.assertEqual(sum(created for _, created in results), 10)
+        ids = {}
+        for config, (session_id, _) in zip(configs, results):
+            ids.setdefault(config.daily_room_url, set()).add(session_id)
+        self.assertTrue(all(len(s) == 1 for s in ids.values()))
+        self.assertEqual(self.operator.session_count(), 10)
+        self.assertEqual(
+            {self.operator.worker_for(room_url(i)) for i in range(10)}, {0, 1})
+
+
+class WorkerFailureTests(unittest.TestCase):
+    def setUp(self):
+        self.operator = ShardedOperator(
+            2, initializer=install_fake_call_client)
+
+    def tearDown(self):
+        self.operator.shutdown()
+
+    def test_worker_dying_during_call_is_restarted(self):
+        config = BotConfig("fake_key", None, room_url(0))
+        worker = self.operator.worker_for(config.daily_room_url)
+        self.operator.start_session(config)
+
+        with self.assertRaises(WorkerError):
+            self.operator.call(worker, exit_worker)
+
+        # The worker's sessions are lost, but its rooms can start new ones.
+        session_id, created = self.operator.start_session(config)
+        self.assertTrue(created)
+        self.assertIsNotNone(session_id)
+        self.assertEqual(self.operator.session_count(), 1)
+
+    def test_dead_worker_is_restarted_before_next_call(self):
+        self.operator.start_session(BotConfig("fake_key", None, room_url(0)))
+        self.operator._workers[0].terminate()
+        self.operator._workers[0].join()
+        self.operator._workers[1].terminate()
+        self.operator._workers[1].join()
+
+        families = self.operator.collect_metrics()
+        self.assertIn("operator_active_sessions",
+                      {family.name for family in families})
+        self.assertEqual(self.operator.session_count(), 0)
@@ -2,31 +2,42 @@
 third-party API keys."""
 from __future__ import annotations
 import argparse
+import dataclasses
+import hashlib
 
 import os
 from os.path import join, dirname, abspath
+from urllib.parse import urlparse
 
 from dotenv import load_dotenv
 
+from server.store.memory import Retrieval
+
 
 class BotConfig:
     _openai_api_key: str = None
     _openai_model_name: str = None
     _log_dir_path: str = None
+    _store_dir_path: str = None
     _daily_room_url: str = None
     _daily_meeting_token: str = None
+    _retrieval: str = None
 
     def __init__(self,
                  openai_api_key: str,
                  openai_model_name: str,
                  daily_room_url: str = None,
                  daily_meeting_token: str = None,
-                 log_dir_path: str = None):
+                 log_dir_path: str = None,
+                 store_dir_path: str = None,
+                 retrieval: str = None):
         self._openai_api_key = openai_api_key
         self._openai_model_name = openai_model_name
         self._log_dir_path = log_dir_path
+        self._store_dir_path = store_dir_path
         self._daily_room_url = daily_room_url
         self._daily_meeting_token = daily_meeting_token
+        self._retrieval = retrieval
 
     @property
     def openai_model_name(self) -> str:
@@ -40,6 +51,10 @@ class BotConfig:
     def log_dir_path(self) -> str:
         return self._log_dir_path
 
+    @property
+    def store_dir_path(self) -> str:
+        return self._store_dir_path
+
     @property
     def daily_room_url(self) -> str:
         return self._daily_room_url
@@ -48,16 +63,64 @@ class BotConfig:
     def daily_meeting_token(self) -> str:
         return self._daily_meeting_token
 
+    @property
+    def retrieval(self) -> str | None:
+        """How context stores rank context for custom queries: "vector",
+        "lexical" or "hybrid". Defaults to "vector"."""
+        return self._retrieval
+
     def get_log_file_path(self, room_name: str) -> str | None:
         """Returns the log file for the given room name"""
         if not self.log_dir_path:
             return None
         return os.path.join(self.log_dir_path, f"{room_name}.log")
 
+    def get_store_dir_path(self, room_url: str) -> str | None:
+        """Returns the directory to persist the given room's context store in.
+        Rooms on different Daily domains can share a name, so the directory
+        is named after the room and a hash of its domain and name.
+        If None, context is only stored in memory."""
+        if not self.store_dir_path:
+            return None
+        parsed_url = urlparse(room_url)
+        room_name = os.path.basename(parsed_url.path.rstrip("/"))
+        room_hash = hashlib.blake2b(
+            f"{parsed_url.netloc.lower()}/{room_name}".encode(),
+            digest_size=8).hexdigest()
+        return os.path.join(self.store_dir_path, f"{room_name}-{room_hash}")
+
     def ensure_dirs(self):
         """Creates required file directories if they do not already exist."""
         if self.log_dir_path:
             ensure_dir(self.log_dir_path)
+        if self.store_dir_path:
+            ensure_dir(self.store_dir_path)
+
+
+@dataclasses.dataclass(frozen=True)
+class Capacity:
+    """Class representing how much work a server process takes on"""
+    max_sessions: int = 100
+    max_concurrent_llm_calls: int = 16
+    # Raw transcription lines waiting to be cleaned up, across all sessions.
+    max_transcript_backlog: int = 5000
+    # Seconds that rejected requesters are asked to wait before retrying.
+    retry_after: int = 30
+
+    @classmethod
+    def from_env(cls) -> Capacity:
+        """Returns capacity overridden by any environment variables."""
+        default = cls()
+        return cls(
+            max_sessions=int(os.environ.get(
+                "MAX_SESSIONS", default.max_sessions)),
+            max_concurrent_llm_calls=int(os.environ.get(
+                "MAX_CONCURRENT_LLM_CALLS", default.max_concurrent_llm_calls)),
+            max_transcript_backlog=int(os.environ.get(
+                "MAX_TRANSCRIPT_BACKLOG", default.max_transcript_backlog)),
+            retry_after=int(os.environ.get(
+                "CAPACITY_RETRY_AFTER", default.retry_after)),
+        )
 
 
 def ensure_dir(dir_path: str):
@@ -70,6 +133,7 @@ def get_headless_config() -> BotConfig:
     dotenv_path = join(dirname(dirname(abspath(__file__))), '.env')
     load_dotenv(dotenv_path)
 
+    retrieval_modes = [r.value for r in Retrieval]
     parser = argparse.ArgumentParser(description='Start a session.')
     parser.add_argument(
         '--room_url',
@@ -96,11 +160,32 @@ def get_headless_config() -> BotConfig:
         type=str,
         default=None,
         help='Log dir name')
+    parser.add_argument(
+        '--store_dir_name',
+        type=str,
+        default=os.environ.get('STORE_DIR_PATH'),
+        help='Dir name to persist context stores in')
+    parser.add_argument(
+        '--retrieval',
+        type=str,
+        choices=retrieval_modes,
+        default=os.environ.get('RETRIEVAL') or None,
+        help='How to rank context for custom queries')
     args = parser.parse_args()
+    # argparse does not check defaults against choices, so check the
+    # value taken from the environment here.
+    if args.retrieval and args.retrieval not in retrieval_modes:
+        parser.error(f"invalid RETRIEVAL {args.retrieval!r} "
+                     f"(choose from {', '.join(retrieval_modes)})")
 
     ldn = args.log_dir_name
     ldp = None
     if ldn:
         ldp = os.path.abspath(ldn)
+    sdn = args.store_dir_name
+    sdp = None
+    if sdn:
+        sdp = os.path.abspath(sdn)
     return BotConfig(args.oai_api_key, args.oai_model_name,
-                     args.room_url, args.daily_meeting_token, ldp)
+                     args.room_url, args.daily_meeting_token, ldp, sdp,
+                     args.retrieval)
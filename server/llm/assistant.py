@@ -1,5 +1,6 @@
 """Module defining an assistant base class, which new assistants can implement"""
 from abc import ABC, abstractmethod
+from typing import Callable
 
 
 class NoContextError(Exception):
@@ -19,13 +20,36 @@ class Assistant(ABC):
         """Registers new context (usually a transcription line)."""
 
     @abstractmethod
-    async def query(self, custom_query: str) -> str:
-        """Runs a query against the assistant and returns the answer."""
+    def register_new_line(self, text: str, speaker: str = None,
+                          source: str = "voice", sent_at: float = None):
+        """Registers a new line of context, such as a transcription line,
+        from the given speaker. sent_at defaults to the current time."""
+
+    @abstractmethod
+    async def query(self, custom_query: str,
+                    on_delta: Callable[[str], None] = None) -> str:
+        """Runs a query against the assistant and returns the answer.
+        If a delta callback is provided, the answer is also passed to it
+        piece by piece as it is generated."""
 
     @abstractmethod
     def get_clean_transcript(self) -> str:
         """Returns latest clean transcript."""
 
+    @abstractmethod
+    def get_transcript_segments(self, since: int = 0) -> list[str]:
+        """Returns clean transcript segments, starting with the segment
+        with the given sequence number."""
+
+    @abstractmethod
+    def get_transcript_backlog(self) -> int:
+        """Returns how many context items are waiting to be cleaned up."""
+
+    @abstractmethod
+    def get_transcript_lag(self) -> float:
+        """Returns how many seconds the oldest context item waiting to be
+        cleaned up has been waiting."""
+
     @abstractmethod
     async def cleanup_transcript(self) -> str:
         """Cleans up transcript from raw context."""
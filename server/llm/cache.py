@@ -0,0 +1,103 @@
+"""Module providing a cache for LLM responses."""
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from openai.types.chat import ChatCompletionMessageParam
+
+from server import metrics
+
+_lookups = metrics.counter(
+    "llm_response_cache_lookups",
+    "LLM response cache lookups, by whether they were hits or misses",
+    ("result",))
+_hits = _lookups.labels(result="hit")
+_misses = _lookups.labels(result="miss")
+
+
+class ResponseCache:
+    """Least-recently-used cache of LLM responses, whose entries expire after
+    a TTL. Memory is bounded by both entry count and total response size."""
+
+    _entries: OrderedDict[str, tuple[str, float]]
+    _lock: threading.Lock
+    _chars: int
+
+    def __init__(self, max_entries: int = 1024, max_chars: int = 4_000_000,
+                 ttl: float = 600, clock: Callable[[], float] = time.monotonic):
+        self._max_entries = max_entries
+        self._max_chars = max_chars
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._chars = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(model: str, query: str | None,
+            context: list[ChatCompletionMessageParam]) -> str:
+        """Returns the cache key for the given model, query and the context
+        it is answered from. Any change to the context changes the key."""
+        h = hashlib.sha256()
+        h.update(json.dumps([model, normalize_query(query)]).encode())
+        for message in context:
+            h.update(json.dumps(
+                [message.get("role"), message.get("content")]).encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """Returns the cached response for the given key, if any."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                _hits.inc()
+                return entry[0]
+            if entry:
+                self._remove(key)
+            self.misses += 1
+            _misses.inc()
+            return None
+
+    def put(self, key: str, response: str):
+        """Caches the given response, evicting least recently used
+        responses as needed."""
+        if len(response) > self._max_chars:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (response, self._clock() + self._ttl)
+            self._chars += len(response)
+            while len(self._entries) > self._max_entries or \
+                    self._chars > self._max_chars:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        response, _ = self._entries.pop(key)
+        self._chars -= len(response)
+
+
+def normalize_query(query: str | None) -> str:
+    """Normalizes case, whitespace and trailing punctuation, so that
+    trivially different phrasings of a query share cache entries."""
+    if not query:
+        return ""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
+
+
+# Cache shared by all assistants in the process, so that memory use is
+# bounded no matter how many sessions are running.
+default_response_cache = ResponseCache()
@@ -0,0 +1,104 @@
+"""Module which shares async OpenAI clients, and with them their HTTP
+connection pools, between all sessions in the process that use the same
+API key."""
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import os
+import threading
+import weakref
+
+import httpx
+from openai import AsyncOpenAI
+
+
+@dataclasses.dataclass(frozen=True)
+class ClientSettings:
+    """Class representing connection settings for shared OpenAI clients"""
+    base_url: str | None = None
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    timeout: float = 60.0
+    connect_timeout: float = 5.0
+    max_retries: int = 2
+
+    @classmethod
+    def from_env(cls) -> ClientSettings:
+        """Returns settings overridden by any OPENAI_* environment variables."""
+        default = cls()
+        return cls(
+            base_url=os.environ.get("OPENAI_BASE_URL") or None,
+            max_connections=int(os.environ.get(
+                "OPENAI_MAX_CONNECTIONS", default.max_connections)),
+            max_keepalive_connections=int(os.environ.get(
+                "OPENAI_MAX_KEEPALIVE_CONNECTIONS", default.max_keepalive_connections)),
+            timeout=float(os.environ.get(
+                "OPENAI_TIMEOUT", default.timeout)),
+            connect_timeout=float(os.environ.get(
+                "OPENAI_CONNECT_TIMEOUT", default.connect_timeout)),
+            max_retries=int(os.environ.get(
+                "OPENAI_MAX_RETRIES", default.max_retries)),
+        )
+
+
+_settings = ClientSettings.from_env()
+_lock = threading.Lock()
+
+# HTTP connections belong to the event loop they were opened on, so clients
+# are shared per loop. Clients are dropped along with their loop.
+_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop,
+                                    dict[str, AsyncOpenAI]] = weakref.WeakKeyDictionary()
+
+
+def configure(settings: ClientSettings):
+    """Sets connection settings for shared clients. Only affects clients
+    created after this call."""
+    global _settings
+    with _lock:
+        _settings = settings
+        _clients.clear()
+
+
+def get_async_client(api_key: str) -> AsyncOpenAI:
+    """Returns the shared client for the given API key on the running
+    event loop, creating it if needed."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        loop_clients = _clients.setdefault(loop, {})
+        client = loop_clients.get(api_key)
+        if not client:
+            client = _new_client(api_key, _settings)
+            loop_clients[api_key] = client
+        return client
+
+
+def _new_client(api_key: str, settings: ClientSettings) -> AsyncOpenAI:
+    http_client = httpx.AsyncClient(
+        base_url=settings.base_url or "https://api.openai.com/v1",
+        limits=httpx.Limits(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_keepalive_connections),
+        timeout=httpx.Timeout(settings.timeout,
+                              connect=settings.connect_timeout),
+    )
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=settings.base_url,
+        timeout=httpx.Timeout(settings.timeout,
+                              connect=settings.connect_timeout),
+        max_retries=settings.max_retries,
+        http_client=http_client,
+    )
+
+
+class SharedClient:
+    """Stands in for an AsyncOpenAI client, delegating each call to the
+    shared client for its API key on the running event loop."""
+    _api_key: str
+
+    def __init__(self, api_key: str):
+        self._api_key = api_key
+
+    def __getattr__(self, name: str):
+        return getattr(get_async_client(self._api_key), name)
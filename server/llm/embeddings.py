@@ -0,0 +1,169 @@
+"""Module which batches embedding requests from all stores in the process
+that share an API key, so that many small requests from different sessions
+go out as a few larger ones."""
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import threading
+import time
+import weakref
+
+from openai import AsyncOpenAI
+
+from server import metrics
+from server.llm.clients import SharedClient
+
+_embedding_seconds = metrics.histogram(
+    "openai_embedding_request_seconds",
+    "Latency of OpenAI embedding requests")
+_batch_inputs = metrics.histogram(
+    "embedding_batch_inputs",
+    "Number of inputs embedded per batched request",
+    buckets=metrics.COUNT_BUCKETS)
+_batch_callers = metrics.histogram(
+    "embedding_batch_callers",
+    "Number of callers served per batched embedding request",
+    buckets=metrics.COUNT_BUCKETS)
+_queue_wait_seconds = metrics.histogram(
+    "embedding_queue_wait_seconds",
+    "Time embedding inputs wait before their batch is sent")
+
+
+@dataclasses.dataclass
+class _Pending:
+    """Class representing one caller's inputs waiting to be embedded"""
+    inputs: list[str]
+    future: asyncio.Future
+    queued_at: float
+
+
+class _Queue:
+    """Inputs waiting to be embedded on one event loop"""
+
+    def __init__(self):
+        self.pending: list[_Pending] = []
+        self.size = 0
+        self.timer: asyncio.TimerHandle | None = None
+        # Batches in flight, kept so that they aren't garbage collected.
+        self.tasks: set[asyncio.Task] = set()
+
+
+class EmbeddingBatcher:
+    """Collects inputs to embed and sends them in batches, once a batch
+    holds max_batch_size inputs or its oldest input has waited max_wait
+    seconds. Each caller gets the embeddings of its own inputs back.
+
+    Coroutines running on different event loops can share a batcher;
+    inputs are only batched with others from the same loop."""
+
+    _client: AsyncOpenAI
+    _model: str
+    _max_batch_size: int
+    _max_wait: float
+    _lock: threading.Lock
+    _queues: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Queue]
+
+    def __init__(self, client: AsyncOpenAI,
+                 model: str = "text-embedding-ada-002",
+                 max_batch_size: int = 256, max_wait: float = 0.005):
+        self._client = client
+        self._model = model
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queues = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        return self._client
+
+    async def embed(self, inputs: list[str]) -> list[list[float]]:
+        """Returns the embedding of each of the given inputs."""
+        if not inputs:
+            return []
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            queue = self._queues.setdefault(loop, _Queue())
+        future = loop.create_future()
+        queue.pending.append(_Pending(inputs, future, time.perf_counter()))
+        queue.size += len(inputs)
+        if queue.size >= self._max_batch_size:
+            self._flush(queue)
+        elif queue.timer is None:
+            queue.timer = loop.call_later(self._max_wait, self._flush, queue)
+        return await future
+
+    def _flush(self, queue: _Queue):
+        """Sends everything queued, in batches of at most max_batch_size
+        inputs. A single caller's inputs are never split across batches."""
+        if queue.timer:
+            queue.timer.cancel()
+            queue.timer = None
+        pending = [p for p in queue.pending if not p.future.done()]
+        queue.pending = []
+        queue.size = 0
+
+        batch, size = [], 0
+        for p in pending:
+            if batch and size + len(p.inputs) > self._max_batch_size:
+                self._send(queue, batch)
+                batch, size = [], 0
+            batch.append(p)
+            size += len(p.inputs)
+        if batch:
+            self._send(queue, batch)
+
+    def _send(self, queue: _Queue, batch: list[_Pending]):
+        task = asyncio.get_running_loop().create_task(self._request(batch))
+        queue.tasks.add(task)
+        task.add_done_callback(queue.tasks.discard)
+
+    async def _request(self, batch: list[_Pending]):
+        """Embeds the inputs of the given callers in a single request, and
+        hands each caller its share of the results."""
+        now = time.perf_counter()
+        inputs = []
+        for p in batch:
+            _queue_wait_seconds.observe(now - p.queued_at)
+            inputs.extend(p.inputs)
+        _batch_inputs.observe(len(inputs))
+        _batch_callers.observe(len(batch))
+        try:
+            with _embedding_seconds.time():
+                res = await self._client.embeddings.create(
+                    input=inputs, model=self._model)
+            vectors = [e.embedding for e in res.data]
+            if len(vectors) != len(inputs):
+                raise Exception(
+                    f"Requested {len(inputs)} embeddings, got {len(vectors)}.")
+        except Exception as e:
+            for p in batch:
+                if not p.future.done():
+                    p.future.set_exception(e)
+            return
+        start = 0
+        for p in batch:
+            end = start + len(p.inputs)
+            if not p.future.done():
+                p.future.set_result(vectors[start:end])
+            start = end
+
+
+_lock = threading.Lock()
+# Batchers are kept alive by the stores using them, and by their own
+# pending work, so keys which are no longer used drop out.
+_batchers: weakref.WeakValueDictionary[tuple[str, str], EmbeddingBatcher] = \
+    weakref.WeakValueDictionary()
+
+
+def get_batcher(api_key: str,
+                model: str = "text-embedding-ada-002") -> EmbeddingBatcher:
+    """Returns the process-wide batcher for the given API key and model,
+    which sends requests through the shared client for the key."""
+    with _lock:
+        batcher = _batchers.get((api_key, model))
+        if not batcher:
+            batcher = EmbeddingBatcher(SharedClient(api_key), model)
+            _batchers[(api_key, model)] = batcher
+        return batcher
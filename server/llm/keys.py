@@ -0,0 +1,74 @@
+"""Module which validates OpenAI API keys, caching the results so that
+repeated validation of the same key is a local lookup."""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import threading
+import time
+
+import openai
+
+from server.llm.clients import get_async_client
+
+# Seconds for which a probe result is trusted.
+probe_ttl: float = 600
+
+_lock = threading.Lock()
+# Probe results and when they expire, keyed by key hash.
+_results: dict[str, tuple[bool, float]] = {}
+# Probes in progress, keyed by key hash.
+_probes: dict[str, asyncio.Future[bool]] = {}
+
+
+def _key_hash(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+async def probe_api_key(api_key: str) -> bool:
+    """Probes the OpenAI API with the provided key to ensure it is valid.
+    Results are cached per key for a while, and concurrent probes of the
+    same key share a single request."""
+    key_hash = _key_hash(api_key)
+    loop = asyncio.get_running_loop()
+    with _lock:
+        result = _results.get(key_hash)
+        if result and result[1] > time.monotonic():
+            return result[0]
+        probe = _probes.get(key_hash)
+        if not probe or probe.get_loop() is not loop:
+            probe = loop.create_task(_probe(api_key, key_hash))
+            _probes[key_hash] = probe
+    return await asyncio.shield(probe)
+
+
+def clear():
+    """Forgets all cached probe results."""
+    with _lock:
+        _results.clear()
+
+
+async def _probe(api_key: str, key_hash: str) -> bool:
+    """Lists models, which is free and quick, to check the given key."""
+    valid = None
+    try:
+        await get_async_client(api_key).models.list()
+        valid = True
+    except (openai.AuthenticationError, openai.PermissionDeniedError) as e:
+        print(f"Invalid OpenAI API key: {e}")
+        valid = False
+    except Exception as e:
+        # Don't remember other failures, which are likely to be transient.
+        print(f"Failed to probe OpenAI API key: {e}")
+        return False
+    finally:
+        with _lock:
+            if _probes.get(key_hash) is asyncio.current_task():
+                del _probes[key_hash]
+            if valid is not None:
+                now = time.monotonic()
+                for h in [h for h, (_, expires_at) in _results.items()
+                          if expires_at <= now]:
+                    del _results[h]
+                _results[key_hash] = (valid, now + probe_ttl)
+    return valid
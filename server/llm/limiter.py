@@ -0,0 +1,141 @@
+"""Module which limits how many LLM calls run at once across all sessions
+in the process, letting interactive queries ahead of background work."""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import enum
+import heapq
+import itertools
+import threading
+from typing import AsyncIterator
+
+from server import metrics
+
+
+class Priority(enum.IntEnum):
+    """Priority of an LLM call. Lower values are admitted first."""
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class PrioritySemaphore:
+    """Semaphore which admits waiters in priority order, and in arrival
+    order within a priority. Coroutines running on different event loops
+    can share it."""
+
+    _limit: int
+    _value: int
+    _lock: threading.Lock
+    _waiters: list[tuple[int, int, asyncio.Future]]
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._value = limit
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._counter = itertools.count()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def in_use(self) -> int:
+        return self._limit - self._value
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, f in self._waiters if not f.cancelled())
+
+    def set_limit(self, limit: int):
+        """Changes how many holders are allowed at once. Current holders
+        are not affected."""
+        with self._lock:
+            self._value += limit - self._limit
+            self._limit = limit
+            self._wake()
+
+    async def acquire(self, priority: Priority = Priority.BACKGROUND):
+        """Waits until the caller may proceed."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return
+            fut = loop.create_future()
+            heapq.heappush(self._waiters,
+                           (int(priority), next(self._counter), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # If we were admitted just as we were cancelled, pass our
+            # place on to the next waiter.
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            self._value += 1
+            self._wake()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: Priority = Priority.BACKGROUND) -> AsyncIterator[None]:
+        """Holds the semaphore for the duration of the block."""
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _wake(self):
+        """Admits as many waiters as there is room for. Must be called
+        with the lock held."""
+        while self._value > 0 and self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.cancelled():
+                continue
+            try:
+                fut.get_loop().call_soon_threadsafe(self._admit, fut)
+            except RuntimeError:
+                # The waiter's loop has been closed.
+                continue
+            self._value -= 1
+
+    def _admit(self, fut: asyncio.Future):
+        # The waiter may have been cancelled since it was picked.
+        if fut.done():
+            self.release()
+            return
+        fut.set_result(None)
+
+
+class RunningTotal:
+    """Thread-safe running total, such as of work queued across sessions,
+    which can be read without visiting each contributor."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def add(self, amount: int):
+        with self._lock:
+            self._value += amount
+
+
+# Limits LLM calls across all sessions in the process.
+llm_calls = PrioritySemaphore(16)
+
+metrics.gauge(
+    "llm_calls_in_progress",
+    "LLM calls currently running across all sessions").set_function(
+    lambda: llm_calls.in_use)
+metrics.gauge(
+    "llm_calls_waiting",
+    "LLM calls waiting for a slot across all sessions").set_function(
+    lambda: llm_calls.waiting)
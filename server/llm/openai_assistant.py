@@ -1,50 +1,83 @@
 """Module that defines an OpenAI assistant."""
 import asyncio
+import sys
+import time
 from collections import deque
 import logging
+from typing import Callable
 
-from openai import OpenAI
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionSystemMessageParam, \
     ChatCompletionUserMessageParam
 
+from server import metrics
 from server.llm.assistant import Assistant, NoContextError
-from server.store.memory import MemoryStore
-
-
-def probe_api_key(api_key: str) -> bool:
-    """Probes the OpenAI API with the provided key to ensure it is valid."""
-    try:
-        client = OpenAI(api_key=api_key)
-        client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                ChatCompletionUserMessageParam(
-                    content="This is a test",
-                    role="user")],
-        )
-        return True
-    except Exception as e:
-        print(f"Failed to probe OpenAI API key: {e}")
-        return False
+from server.llm.cache import ResponseCache, default_response_cache
+from server.llm.clients import SharedClient
+from server.llm.embeddings import get_batcher
+from server.llm.limiter import Priority, PrioritySemaphore, RunningTotal, \
+    llm_calls
+from server.llm.prompt import RawContext, build_messages, count_message_tokens, \
+    pop_batch
+from server.llm.transcript import Transcript, TranscriptSegment
+from server.store.file import FileStore
+from server.store.memory import MemoryStore, Retrieval, count_tokens
+from server.store.store import Store
+
+_chat_seconds = metrics.histogram(
+    "openai_chat_request_seconds",
+    "Latency of OpenAI chat completion requests, until the full answer is received",
+    ("streamed",))
+_chat_tokens = metrics.counter(
+    "openai_chat_tokens", "Tokens used by OpenAI chat completion requests",
+    ("kind",))
+_cleanup_batch_lines = metrics.histogram(
+    "transcript_cleanup_batch_lines",
+    "Number of transcription lines in each transcript cleanup batch",
+    buckets=metrics.COUNT_BUCKETS)
+_cleanup_batch_tokens = metrics.histogram(
+    "transcript_cleanup_batch_tokens",
+    "Number of tokens in each transcript cleanup batch",
+    buckets=metrics.COUNT_BUCKETS)
+_cleanup_batch_seconds = metrics.histogram(
+    "transcript_cleanup_batch_seconds",
+    "Time taken to clean up each transcript batch, including waiting for an LLM call slot")
 
 
 class OpenAIAssistant(Assistant):
     """Class that implements assistant features using the OpenAI API"""
-    _client: OpenAI = None
+    _client: SharedClient = None
 
     _model_name: str = None
     _logger: logging.Logger = None
 
     # For now, just store context in memory.
-    _raw_context: deque([ChatCompletionMessageParam]) = None
-    _clean_transcript: str = None
+    _raw_context: deque[RawContext] = None
+    # Each cleaned batch, in order. A batch's index is its sequence number.
+    _clean_transcript: Transcript = None
     _clean_transcript_running: bool = False
-    _summary_context: str = None
-
-    # Process 20 context items at a time.
-    _transcript_batch_size: int = 25
 
-    _store: MemoryStore = None
+    # Running notes covering the clean transcript, updated as each cleaned
+    # batch comes in, so that summaries don't need the whole transcript.
+    _summary_context: str = None
+    # Cleaned batches not yet folded into the running notes.
+    _unsummarized: list[str] = None
+    _summary_context_max_tokens: int = 1024
+
+    # Clean up roughly this many tokens of context per batch, and run
+    # up to this many batches at a time when catching up on a backlog.
+    _transcript_batch_tokens: int = 1000
+    _max_concurrent_batches: int = 4
+
+    # Transcription lines waiting to be cleaned up across all assistants
+    # sharing this total, such as all of an operator's sessions.
+    _backlog: RunningTotal | None = None
+
+    _store: Store = None
+    # Answers to queries, keyed by the context they were answered from.
+    _response_cache: ResponseCache = None
+    # Limits concurrent LLM calls across all assistants, letting queries
+    # ahead of transcript cleanup.
+    _llm_calls: PrioritySemaphore = llm_calls
     _default_transcript_prompt = ChatCompletionSystemMessageParam(content="""
         Using the exact transcript provided in the previous messages, convert it into a cleaned-up, paragraphed format. It is crucial that you strictly adhere to the content of the provided transcript without adding or modifying any of the original dialogue. Your tasks are to:
 
@@ -72,39 +105,113 @@ class OpenAIAssistant(Assistant):
         Exclude any square brackets, tags, or timestamps from the summary.
         """
 
+    _default_summary_context_prompt = """
+        You are maintaining running notes for an ongoing business meeting.
+        The first message contains the notes so far (it may be empty), and the following messages
+        contain the latest part of the cleaned-up meeting transcript.
+        Rewrite the notes so that they also cover the latest part of the transcript. The notes should list:
+
+            1. Key discussion points
+            2. Decisions made
+            3. Concrete action items, with who assigned them and who they were assigned to
+
+        Merge related points, and drop details that are no longer relevant, so the notes stay under 500 words.
+        Rely solely on information from the notes and transcript; do not infer or add information.
+        Respond with the updated notes only.
+        """
+
     def __init__(self, api_key: str, model_name: str = None,
-                 logger: logging.Logger = None):
+                 logger: logging.Logger = None, store_dir_path: str = None,
+                 response_cache: ResponseCache = None,
+                 retrieval: Retrieval = None, backlog: RunningTotal = None):
         if not api_key:
             raise Exception("OpenAI API key not provided, but required.")
 
         self._raw_context = deque()
         self._summary_context = ""
-        self._clean_transcript = ""
+        self._unsummarized = []
+        self._clean_transcript = Transcript()
         self._logger = logger
+        self._backlog = backlog
         if not model_name:
             model_name = "gpt-4-1106-preview"
         self._model_name = model_name
-        self._client = OpenAI(
-            api_key=api_key,
-        )
-        self._store = MemoryStore(self._client)
+        self._client = SharedClient(api_key)
+        self._response_cache = response_cache if response_cache is not None \
+            else default_response_cache
+        # If a store directory is provided, persist context there.
+        # Otherwise, just keep it in memory.
+        # Embedding requests are batched with those of other sessions
+        # using the same key.
+        batcher = get_batcher(api_key)
+        retrieval = retrieval or Retrieval.VECTOR
+        if store_dir_path:
+            self._store = FileStore(
+                self._client, store_dir_path, batcher=batcher,
+                retrieval=retrieval)
+        else:
+            self._store = MemoryStore(
+                self._client, batcher=batcher, retrieval=retrieval)
 
     def destroy(self):
         """Destroys the assistant and relevant resources"""
         self._store.destroy()
+        # Stop counting lines registered from here on, and take the ones
+        # that will never be cleaned up off the total.
+        backlog, self._backlog = self._backlog, None
+        if backlog:
+            backlog.add(-len(self._raw_context))
 
     def register_new_context(self, new_text: str, metadata: list[str] = None):
         """Registers new context (usually a transcription line)."""
         content = self._compile_ctx_content(new_text, metadata)
-        user_msg = ChatCompletionUserMessageParam(content=content, role="user")
-        self._raw_context.append(user_msg)
+        speaker = None
+        for m in metadata or []:
+            if m.startswith("Name: "):
+                speaker = sys.intern(m[len("Name: "):])
+                break
+        self._raw_context.append(RawContext(content, time.time(), speaker))
+        self._add_backlog(1)
+
+    def register_new_line(self, text: str, speaker: str = None,
+                          source: str = "voice", sent_at: float = None):
+        """Registers a new line of context from the given speaker."""
+        self._raw_context.append(RawContext(
+            text,
+            sent_at if sent_at is not None else time.time(),
+            sys.intern(speaker) if speaker is not None else None,
+            sys.intern(source)))
+        self._add_backlog(1)
 
     def get_clean_transcript(self) -> str:
         """Returns latest clean transcript."""
-        return self._clean_transcript
+        return self._clean_transcript.text()
+
+    def get_transcript_segments(self, since: int = 0) -> list[str]:
+        """Returns clean transcript segments, starting with the segment
+        with the given sequence number."""
+        return [s.text for s in self._clean_transcript[since:]]
+
+    def _add_backlog(self, amount: int):
+        backlog = self._backlog
+        if backlog:
+            backlog.add(amount)
+
+    def get_transcript_backlog(self) -> int:
+        """Returns how many context items are waiting to be cleaned up."""
+        return len(self._raw_context)
+
+    def get_transcript_lag(self) -> float:
+        """Returns how many seconds the oldest context item waiting to be
+        cleaned up has been waiting."""
+        try:
+            return time.time() - self._raw_context[0].received_at
+        except IndexError:
+            return 0
 
     async def cleanup_transcript(self) -> str:
-        """Cleans up transcript from raw context."""
+        """Cleans up transcript from raw context. If more than one batch of
+        context is waiting, cleans up several batches concurrently."""
         if self._clean_transcript_running:
             raise Exception("Clean transcript process already running")
 
@@ -116,46 +223,82 @@ class OpenAIAssistant(Assistant):
             if len(self._raw_context) == 0:
                 raise NoContextError()
 
-            # How many transcript lines to process
-            to_fetch = self._transcript_batch_size
-
-            to_process = []
-            ctx = self._raw_context
+            batches = []
+            while self._raw_context and len(
+                    batches) < self._max_concurrent_batches:
+                batches.append(self._next_transcript_batch())
+
+            results = await asyncio.gather(*[
+                self._cleanup_batch(batch) for batch in batches],
+                return_exceptions=True)
+
+            # Append results in order, stopping at the first failure so that
+            # the clean transcript never has gaps.
+            cleaned = []
+            for i, res in enumerate(results):
+                if isinstance(res, Exception):
+                    # Re-insert failed items into the queue,
+                    # to make sure they do not get lost on next attempt.
+                    for batch in reversed(batches[i:]):
+                        self._raw_context.extendleft(reversed(batch))
+                        self._add_backlog(len(batch))
+                    break
+                self._clean_transcript.append(
+                    self._new_transcript_segment(res, batches[i]))
+                self._unsummarized.append(res)
+                cleaned.append(
+                    ChatCompletionUserMessageParam(role="user", content=res))
+
+            if cleaned:
+                try:
+                    await self._store.add(cleaned)
+                except Exception as e:
+                    raise Exception(f"Failed to query OpenAI: {e}") from e
+                await self._update_summary_context()
 
-            # Fetch the next batch of transcript lines
-            while to_fetch > 0 and ctx:
-                next_line = ctx.popleft()
-                to_process.append(next_line)
-                # If we're at the end of the batch size but did not
-                # get what appears to be a full sentence, just keep going.
-                if to_fetch == 1 and "." not in next_line.content:
-                    continue
-                to_fetch -= 1
-
-            messages = to_process + [self._default_transcript_prompt]
-            try:
-                loop = asyncio.get_event_loop()
-                future = loop.run_in_executor(
-                    None, self._make_openai_request, messages)
-                res = await future
-                self._clean_transcript += f"\n\n{res}"
-                self._store.add(
-                    [ChatCompletionUserMessageParam(role="user", content=res)])
-            except Exception as e:
-                # Re-insert failed items into the queue,
-                # to make sure they do not get lost on next attempt.
-                for item in reversed(to_process):
-                    self._raw_context.appendleft(item)
+            if len(cleaned) < len(results):
+                e = results[len(cleaned)]
                 raise Exception(f"Failed to query OpenAI: {e}") from e
         finally:
             # Always reset transcript run state
             self._clean_transcript_running = False
 
-    async def query(self, custom_query: str = None) -> str:
+    async def _cleanup_batch(self, batch: list[RawContext]) -> str:
+        """Returns a cleaned up version of the given batch of context."""
+        with _cleanup_batch_seconds.time():
+            async with self._llm_calls.slot(Priority.BACKGROUND):
+                return await self._make_openai_request(
+                    build_messages(batch) + [self._default_transcript_prompt])
+
+    def _new_transcript_segment(self, text: str,
+                                batch: list[RawContext]) -> TranscriptSegment:
+        """Returns a transcript segment for the given cleaned batch."""
+        speakers = dict.fromkeys(c.speaker for c in batch if c.speaker)
+        return TranscriptSegment(
+            text=text,
+            speakers=tuple(speakers),
+            start_time=batch[0].received_at,
+            end_time=batch[-1].received_at,
+            token_count=count_tokens(text))
+
+    def _next_transcript_batch(self) -> list[RawContext]:
+        """Pops the next batch of context items to clean up, packed to the
+        configured token budget."""
+        batch, tokens = pop_batch(self._raw_context, self._transcript_batch_tokens)
+        self._add_backlog(-len(batch))
+        _cleanup_batch_lines.observe(len(batch))
+        _cleanup_batch_tokens.observe(tokens)
+        return batch
+
+    async def query(self, custom_query: str = None,
+                    on_delta: Callable[[str], None] = None) -> str:
         """Submits a query to OpenAI with the stored context if one is provided.
-        If a query is not provided, uses the default."""
+        If a query is not provided, uses the default. If a delta callback is
+        provided, streams the answer to it as it is generated."""
 
-        if not self._clean_transcript:
+        # Custom queries can be answered from a persisted store even
+        # before this assistant has cleaned up any transcript itself.
+        if not custom_query and not len(self._clean_transcript):
             raise NoContextError()
 
         input_param: ChatCompletionUserMessageParam = None
@@ -165,29 +308,66 @@ class OpenAIAssistant(Assistant):
             search_param = ChatCompletionUserMessageParam(
                 content=custom_query, role="user")
             input_param = search_param
-            ctx = self._store.gather_context(input_param, 4096)
+            ctx = await self._store.gather_context(input_param, 4096)
             if not ctx:
                 raise NoContextError()
 
         else:
-            ctx = [ChatCompletionUserMessageParam(
-                content=self._clean_transcript, role="user")]
-            input_param =ChatCompletionUserMessageParam(
+            ctx = self._summary_context_messages()
+            input_param = ChatCompletionUserMessageParam(
                 content=self._default_prompt, role="system")
-            
+
+        # The key covers the context the answer is based on, so new
+        # transcript segments which change that context invalidate it.
+        cache_key = self._response_cache.key(
+            self._model_name, custom_query, ctx)
+        res = self._response_cache.get(cache_key)
+        if res is not None:
+            return res
+
         final_ctx = ctx + [input_param]
         try:
-            loop = asyncio.get_event_loop()
-            future = loop.run_in_executor(
-                None, self._make_openai_request, final_ctx)
-            res = await future
+            async with self._llm_calls.slot(Priority.INTERACTIVE):
+                res = await self._make_openai_request(
+                    final_ctx, on_delta=on_delta)
             if not custom_query:
-                self._store.add(
+                await self._store.add(
                     [ChatCompletionUserMessageParam(role="assistant", content=res)])
+            self._response_cache.put(cache_key, res)
             return res
         except Exception as e:
             raise Exception(f"Failed to query OpenAI: {e}") from e
 
+    async def _update_summary_context(self):
+        """Folds any cleaned batches that are not yet covered by the running
+        summary context into it."""
+        if not self._unsummarized:
+            return
+        folded = len(self._unsummarized)
+        messages = self._summary_context_messages() + [
+            ChatCompletionSystemMessageParam(
+                content=self._default_summary_context_prompt, role="system")]
+        try:
+            async with self._llm_calls.slot(Priority.BACKGROUND):
+                self._summary_context = await self._make_openai_request(
+                    messages, self._summary_context_max_tokens)
+            # More batches may have been cleaned up while we were waiting.
+            del self._unsummarized[:folded]
+        except Exception as e:
+            # Leave the batches to be folded in on the next attempt.
+            if self._logger:
+                self._logger.warning(
+                    "Failed to update summary context: %s", e)
+
+    def _summary_context_messages(self) -> list[ChatCompletionMessageParam]:
+        """Returns the running summary context, followed by any cleaned
+        batches it does not cover yet."""
+        notes = self._summary_context or "No notes yet."
+        return [ChatCompletionUserMessageParam(
+            content=notes, role="user")] + [
+            ChatCompletionUserMessageParam(content=batch, role="user")
+            for batch in self._unsummarized]
+
     def _compile_ctx_content(self, new_text: str,
                              metadata: list[str] = None) -> str:
         """Compiles context content from the provided text and metadata."""
@@ -197,14 +377,29 @@ class OpenAIAssistant(Assistant):
         content += new_text
         return content
 
-    def _make_openai_request(
-            self, messages: list[ChatCompletionMessageParam]) -> str:
-        """Makes a chat completion request to OpenAI and returns the response."""
-
-        res = self._client.chat.completions.create(
-            model=self._model_name,
-            messages=messages,
-        )
+    async def _make_openai_request(
+            self, messages: list[ChatCompletionMessageParam],
+            max_tokens: int = None,
+            on_delta: Callable[[str], None] = None) -> str:
+        """Makes a chat completion request to OpenAI and returns the response.
+        If a delta callback is provided, the response is streamed to it."""
+
+        kwargs = {}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        if on_delta:
+            with _chat_seconds.labels(streamed="true").time():
+                return await self._stream_openai_request(messages, on_delta, **kwargs)
+        with _chat_seconds.labels(streamed="false").time():
+            res = await self._client.chat.completions.create(
+                model=self._model_name,
+                messages=messages,
+                **kwargs,
+            )
+        usage = getattr(res, "usage", None)
+        if usage:
+            _chat_tokens.labels(kind="prompt").inc(usage.prompt_tokens)
+            _chat_tokens.labels(kind="completion").inc(usage.completion_tokens)
 
         for choice in res.choices:
             reason = choice.finish_reason
@@ -218,3 +413,35 @@ class OpenAIAssistant(Assistant):
         raise Exception(
             "No usable choice found in OpenAI response: %s",
             res.choices)
+
+    async def _stream_openai_request(
+            self, messages: list[ChatCompletionMessageParam],
+            on_delta: Callable[[str], None], **kwargs) -> str:
+        """Makes a streaming chat completion request to OpenAI, passing each
+        piece of the answer to the given callback, and returns the full answer."""
+        stream = await self._client.chat.completions.create(
+            model=self._model_name,
+            messages=messages,
+            stream=True,
+            **kwargs,
+        )
+        # Streamed responses don't report usage, so count the prompt and
+        # the answer here.
+        _chat_tokens.labels(kind="prompt").inc(count_message_tokens(messages))
+        parts = []
+        reason = None
+        async for chunk in stream:
+            for choice in chunk.choices:
+                if choice.index != 0:
+                    continue
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                    on_delta(choice.delta.content)
+                if choice.finish_reason:
+                    reason = choice.finish_reason
+        if reason == "stop" or reason == "length":
+            answer = "".join(parts)
+            _chat_tokens.labels(kind="completion").inc(count_tokens(answer))
+            return answer
+        raise Exception(
+            f"Streamed OpenAI response finished with reason: {reason}")
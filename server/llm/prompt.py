@@ -0,0 +1,108 @@
+"""Module which builds transcript cleanup prompts from raw context, merging
+consecutive lines from the same speaker into one turn so that each turn's
+metadata is only sent once."""
+from __future__ import annotations
+
+from collections import deque
+
+from openai.types.chat import ChatCompletionMessageParam, ChatCompletionUserMessageParam
+
+from server.store.memory import count_tokens
+
+# Tokens each chat message costs on top of its content.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class RawContext:
+    """Class representing a context item waiting to be cleaned up. Items are
+    kept compact, since a long meeting can queue up many of them: speaker
+    names and sources are interned, and metadata is only rendered when the
+    item is sent to be cleaned up."""
+    __slots__ = ("text", "received_at", "speaker", "source")
+
+    text: str
+    received_at: float
+    speaker: str | None
+    # Where the text came from, such as "voice". If None, the text was
+    # registered with its metadata already rendered, and is sent as is.
+    source: str | None
+
+    def __init__(self, text: str, received_at: float,
+                 speaker: str = None, source: str = None):
+        self.text = text
+        self.received_at = received_at
+        self.speaker = speaker
+        self.source = source
+
+    def continues(self, other: RawContext) -> bool:
+        """Returns whether this item continues the other's turn."""
+        return self.source is not None and self.source == other.source \
+            and self.speaker == other.speaker
+
+
+def turn_header(item: RawContext, start_time: float) -> str:
+    """Returns the metadata prefix of a turn starting with the given item,
+    timed relative to the start of its batch."""
+    return f"[{item.speaker or 'Unknown'} | {item.source} | " \
+           f"+{_format_offset(item.received_at - start_time)}] "
+
+
+def _format_offset(seconds: float) -> str:
+    minutes, seconds = divmod(max(0, int(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def render_turns(batch: list[RawContext]) -> list[str]:
+    """Renders the given batch as turns, merging consecutive items from
+    the same speaker and source."""
+    if not batch:
+        return []
+    start_time = batch[0].received_at
+    turns = []
+    texts = []
+    for i, item in enumerate(batch):
+        if i and item.continues(batch[i - 1]):
+            texts.append(item.text)
+            continue
+        if texts:
+            turns.append(" ".join(texts))
+        header = turn_header(item, start_time) if item.source is not None else ""
+        texts = [header + item.text]
+    turns.append(" ".join(texts))
+    return turns
+
+
+def build_messages(batch: list[RawContext]) -> list[ChatCompletionUserMessageParam]:
+    """Returns the messages to send to clean up the given batch, one per turn."""
+    return [ChatCompletionUserMessageParam(content=turn, role="user")
+            for turn in render_turns(batch)]
+
+
+def count_message_tokens(messages: list[ChatCompletionMessageParam]) -> int:
+    """Returns an estimate of the prompt tokens the given messages cost."""
+    return sum(MESSAGE_OVERHEAD_TOKENS + count_tokens(m.get("content") or "")
+               for m in messages)
+
+
+def pop_batch(ctx: deque[RawContext], target_tokens: int) -> tuple[list[RawContext], int]:
+    """Pops as many items off the front of the given queue as fit in
+    roughly target_tokens prompt tokens, once merged into turns, taking
+    at least one. Returns the items and their estimated token count."""
+    batch = []
+    tokens = 0
+    while ctx:
+        item = ctx[0]
+        cost = count_tokens(item.text)
+        if not batch or not item.continues(batch[-1]):
+            cost += MESSAGE_OVERHEAD_TOKENS
+            if item.source is not None:
+                start_time = batch[0].received_at if batch else item.received_at
+                cost += count_tokens(turn_header(item, start_time))
+        if batch and tokens + cost > target_tokens:
+            break
+        batch.append(ctx.popleft())
+        tokens += cost
+    return batch, tokens
@@ -0,0 +1,101 @@
+import asyncio
+import unittest
+
+from openai.types.chat import ChatCompletionUserMessageParam
+
+from server.bench.fakes import FakeOpenAI
+from server.llm.cache import ResponseCache
+from server.llm.openai_assistant import OpenAIAssistant
+from server.store.memory import MemoryStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def message(content: str) -> ChatCompletionUserMessageParam:
+    return ChatCompletionUserMessageParam(content=content, role="user")
+
+
+class ResponseCacheTests(unittest.TestCase):
+    def test_key_normalizes_query(self):
+        ctx = [message("notes")]
+        self.assertEqual(
+            ResponseCache.key("model", "What were the action items?", ctx),
+            ResponseCache.key("model", "  what were the  action items ", ctx))
+        self.assertNotEqual(
+            ResponseCache.key("model", "action items", ctx),
+            ResponseCache.key("other", "action items", ctx))
+        self.assertNotEqual(
+            ResponseCache.key("model", "action items", ctx),
+            ResponseCache.key("model", "action items", ctx + [message("more")]))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        cache.get("a")
+        cache.put("c", "3")
+        self.assertEqual(cache.get("a"), "1")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "3")
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_size_is_bounded(self):
+        cache = ResponseCache(max_chars=10)
+        cache.put("a", "x" * 6)
+        cache.put("b", "x" * 6)
+        self.assertEqual(len(cache), 1)
+        cache.put("c", "x" * 11)
+        self.assertIsNone(cache.get("c"))
+        self.assertIsNotNone(cache.get("b"))
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        cache = ResponseCache(ttl=10, clock=clock)
+        cache.put("a", "1")
+        clock.now = 9
+        self.assertEqual(cache.get("a"), "1")
+        clock.now = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class AssistantResponseCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache()
+        self.oai = OpenAIAssistant("fake_key", response_cache=self.cache)
+        self.oai._store = MemoryStore(FakeOpenAI(dims=64))
+        self.requests = []
+
+        async def answer(messages, max_tokens=None, on_delta=None):
+            self.requests.append(messages)
+            return f"answer {len(self.requests)}"
+        self.oai._make_openai_request = answer
+
+    def speak(self, text: str):
+        self.oai.register_new_context(text, ["Name: Liza", "voice"])
+        asyncio.run(self.oai.cleanup_transcript())
+
+    def test_repeated_queries_are_cached(self):
+        self.speak("We agreed that Liza will send the budget.")
+        requests = len(self.requests)
+
+        first = asyncio.run(self.oai.query("What were the action items?"))
+        second = asyncio.run(self.oai.query("what were the action items"))
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.requests), requests + 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_summary_is_invalidated_by_new_segments(self):
+        self.speak("We agreed that Liza will send the budget.")
+        first = asyncio.run(self.oai.query())
+        self.assertEqual(asyncio.run(self.oai.query()), first)
+
+        self.speak("We also agreed to meet again on Friday.")
+        self.assertNotEqual(asyncio.run(self.oai.query()), first)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
@@ -0,0 +1,136 @@
+import asyncio
+import random
+import threading
+import time
+import unittest
+from datetime import datetime
+
+from server.bench.fakes import FakeOpenAI
+from server.llm.openai_assistant import OpenAIAssistant
+from server.llm.prompt import build_messages
+from server.store.memory import MemoryStore
+
+
+class StubLLM:
+    """Cleans up batches by echoing their content after a delay, and
+    answers summary context requests immediately."""
+
+    def __init__(self, latency: float, jitter: float = 0):
+        self.latency = latency
+        self.jitter = jitter
+
+    async def __call__(self, messages, max_tokens=None, on_delta=None):
+        if max_tokens:
+            return "notes"
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        return " ".join(m["content"] for m in messages[:-1])
+
+
+def new_assistant(llm: StubLLM) -> OpenAIAssistant:
+    oai = OpenAIAssistant("fake_key")
+    oai._store = MemoryStore(FakeOpenAI(dims=16))
+    oai._make_openai_request = llm
+    return oai
+
+
+class CleanupTranscriptTests(unittest.TestCase):
+    def test_concurrent_batches_are_appended_in_order(self):
+        oai = new_assistant(StubLLM(latency=0.01, jitter=0.05))
+        oai._transcript_batch_tokens = 20
+        lines = [f"Line {i}." for i in range(60)]
+        for line in lines:
+            oai.register_new_context(line)
+
+        while oai.get_transcript_backlog():
+            asyncio.run(oai.cleanup_transcript())
+
+        got = oai.get_clean_transcript().split()
+        self.assertEqual(got, " ".join(lines).split())
+
+    def test_failed_batch_and_later_batches_are_requeued(self):
+        calls = []
+
+        async def fail_second(messages, max_tokens=None, on_delta=None):
+            if max_tokens:
+                return "notes"
+            calls.append(messages)
+            if len(calls) == 2:
+                raise Exception("boom")
+            return messages[0]["content"]
+
+        oai = new_assistant(StubLLM(latency=0))
+        oai._make_openai_request = fail_second
+        oai._transcript_batch_tokens = 1
+        for i in range(6):
+            oai.register_new_context(f"Line {i}.")
+
+        with self.assertRaises(Exception):
+            asyncio.run(oai.cleanup_transcript())
+        self.assertEqual(oai.get_clean_transcript().split(), ["Line", "0."])
+        self.assertEqual(oai.get_transcript_backlog(), 5)
+        self.assertEqual(oai._raw_context[0].text, "Line 1.")
+
+    def test_new_lines_keep_their_metadata_until_cleaned_up(self):
+        oai = new_assistant(StubLLM(latency=0))
+        sent_at = datetime(2023, 11, 13, 23, 24, 10, 123456).timestamp()
+        oai.register_new_line("a test msg", "Liza", "voice", sent_at)
+        oai.register_new_line("another msg", None, "voice", sent_at + 75)
+
+        first, second = oai._raw_context
+        self.assertEqual((first.speaker, first.source, first.received_at),
+                         ("Liza", "voice", sent_at))
+        self.assertEqual((second.speaker, second.source, second.received_at),
+                         (None, "voice", sent_at + 75))
+        self.assertEqual(
+            [m["content"] for m in build_messages(list(oai._raw_context))],
+            ["[Liza | voice | +0:00] a test msg",
+             "[Unknown | voice | +1:15] another msg"])
+
+
+class CleanupLoadTests(unittest.TestCase):
+    """Feeds a synthetic transcription stream to an assistant backed by a
+    slow stub LLM, cleaning up the way Session does."""
+
+    duration = 1.5
+    lines_per_second = 300
+    interval = 0.2
+
+    def run_stream(self, max_concurrent_batches: int) -> float:
+        oai = new_assistant(StubLLM(latency=0.2))
+        oai._transcript_batch_tokens = 200
+        oai._max_concurrent_batches = max_concurrent_batches
+
+        def produce():
+            start = time.time()
+            i = 0
+            while time.time() - start < self.duration:
+                oai.register_new_context(
+                    f"This is synthetic line {i}.", ["Name: Liza", "voice"])
+                i += 1
+                time.sleep(1 / self.lines_per_second)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+
+        async def consume() -> float:
+            max_lag = 0
+            while producer.is_alive():
+                max_lag = max(max_lag, oai.get_transcript_lag())
+                try:
+                    await oai.cleanup_transcript()
+                except Exception:
+                    pass
+                if oai.get_transcript_lag() <= self.interval:
+                    await asyncio.sleep(self.interval)
+            return max_lag
+
+        max_lag = asyncio.run(consume())
+        producer.join()
+        return max_lag
+
+    def test_lag_stays_bounded_with_concurrent_batches(self):
+        concurrent_lag = self.run_stream(max_concurrent_batches=8)
+        sequential_lag = self.run_stream(max_concurrent_batches=1)
+
+        self.assertLess(concurrent_lag, 1.0)
+        self.assertGreater(sequential_lag, concurrent_lag)
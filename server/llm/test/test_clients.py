@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+
+from openai.types.chat import ChatCompletionUserMessageParam
+
+from server.bench.fakes import StubOpenAIServer
+from server.llm import clients
+from server.llm.cache import ResponseCache
+from server.llm.clients import ClientSettings, SharedClient, get_async_client
+from server.llm import openai_assistant
+from server.llm.openai_assistant import OpenAIAssistant
+
+
+def chat_tokens(kind: str) -> float:
+    return sum(v for _, labels, v in openai_assistant._chat_tokens.collect().samples
+               if labels.get("kind") == kind)
+
+
+class SharedClientTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubOpenAIServer(dims=16).start()
+
+    def tearDown(self):
+        self.server.stop()
+        clients.configure(ClientSettings.from_env())
+
+    def test_clients_are_shared_per_key_and_loop(self):
+        async def get_clients():
+            return get_async_client("a"), get_async_client("a"), get_async_client("b")
+
+        a1, a2, b = asyncio.run(get_clients())
+        self.assertIs(a1, a2)
+        self.assertIsNot(a1, b)
+
+        a3, _, _ = asyncio.run(get_clients())
+        self.assertIsNot(a1, a3)
+
+    def test_sessions_share_connection_pool(self):
+        clients.configure(ClientSettings(
+            base_url=self.server.url, max_connections=2, max_retries=0))
+        self.server.latency = 0.05
+        assistants = [OpenAIAssistant("same_key") for _ in range(5)]
+
+        async def run():
+            msg = ChatCompletionUserMessageParam(content="hi", role="user")
+            return await asyncio.gather(*[
+                a._make_openai_request([msg])
+                for a in assistants for _ in range(4)])
+
+        answers = asyncio.run(run())
+        self.assertEqual(answers, ["Echo: hi"] * 20)
+        self.assertEqual(self.server.requests, 20)
+        self.assertLessEqual(self.server.connections, 2)
+
+    def test_store_uses_shared_client(self):
+        clients.configure(ClientSettings(base_url=self.server.url))
+        assistant = OpenAIAssistant(
+            "same_key", response_cache=ResponseCache())
+
+        async def run():
+            await assistant._store.add([ChatCompletionUserMessageParam(
+                content="the budget for next quarter", role="user")])
+            return await assistant.query("budget")
+
+        self.assertTrue(asyncio.run(run()).startswith("Echo: budget"))
+        self.assertEqual(self.server.requests, 3)
+
+    def test_failed_requests_are_retried(self):
+        clients.configure(ClientSettings(
+            base_url=self.server.url, max_retries=1))
+        self.server.fail_first = 1
+
+        async def run():
+            return await SharedClient("key").models.list()
+
+        asyncio.run(run())
+        self.assertEqual(self.server.requests, 2)
+
+    def test_answers_are_streamed(self):
+        clients.configure(ClientSettings(base_url=self.server.url))
+        assistant = OpenAIAssistant(
+            "same_key", response_cache=ResponseCache())
+        deltas = []
+
+        async def run():
+            await assistant._store.add([ChatCompletionUserMessageParam(
+                content="the budget for next quarter", role="user")])
+            return await assistant.query("budget", deltas.append)
+
+        answer = asyncio.run(run())
+        self.assertTrue(answer.startswith("Echo: budget"))
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual("".join(deltas), answer)
+
+    def test_streamed_answers_count_prompt_tokens(self):
+        clients.configure(ClientSettings(base_url=self.server.url))
+        assistant = OpenAIAssistant(
+            "same_key", response_cache=ResponseCache())
+        prompt, completion = chat_tokens("prompt"), chat_tokens("completion")
+
+        async def run():
+            await assistant._store.add([ChatCompletionUserMessageParam(
+                content="the budget for next quarter", role="user")])
+            return await assistant.query("budget", lambda delta: None)
+
+        asyncio.run(run())
+        self.assertGreater(chat_tokens("prompt"), prompt)
+        self.assertGreater(chat_tokens("completion"), completion)
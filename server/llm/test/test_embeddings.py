@@ -0,0 +1,112 @@
+import asyncio
+import gc
+import unittest
+
+import numpy
+from openai.types.chat import ChatCompletionUserMessageParam
+
+from server.bench.fakes import StubOpenAIServer
+from server.llm import clients
+from server.llm.clients import ClientSettings, SharedClient
+from server.llm import embeddings
+from server.llm.embeddings import EmbeddingBatcher, get_batcher
+from server.llm.openai_assistant import OpenAIAssistant
+
+
+class EmbeddingBatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubOpenAIServer(dims=16).start()
+        clients.configure(ClientSettings(
+            base_url=self.server.url, max_retries=0))
+
+    def tearDown(self):
+        self.server.stop()
+        clients.configure(ClientSettings.from_env())
+
+    def assert_embeddings(self, inputs: list[str], got: list[list[float]]):
+        self.assertEqual(len(got), len(inputs))
+        for text, vector in zip(inputs, got):
+            numpy.testing.assert_allclose(
+                vector, self.server.embedder.embed(text))
+
+    def test_concurrent_callers_share_a_request(self):
+        batcher = EmbeddingBatcher(SharedClient("key"))
+        inputs = [[f"caller {i} line {j}" for j in range(i + 1)]
+                  for i in range(10)]
+
+        async def run():
+            return await asyncio.gather(*[batcher.embed(i) for i in inputs])
+
+        results = asyncio.run(run())
+        self.assertEqual(self.server.requests, 1)
+        for caller_inputs, got in zip(inputs, results):
+            self.assert_embeddings(caller_inputs, got)
+
+    def test_batches_are_split_at_max_size(self):
+        batcher = EmbeddingBatcher(SharedClient("key"), max_batch_size=4,
+                                   max_wait=10)
+        inputs = [[f"caller {i} line {j}" for j in range(3)]
+                  for i in range(4)]
+
+        async def run():
+            return await asyncio.gather(*[batcher.embed(i) for i in inputs])
+
+        # The size threshold flushed the batches, long before max_wait.
+        results = asyncio.run(asyncio.wait_for(run(), 5))
+        # Callers' inputs are not split, so each batch serves one caller.
+        self.assertEqual(self.server.requests, 4)
+        for caller_inputs, got in zip(inputs, results):
+            self.assert_embeddings(caller_inputs, got)
+
+    def test_failure_is_raised_to_every_caller(self):
+        self.server.fail_first = 1
+        batcher = EmbeddingBatcher(SharedClient("key"))
+
+        async def run():
+            return await asyncio.gather(
+                batcher.embed(["a"]), batcher.embed(["b"]),
+                return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(r, Exception) for r in results))
+        self.assert_embeddings(["c"], asyncio.run(batcher.embed(["c"])))
+
+    def test_cancelled_caller_does_not_affect_others(self):
+        batcher = EmbeddingBatcher(SharedClient("key"), max_wait=0.05)
+
+        async def run():
+            cancelled = asyncio.create_task(batcher.embed(["a"]))
+            other = asyncio.create_task(batcher.embed(["b"]))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            return await other
+
+        self.assert_embeddings(["b"], asyncio.run(run()))
+        self.assertEqual(self.server.requests, 1)
+
+    def test_sessions_sharing_a_key_share_requests(self):
+        assistants = [OpenAIAssistant("shared_key") for _ in range(8)]
+        self.assertIs(assistants[0]._store._batcher, get_batcher("shared_key"))
+
+        async def run():
+            await asyncio.gather(*[
+                a._store.add([ChatCompletionUserMessageParam(
+                    content=f"session {i} notes", role="user")])
+                for i, a in enumerate(assistants)])
+
+        asyncio.run(run())
+        self.assertEqual(self.server.requests, 1)
+        for a in assistants:
+            self.assertEqual(a._store._size, 1)
+
+    def test_batcher_is_dropped_with_its_last_store(self):
+        assistant = OpenAIAssistant("short_lived_key")
+        self.assertIs(assistant._store._batcher, get_batcher("short_lived_key"))
+        self.assertIn(("short_lived_key", "text-embedding-ada-002"),
+                      embeddings._batchers)
+
+        assistant.destroy()
+        del assistant
+        gc.collect()
+        self.assertNotIn(("short_lived_key", "text-embedding-ada-002"),
+                         embeddings._batchers)
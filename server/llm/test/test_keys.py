@@ -0,0 +1,70 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from server.bench.fakes import StubOpenAIServer
+from server.llm import clients, keys
+from server.llm.clients import ClientSettings
+from server.llm.keys import probe_api_key
+
+
+class ProbeApiKeyTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubOpenAIServer(dims=16, latency=0.2).start()
+        clients.configure(ClientSettings(
+            base_url=self.server.url, max_retries=0))
+        keys.clear()
+
+    def tearDown(self):
+        self.server.stop()
+        clients.configure(ClientSettings.from_env())
+        keys.clear()
+
+    def test_key_is_probed_once_within_ttl(self):
+        max_gap = 0
+
+        async def tick(done: asyncio.Event):
+            nonlocal max_gap
+            last = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                max_gap = max(max_gap, now - last)
+                last = now
+
+        async def run():
+            done = asyncio.Event()
+            ticker = asyncio.create_task(tick(done))
+            first = await asyncio.gather(
+                *[probe_api_key("key") for _ in range(5)])
+            second = await probe_api_key("key")
+            done.set()
+            await ticker
+            return first + [second]
+
+        self.assertEqual(asyncio.run(run()), [True] * 6)
+        self.assertEqual(self.server.requests, 1)
+        # The loop kept running while the probe was in flight.
+        self.assertLess(max_gap, self.server.latency / 2)
+
+    def test_key_is_probed_again_after_ttl(self):
+        asyncio.run(probe_api_key("key"))
+        with mock.patch.object(keys, "probe_ttl", 0):
+            keys.clear()
+            asyncio.run(probe_api_key("key"))
+            asyncio.run(probe_api_key("key"))
+        self.assertEqual(self.server.requests, 3)
+
+    def test_invalid_key_is_cached(self):
+        self.server.invalid_keys.add("bad")
+        self.assertFalse(asyncio.run(probe_api_key("bad")))
+        self.assertFalse(asyncio.run(probe_api_key("bad")))
+        self.assertTrue(asyncio.run(probe_api_key("good")))
+        self.assertEqual(self.server.requests, 2)
+
+    def test_transient_failure_is_not_cached(self):
+        self.server.fail_first = 1
+        self.assertFalse(asyncio.run(probe_api_key("key")))
+        self.assertTrue(asyncio.run(probe_api_key("key")))
+        self.assertEqual(self.server.requests, 2)
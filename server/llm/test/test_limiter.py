@@ -0,0 +1,103 @@
+import asyncio
+import time
+import unittest
+
+from openai.types.chat import ChatCompletionUserMessageParam
+
+from server.bench.fakes import FakeOpenAI
+from server.llm.cache import ResponseCache
+from server.llm.limiter import Priority, PrioritySemaphore
+from server.llm.openai_assistant import OpenAIAssistant
+from server.store.memory import MemoryStore
+
+
+class PrioritySemaphoreTests(unittest.IsolatedAsyncioTestCase):
+    async def test_interactive_waiters_go_first(self):
+        sem = PrioritySemaphore(1)
+        order = []
+
+        async def call(name: str, priority: Priority):
+            async with sem.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        await sem.acquire()
+        tasks = [asyncio.create_task(call(f"cleanup {i}", Priority.BACKGROUND))
+                 for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(call("query", Priority.INTERACTIVE)))
+        await asyncio.sleep(0)
+        self.assertEqual(sem.waiting, 4)
+        sem.release()
+        await asyncio.gather(*tasks)
+
+        self.assertEqual(order, ["query", "cleanup 0", "cleanup 1", "cleanup 2"])
+        self.assertEqual(sem.in_use, 0)
+
+    async def test_cancelled_waiter_does_not_leak(self):
+        sem = PrioritySemaphore(1)
+        await sem.acquire()
+        waiter = asyncio.create_task(sem.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        sem.release()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+
+        self.assertEqual(sem.in_use, 0)
+        await asyncio.wait_for(sem.acquire(), 1)
+
+    async def test_raising_limit_admits_waiters(self):
+        sem = PrioritySemaphore(1)
+        await sem.acquire()
+        waiter = asyncio.create_task(sem.acquire())
+        await asyncio.sleep(0)
+        sem.set_limit(2)
+        await asyncio.wait_for(waiter, 1)
+        self.assertEqual(sem.in_use, 2)
+
+
+class LLMCallLoadTests(unittest.TestCase):
+    """Overloads a few assistants with transcript cleanup work, and checks
+    that queries are still answered promptly."""
+
+    latency = 0.05
+
+    def setUp(self):
+        self.limiter = PrioritySemaphore(2)
+        self.assistants = []
+        for _ in range(5):
+            oai = OpenAIAssistant("fake_key", response_cache=ResponseCache())
+            fake = FakeOpenAI(dims=64, latency=self.latency)
+            oai._client = fake
+            oai._store = MemoryStore(fake)
+            oai._llm_calls = self.limiter
+            oai._transcript_batch_tokens = 50
+            self.assistants.append(oai)
+
+    def test_query_latency_is_bounded_under_cleanup_load(self):
+        async def run() -> float:
+            await self.assistants[0]._store.add([ChatCompletionUserMessageParam(
+                content="The budget was approved.", role="user")])
+            for oai in self.assistants:
+                for i in range(200):
+                    oai.register_new_context(
+                        f"We discussed item {i} of the budget.", ["Name: Liza"])
+            cleanups = [asyncio.create_task(oai.cleanup_transcript())
+                        for oai in self.assistants]
+            await asyncio.sleep(self.latency / 2)
+            # Every slot is taken by cleanup, with more cleanup waiting.
+            self.assertEqual(self.limiter.in_use, 2)
+            self.assertGreater(self.limiter.waiting, 10)
+
+            start = time.perf_counter()
+            await self.assistants[0].query("What about the budget?")
+            elapsed = time.perf_counter() - start
+            await asyncio.gather(*cleanups)
+            return elapsed
+
+        elapsed = asyncio.run(run())
+        # The query waits for at most one cleanup call to finish, plus its
+        # own embedding and completion, rather than for the whole backlog.
+        self.assertLess(elapsed, 5 * self.latency)
@@ -0,0 +1,57 @@
+import unittest
+from collections import deque
+
+from server.llm.prompt import RawContext, build_messages, pop_batch, render_turns
+from server.store.memory import count_tokens
+
+
+def line(text: str, at: float, speaker: str = "Liza") -> RawContext:
+    return RawContext(text, at, speaker, "voice")
+
+
+class CleanupPromptTests(unittest.TestCase):
+    def test_consecutive_lines_are_merged_into_turns(self):
+        batch = [line("So the budget", 100), line("is tight.", 101.5),
+                 line("Agreed.", 112, "Tasha"), line("Let's cut travel.", 175),
+                 line("Fine.", 176, None)]
+        self.assertEqual(render_turns(batch), [
+            "[Liza | voice | +0:00] So the budget is tight.",
+            "[Tasha | voice | +0:12] Agreed.",
+            "[Liza | voice | +1:15] Let's cut travel.",
+            "[Unknown | voice | +1:16] Fine.",
+        ])
+        self.assertEqual(len(build_messages(batch)), 4)
+
+    def test_prerendered_context_is_sent_as_is(self):
+        batch = [RawContext("[Liza | chat] hi", 100), RawContext("there", 101),
+                 line("hello", 102)]
+        self.assertEqual(render_turns(batch), [
+            "[Liza | chat] hi", "there", "[Liza | voice | +0:02] hello"])
+
+    def test_long_offsets_include_hours(self):
+        batch = [line("a", 0), line("b", 3725, "Tasha")]
+        self.assertEqual(render_turns(batch)[1], "[Tasha | voice | +1:02:05] b")
+
+    def test_batches_are_packed_to_target(self):
+        ctx = deque(line(f"This is line {i} of the meeting.", i,
+                         ["Liza", "Tasha"][i // 5 % 2])
+                    for i in range(100))
+        target = 120
+        batches = []
+        while ctx:
+            batch, tokens = pop_batch(ctx, target)
+            self.assertLessEqual(tokens, target)
+            content = sum(count_tokens(t) for t in render_turns(batch))
+            self.assertLessEqual(content, tokens)
+            batches.append(batch)
+        self.assertEqual(sum(len(b) for b in batches), 100)
+        # Batches are full, apart from the last.
+        for batch in batches[:-1]:
+            self.assertGreater(len(batch), 5)
+
+    def test_oversized_item_is_taken_alone(self):
+        ctx = deque([line("word " * 50, 0), line("next", 1)])
+        batch, tokens = pop_batch(ctx, 10)
+        self.assertEqual(len(batch), 1)
+        self.assertGreater(tokens, 10)
+        self.assertEqual(len(ctx), 1)
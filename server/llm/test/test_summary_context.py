@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+
+from server.bench.fakes import FakeOpenAI
+from server.llm.cache import ResponseCache
+from server.llm.openai_assistant import OpenAIAssistant
+from server.store.memory import MemoryStore
+
+
+class StubLLM:
+    """Records chat completion requests and answers each with a distinct,
+    fixed-size response."""
+
+    def __init__(self):
+        self.requests = []
+
+    async def __call__(self, messages, max_tokens=None, on_delta=None):
+        self.requests.append(messages)
+        return f"word{len(self.requests):04d} " + "word " * 99
+
+
+def prompt_size(messages) -> int:
+    return sum(len(m["content"]) for m in messages)
+
+
+class SummaryContextTests(unittest.TestCase):
+    def setUp(self):
+        self.oai = OpenAIAssistant("fake_key", response_cache=ResponseCache())
+        self.oai._store = MemoryStore(FakeOpenAI(dims=16))
+        self.llm = StubLLM()
+        self.oai._make_openai_request = self.llm
+
+    def speak(self, lines: int):
+        for i in range(lines):
+            self.oai.register_new_context(
+                f"This is transcription line {i}.", ["Name: Liza", "voice"])
+
+    def test_summary_prompt_size_is_constant(self):
+        sizes = []
+        transcript_sizes = []
+        for _ in range(10):
+            self.speak(25)
+            asyncio.run(self.oai.cleanup_transcript())
+            asyncio.run(self.oai.query())
+            sizes.append(prompt_size(self.llm.requests[-1]))
+            transcript_sizes.append(len(self.oai.get_clean_transcript()))
+
+        self.assertEqual(len(set(sizes)), 1)
+        self.assertGreaterEqual(transcript_sizes[-1], 10 * transcript_sizes[0])
+
+    def test_failed_fold_is_retried_with_next_batch(self):
+        async def fail_fold(messages, max_tokens=None, on_delta=None):
+            if max_tokens:
+                raise Exception("fold failed")
+            return "clean batch"
+        self.oai._make_openai_request = fail_fold
+
+        self.speak(25)
+        asyncio.run(self.oai.cleanup_transcript())
+        self.assertEqual(self.oai._unsummarized, ["clean batch"])
+
+        self.oai._make_openai_request = self.llm
+        self.speak(25)
+        asyncio.run(self.oai.cleanup_transcript())
+        self.assertEqual(self.oai._unsummarized, [])
+        fold_request = self.llm.requests[-1]
+        self.assertEqual(fold_request[1]["content"], "clean batch")
@@ -0,0 +1,54 @@
+import unittest
+
+from server.llm.transcript import Transcript, TranscriptSegment
+
+
+def segment(i: int, tokens: int = 10) -> TranscriptSegment:
+    return TranscriptSegment(text=f"segment {i}", speakers=("Liza",),
+                             start_time=i * 10, end_time=i * 10 + 9,
+                             token_count=tokens)
+
+
+class TranscriptTests(unittest.TestCase):
+    def setUp(self):
+        self.transcript = Transcript()
+        for i in range(10):
+            self.transcript.append(segment(i))
+
+    def test_text_is_joined_lazily_and_incrementally(self):
+        t = Transcript()
+        self.assertEqual(t.text(), "")
+        t.append(segment(0))
+        self.assertEqual(t.text(), "segment 0")
+        t.append(segment(1))
+        t.append(segment(2))
+        self.assertEqual(t.text(), "segment 0\n\nsegment 1\n\nsegment 2")
+        self.assertEqual(t.text(since=2), "segment 2")
+
+    def test_range_access(self):
+        self.assertEqual(len(self.transcript), 10)
+        self.assertEqual(self.transcript.token_count, 100)
+        self.assertEqual([s.text for s in self.transcript[8:]],
+                         ["segment 8", "segment 9"])
+
+    def test_window_by_time(self):
+        got = self.transcript.window(start_time=25, end_time=41)
+        self.assertEqual([s.text for s in got],
+                         ["segment 2", "segment 3", "segment 4"])
+
+    def test_window_by_end_time(self):
+        got = self.transcript.window(end_time=30)
+        self.assertEqual([s.text for s in got],
+                         ["segment 0", "segment 1", "segment 2", "segment 3"])
+        got = self.transcript.window(end_time=29.5)
+        self.assertEqual(len(got), 3)
+        self.assertEqual(self.transcript.window(end_time=-1), [])
+        self.assertEqual(self.transcript.window(start_time=50, end_time=20), [])
+
+    def test_window_by_token_budget(self):
+        got = self.transcript.window(max_tokens=35)
+        self.assertEqual([s.text for s in got],
+                         ["segment 7", "segment 8", "segment 9"])
+
+        got = self.transcript.window(end_time=45, max_tokens=20)
+        self.assertEqual([s.text for s in got], ["segment 3", "segment 4"])
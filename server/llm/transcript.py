@@ -0,0 +1,100 @@
+"""Module defining a clean transcript made up of immutable segments."""
+from __future__ import annotations
+
+import bisect
+import dataclasses
+
+
+@dataclasses.dataclass(frozen=True)
+class TranscriptSegment:
+    """Class representing one cleaned-up batch of the transcript"""
+    text: str
+    speakers: tuple[str, ...]
+    start_time: float
+    end_time: float
+    token_count: int
+
+
+class Transcript:
+    """Class representing a clean transcript as an ordered list of segments.
+    Appends are O(1). The full text is joined when it is asked for: the
+    first read after new segments were appended copies the whole text once,
+    like appending to a single string did, and later reads are free."""
+
+    separator = "\n\n"
+
+    _segments: list[TranscriptSegment]
+    # Running token totals, so that _token_totals[i] is the token count
+    # of the first i segments.
+    _token_totals: list[int]
+    # Start and end times of each segment, kept sorted for lookups.
+    _start_times: list[float]
+    _end_times: list[float]
+    # Joined text of the first _joined_count segments.
+    _joined: str
+    _joined_count: int
+
+    def __init__(self):
+        self._segments = []
+        self._token_totals = [0]
+        self._start_times = []
+        self._end_times = []
+        self._joined = ""
+        self._joined_count = 0
+
+    def __len__(self) -> int:
+        return len(self._segments)
+
+    def __getitem__(self, index):
+        return self._segments[index]
+
+    @property
+    def token_count(self) -> int:
+        return self._token_totals[-1]
+
+    def append(self, segment: TranscriptSegment):
+        """Appends the given segment to the end of the transcript."""
+        self._segments.append(segment)
+        self._token_totals.append(self._token_totals[-1] + segment.token_count)
+        # Segments are usually appended in time order, but keep times
+        # sorted for lookups regardless.
+        self._start_times.append(_at_least(self._start_times, segment.start_time))
+        self._end_times.append(_at_least(self._end_times, segment.end_time))
+
+    def text(self, since: int = 0) -> str:
+        """Returns the text of all segments starting with the given index."""
+        if since:
+            return self.separator.join(s.text for s in self._segments[since:])
+        if self._joined_count < len(self._segments):
+            new = self.separator.join(
+                s.text for s in self._segments[self._joined_count:])
+            self._joined = self.separator.join((self._joined, new)) \
+                if self._joined_count else new
+            self._joined_count = len(self._segments)
+        return self._joined
+
+    def window(self, start_time: float = None, end_time: float = None,
+               max_tokens: int = None) -> list[TranscriptSegment]:
+        """Returns the segments overlapping the given time range. If a token
+        budget is given, returns only the latest of those segments that
+        fit within it."""
+        lo = 0
+        if start_time is not None:
+            lo = bisect.bisect_left(self._end_times, start_time)
+        hi = len(self._segments)
+        if end_time is not None:
+            hi = max(lo, bisect.bisect_right(self._start_times, end_time))
+        if max_tokens is not None:
+            # Find the earliest segment such that it and everything after
+            # it up to hi fits the budget.
+            budget_lo = bisect.bisect_left(
+                self._token_totals, self._token_totals[hi] - max_tokens)
+            lo = max(lo, budget_lo)
+        return self._segments[lo:hi]
+
+
+def _at_least(times: list[float], t: float) -> float:
+    """Returns the given time, raised to the last of the given times."""
+    if times and t < times[-1]:
+        return times[-1]
+    return t
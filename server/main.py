@@ -1,4 +1,5 @@
 """This module defines all the routes for the Daily AI assistant server."""
+import asyncio
 import json
 import os
 import sys
@@ -12,9 +13,12 @@ from quart.cli import load_dotenv
 from quart_cors import cors
 from quart import Quart, jsonify, Response, request
 
+from server import metrics
 from server.config import BotConfig
-from server.call.operator import Operator
-from server.llm.openai_assistant import probe_api_key
+from server.call.operator import CapacityError, Operator
+from server.call.sharding import ShardedOperator, WorkerError
+from server.llm.keys import probe_api_key
+from server.store.memory import Retrieval
 
 dotenv_path = join(dirname(dirname(abspath(__file__))), '.env')
 load_dotenv(dotenv_path)
@@ -24,12 +28,25 @@ print("Running AI assistant server")
 
 # Note that this is not a secure CORS configuration for production.
 cors(app, allow_origin="*", allow_headers=["content-type"])
-operator = Operator()
+operator: Operator | ShardedOperator = None
+# How sessions rank context for custom queries, validated at startup.
+retrieval: Retrieval | None = None
 
 
 @app.before_serving
 async def init():
+    """Starts the operator. If SESSION_WORKERS is set above 1, sessions are
+    spread over that many worker processes instead of running in this one.
+    Fails if RETRIEVAL is set to an unknown mode."""
+    global operator, retrieval
+    if os.environ.get("RETRIEVAL"):
+        retrieval = Retrieval(os.environ["RETRIEVAL"])
     Daily.init()
+    num_workers = int(os.environ.get("SESSION_WORKERS") or 1)
+    if num_workers > 1:
+        operator = ShardedOperator(num_workers)
+    else:
+        operator = Operator()
 
 
 @app.after_serving
@@ -47,6 +64,14 @@ async def index():
     return {}, 200
 
 
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """Exposes server metrics in the Prometheus text format"""
+    families = await asyncio.to_thread(operator.collect_metrics)
+    return Response(metrics.render(families),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.route('/session', methods=['POST'])
 async def create_session():
     """Creates a session, which includes creating a Daily room
@@ -66,21 +91,36 @@ async def create_session():
     if not room_url or not openai_api_key:
         return process_error(err_msg, 400)
 
-    if probe_api_key(openai_api_key) is False:
+    if await probe_api_key(openai_api_key) is False:
         return process_error("Invalid OpenAI API key", 401)
 
     openai_model_name = data.get("openai_model_name")
     if not openai_model_name:
         openai_model_name = os.environ.get("OPENAI_MODEL_NAME")
     meeting_token = data.get("meeting_token")
-
-    c = BotConfig(openai_api_key, openai_model_name, room_url, meeting_token)
-    session = operator.create_session(c)
-    if session:
-        session.start()
-    return jsonify({
+    store_dir_path = os.environ.get("STORE_DIR_PATH")
+
+    c = BotConfig(openai_api_key, openai_model_name, room_url, meeting_token,
+                  store_dir_path=store_dir_path, retrieval=retrieval)
+    # Starting a session may wait on a worker process, so keep it
+    # off the event loop.
+    try:
+        session_id, _ = await asyncio.to_thread(operator.start_session, c)
+    except CapacityError as e:
+        response, code = process_error(
+            "Server is at capacity, please retry later", 503)
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, code
+    except WorkerError as e:
+        # The room's worker died and is being restarted, so the room can
+        # get a new session on retry.
+        return process_error("Session worker failed, please retry", 503, e)
+    response = {
         "room_url": room_url
-    }), 200
+    }
+    if session_id:
+        response["session_id"] = session_id
+    return jsonify(response), 200
 
 
 def process_error(msg: str, code=500, error: Exception = None,
@@ -0,0 +1,278 @@
+"""Module providing lightweight, thread-safe metrics, which are exposed in
+the Prometheus text format. Recording a sample only takes a lock and a few
+arithmetic operations, so instrumentation can stay on in production."""
+from __future__ import annotations
+
+import bisect
+import contextlib
+import dataclasses
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Iterator
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+@dataclasses.dataclass
+class Family:
+    """Class representing a metric and its samples at a point in time"""
+    name: str
+    type: str
+    help: str
+    # Each sample is a name, its labels and its value.
+    samples: list[tuple[str, dict[str, str], float]]
+
+
+class _Metric(ABC):
+    """Base class for metrics, which may be split by label values."""
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, **labels: str):
+        """Returns the child metric for the given label values."""
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def remove(self, **labels: str):
+        """Stops exposing the child metric for the given label values."""
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            self._children.pop(key, None)
+
+    def collect(self) -> Family:
+        with self._lock:
+            children = list(self._children.items())
+        samples = []
+        for key, child in children:
+            labels = dict(zip(self.labelnames, key))
+            samples.extend(child.samples(self.name, labels))
+        return Family(self.name, self.type, self.help, samples)
+
+    @abstractmethod
+    def _new_child(self):
+        """Returns a new child metric, for one set of label values."""
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def samples(self, name: str, labels: dict[str, str]):
+        return [(f"{name}_total", labels, self._value)]
+
+
+class Counter(_Metric):
+    """Metric which only goes up, such as a number of requests."""
+    type = "counter"
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+        self._function = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """Makes the gauge report the result of the given function, which
+        is called whenever metrics are collected."""
+        self._function = function
+
+    def samples(self, name: str, labels: dict[str, str]):
+        value = self._function() if self._function else self._value
+        return [(name, labels, value)]
+
+
+class Gauge(_Metric):
+    """Metric which can go up and down, such as a queue length."""
+    type = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple[float, ...]):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        """Observes how many seconds the block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name: str, labels: dict[str, str]):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self._buckets + (math.inf,), counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else repr(float(bound))
+            samples.append((f"{name}_bucket", {**labels, "le": le}, cumulative))
+        samples.append((f"{name}_sum", labels, total))
+        samples.append((f"{name}_count", labels, cumulative))
+        return samples
+
+
+class Histogram(_Metric):
+    """Metric which counts observations, such as latencies, in buckets."""
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+class Registry:
+    """Class holding the metrics to expose."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise Exception(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def collect(self) -> list[Family]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return [m.collect() for m in metrics]
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name: str, help: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: tuple[str, ...] = (),
+              buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def merge(families: list[Family], more: list[Family],
+          labels: dict[str, str]) -> list[Family]:
+    """Returns the given families, with the samples of the other families
+    added to them under the given extra labels."""
+    by_name = {f.name: f for f in families}
+    for family in more:
+        samples = [(n, {**labels, **l}, v) for n, l, v in family.samples]
+        if family.name in by_name:
+            by_name[family.name].samples.extend(samples)
+        else:
+            by_name[family.name] = Family(
+                family.name, family.type, family.help, samples)
+    return list(by_name.values())
+
+
+def render(families: list[Family]) -> str:
+    """Renders the given metrics in the Prometheus text exposition format."""
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {family.name} {_escape_help(family.help)}")
+        lines.append(f"# TYPE {family.name} {family.type}")
+        for name, labels, value in family.samples:
+            if labels:
+                pairs = ",".join(f'{k}="{_escape_label(v)}"'
+                                 for k, v in labels.items())
+                name = f"{name}{{{pairs}}}"
+            lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
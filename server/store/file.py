@@ -0,0 +1,125 @@
+"""Module that defines a store persisted to the local file system."""
+import json
+import os
+
+import numpy
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessageParam
+
+from server.config import ensure_dir
+from server.llm.embeddings import EmbeddingBatcher
+from server.store.memory import MemoryStore, Retrieval
+
+
+class FileStore(MemoryStore):
+    """Store which appends embeddings to a memory-mapped file and params to an
+    append-only log, so that an index survives restarts and embeddings do not
+    have to be held in memory."""
+    _dir_path: str
+    _dims: int | None
+
+    _index_file_name = "index.json"
+    _embeddings_file_name = "embeddings.f32"
+    _params_file_name = "params.jsonl"
+
+    def __init__(self, client: AsyncOpenAI, dir_path: str, chunk_size: int = 500,
+                 chunk_overlap: int = 0, batcher: EmbeddingBatcher = None,
+                 retrieval: Retrieval = Retrieval.VECTOR):
+        super().__init__(client, chunk_size, chunk_overlap, batcher, retrieval)
+        self._dir_path = dir_path
+        self._dims = None
+        ensure_dir(dir_path)
+        self._load()
+
+    @property
+    def dir_path(self) -> str:
+        return self._dir_path
+
+    def destroy(self):
+        """Releases stored messages and embeddings from memory.
+        Persisted files are kept, to be loaded by the next store using
+        the same directory."""
+        with self._lock:
+            if isinstance(self._embeddings, numpy.memmap):
+                self._embeddings.flush()
+        super().destroy()
+
+    def _load(self):
+        """Loads a previously persisted index from the store directory."""
+        index_path = self._path(self._index_file_name)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, encoding="utf-8") as f:
+            self._dims = json.load(f)["dims"]
+
+        params = []
+        token_counts = []
+        params_path = self._path(self._params_file_name)
+        if os.path.exists(params_path):
+            with open(params_path, "rb+") as f:
+                valid_bytes = 0
+                for line in f:
+                    # A torn final line means we crashed mid-write. Drop it,
+                    # since its embedding may not have been fully written.
+                    if not line.endswith(b"\n"):
+                        break
+                    record = json.loads(line)
+                    token_counts.append(record.pop("tokens"))
+                    params.append(record)
+                    valid_bytes += len(line)
+                f.truncate(valid_bytes)
+
+        stored_rows = self._stored_rows()
+        if len(params) > stored_rows:
+            raise Exception(
+                f"Store at {self._dir_path} has {len(params)} params but only {stored_rows} embeddings.")
+
+        with self._lock:
+            self._reserve(len(params), self._dims)
+            self._token_counts[:len(params)] = token_counts
+            self._size = len(params)
+            self._params = params
+            self._index.add([p.get("content") for p in params])
+
+    def _append(self, params: list[ChatCompletionMessageParam],
+                vectors: numpy.ndarray, token_counts: list[int]):
+        """Appends the given params and embeddings, persisting the embeddings
+        before the log entries that reference them."""
+        super()._append(params, vectors, token_counts)
+        self._embeddings.flush()
+
+        lines = []
+        for param, tokens in zip(params, token_counts):
+            record = {**param, "tokens": int(tokens)}
+            lines.append(json.dumps(record) + "\n")
+        with open(self._path(self._params_file_name), "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def _grow_embeddings(self, capacity: int, dims: int) -> numpy.ndarray:
+        """Grows the embeddings file to the given number of rows and maps it.
+        Existing rows stay in place on disk, so nothing needs to be copied."""
+        if self._dims is None:
+            self._dims = dims
+            with open(self._path(self._index_file_name), "w", encoding="utf-8") as f:
+                json.dump({"dims": dims}, f)
+        if dims != self._dims:
+            raise Exception(
+                f"Store at {self._dir_path} holds {self._dims}-dimensional embeddings, got {dims}.")
+
+        path = self._path(self._embeddings_file_name)
+        rows = max(capacity, self._stored_rows())
+        with open(path, "ab") as f:
+            f.truncate(rows * dims * numpy.dtype(numpy.float32).itemsize)
+        return numpy.memmap(path, dtype=numpy.float32,
+                            mode="r+", shape=(rows, dims))
+
+    def _stored_rows(self) -> int:
+        """Returns how many embedding rows the embeddings file has room for."""
+        path = self._path(self._embeddings_file_name)
+        if self._dims is None or not os.path.exists(path):
+            return 0
+        itemsize = numpy.dtype(numpy.float32).itemsize
+        return os.path.getsize(path) // (self._dims * itemsize)
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self._dir_path, file_name)
@@ -0,0 +1,77 @@
+"""Module that defines an in-memory BM25 index, which ranks stored chunks by
+the words they share with a query without needing its embedding."""
+import math
+import re
+from array import array
+from collections import Counter
+
+import numpy
+
+_word = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits the given text into lowercase words."""
+    return _word.findall(text.lower())
+
+
+class BM25Index:
+    """Inverted index of documents, identified by their insertion order,
+    which scores documents against a query with Okapi BM25. Documents can
+    only be appended, so the index is updated incrementally.
+
+    Not thread-safe: documents must not be added while scoring."""
+
+    # Term frequency saturation, and how much document length matters.
+    k1: float = 1.5
+    b: float = 0.75
+
+    # Term to the IDs of the documents it occurs in, and how often it
+    # occurs in each.
+    _postings: dict[str, tuple[array, array]]
+    _doc_lengths: array
+    _total_length: int
+
+    def __init__(self):
+        self._postings = {}
+        self._doc_lengths = array("I")
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def add(self, texts: list[str]):
+        """Indexes the given documents, in order."""
+        for text in texts:
+            doc_id = len(self._doc_lengths)
+            terms = tokenize(text)
+            for term, tf in Counter(terms).items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = (array("I"), array("I"))
+                    self._postings[term] = postings
+                postings[0].append(doc_id)
+                postings[1].append(tf)
+            self._doc_lengths.append(len(terms))
+            self._total_length += len(terms)
+
+    def scores(self, query: str) -> numpy.ndarray:
+        """Returns the BM25 score of every indexed document for the given
+        query. Documents sharing no words with the query score 0."""
+        n = len(self._doc_lengths)
+        scores = numpy.zeros(n, dtype=numpy.float32)
+        if n == 0:
+            return scores
+        doc_lengths = numpy.frombuffer(self._doc_lengths, dtype=numpy.uint32)
+        avg_length = self._total_length / n or 1
+        norms = self.k1 * (1 - self.b + self.b * doc_lengths / avg_length)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            doc_ids = numpy.frombuffer(postings[0], dtype=numpy.uint32)
+            tfs = numpy.frombuffer(postings[1], dtype=numpy.uint32)
+            df = len(doc_ids)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            scores[doc_ids] += idf * tfs * (self.k1 + 1) / (tfs + norms[doc_ids])
+        return scores
@@ -1,120 +1,404 @@
+import bisect
+import enum
+import functools
+import re
 import threading
 import time
+from collections import OrderedDict
 import numpy
-from openai import OpenAI
-from openai.types.embedding import Embedding
+from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionUserMessageParam
-import textwrap
 import tiktoken
 
+from server import metrics
+from server.llm.embeddings import EmbeddingBatcher
+from server.store.lexical import BM25Index
+from server.store.store import Store
 
-class MemoryStore:
-    _client: OpenAI
-    _embeddings: list[Embedding]
+_embedded_tokens = metrics.counter(
+    "store_embedded_tokens", "Tokens of content embedded by stores")
+_gather_context_seconds = metrics.histogram(
+    "store_gather_context_seconds",
+    "Time taken to gather context for a query, including embedding it")
+_gather_context_candidates = metrics.histogram(
+    "store_gather_context_candidates",
+    "Number of stored chunks ranked to gather context for a query",
+    buckets=metrics.COUNT_BUCKETS)
+_query_embedding_lookups = metrics.counter(
+    "store_query_embedding_cache_lookups",
+    "Query embedding cache lookups, by whether they were hits or misses",
+    ("result",))
+_query_embedding_hits = _query_embedding_lookups.labels(result="hit")
+_query_embedding_misses = _query_embedding_lookups.labels(result="miss")
+
+
+class Retrieval(str, enum.Enum):
+    """How stores rank stored params against a query"""
+    # By similarity of embeddings.
+    VECTOR = "vector"
+    # By words shared with the query, which needs no embedding request.
+    # Falls back to embeddings if no stored param shares a word.
+    LEXICAL = "lexical"
+    # By a weighted blend of both.
+    HYBRID = "hybrid"
+
+
+class MemoryStore(Store):
+    """Store which keeps all messages and embeddings in memory."""
+    _client: AsyncOpenAI
+    _batcher: EmbeddingBatcher
+    # Pre-normalized embeddings, one row per stored param. Only the first
+    # _size rows are populated; the rest is spare capacity.
+    _embeddings: numpy.ndarray
+    # Token count of each stored param's content, parallel to _embeddings.
+    _token_counts: numpy.ndarray
+    _size: int
     _params: list[ChatCompletionMessageParam]
+    # Word index of stored params' content, parallel to _embeddings.
+    _index: BM25Index
+    _retrieval: Retrieval
+    # Normalized embeddings of recent queries, in least recently used order.
+    _query_embeddings: OrderedDict[str, numpy.ndarray]
     _embedding_model = "text-embedding-ada-002"
     _lock: threading.Lock
 
-    def __init__(self, client: OpenAI):
+    # Token size of, and overlap between, the chunks stored params are
+    # split into.
+    _chunk_size: int
+    _chunk_overlap: int
+
+    # How many rows to allocate for the first batch of embeddings.
+    _initial_capacity: int = 256
+    # How many of the most similar params to rank before falling back
+    # to ranking all of them.
+    _top_k: int = 64
+    # How much word matches count in hybrid retrieval, from 0 to 1.
+    _lexical_weight: float = 0.3
+    # How many query embeddings to keep.
+    _query_cache_size: int = 256
+
+    def __init__(self, client: AsyncOpenAI, chunk_size: int = 500,
+                 chunk_overlap: int = 0, batcher: EmbeddingBatcher = None,
+                 retrieval: Retrieval = Retrieval.VECTOR):
         self._lock = threading.Lock()
         self._client = client
-        self._embeddings = []
+        # Stores can share a batcher, so that their embedding requests are
+        # sent together. Otherwise, only this store's requests are batched.
+        self._batcher = batcher if batcher is not None \
+            else EmbeddingBatcher(client, self._embedding_model)
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self._embeddings = numpy.empty((0, 0), dtype=numpy.float32)
+        self._token_counts = numpy.empty(0, dtype=numpy.int32)
+        self._size = 0
         self._params = []
+        self._index = BM25Index()
+        self._retrieval = Retrieval(retrieval)
+        self._query_embeddings = OrderedDict()
 
-    def add(self, params: list[ChatCompletionMessageParam]):
+    async def add(self, params: list[ChatCompletionMessageParam]):
         """Stores messages and embeddings for context generation."""
         new_params = []
         for param in params:
             content = param.get("content")
             prefix = f'[Timestamp {time.time()}]: '
 
-            chunks = chunk(content, prefix=prefix, target_chunk_size=500)
+            chunks = chunk(content, prefix=prefix,
+                           target_chunk_size=self._chunk_size,
+                           overlap=self._chunk_overlap)
             for c in chunks:
                 np = {'role': param.get('role'), 'content': c}
                 new_params.append(np)
 
+        if not new_params:
+            return
+
         input: list[str] = []
         for doc in new_params:
             input.append(str(doc))
 
-        embeddings = self._client.embeddings.create(
-            input=input,
-            model=self._embedding_model
-        )
+        embeddings = await self._batcher.embed(input)
+        vectors = _normalize(numpy.array(embeddings, dtype=numpy.float32))
+        token_counts = [count_tokens(p.get('content')) for p in new_params]
+        _embedded_tokens.inc(sum(token_counts))
         with self._lock:
-            self._params.extend(new_params)
-            self._embeddings.extend(embeddings.data)
-
-            if len(self._params) != len(self._embeddings):
+            if len(new_params) != len(vectors):
                 raise Exception(
                     "Something went wrong, params and embeddings are not the same length.")
 
-    def gather_context(self, input: ChatCompletionUserMessageParam,
-                       max_tokens: int = 120000) -> list[ChatCompletionMessageParam]:
+            self._append(new_params, vectors, token_counts)
+
+    async def gather_context(self, input: ChatCompletionUserMessageParam,
+                             max_tokens: int = 120000) -> list[ChatCompletionMessageParam]:
         """Queries store for most contextually relevant params."""
         with self._lock:
-            if self._params == []:
+            if self._size == 0:
                 return []
+        start = time.perf_counter()
+        content = input.get("content") or ""
+
+        # Embed the query outside the lock, so that concurrent queries and
+        # additions don't wait on each other's network round-trips.
+        query = None
+        if self._retrieval != Retrieval.LEXICAL:
+            query = await self._embed_query(str(input))
+        scores, token_counts, params = self._score(content, query)
+        if scores is None:
+            # Nothing shares a word with the query, so rank by meaning.
+            query = await self._embed_query(str(input))
+            scores, token_counts, params = self._score(content, query)
+        if len(scores) == 0:
+            return []
+
+        remaining_tokens = max_tokens
+        relevant_docs = []
+        for i in self._rank(scores):
+            tokens_used = int(token_counts[i])
+            if remaining_tokens - tokens_used < 0:
+                break
+            remaining_tokens -= tokens_used
+            relevant_docs.append(params[i])
+        _gather_context_candidates.observe(len(scores))
+        _gather_context_seconds.observe(time.perf_counter() - start)
+        return relevant_docs
 
-            input_embedding = self._client.embeddings.create(
-                input=str(input),
-                model=self._embedding_model
-            ).data[0].embedding
-
-            sims: list[tuple[float, int]] = []
-            for i, embedding in enumerate(self._embeddings):
-                sim = self._cosine_similarity(
-                    input_embedding, embedding.embedding)
-                sims.append((sim, i))
-
-            sims.sort(key=lambda x: x[0], reverse=True)
-            idxs = [x[1] for x in sims]
-
-            remaining_tokens = max_tokens
-            relevant_docs = []
-            for i in idxs:
-                doc = self._params[i]
-                tokens_used = count_tokens(doc.get('content'))
-                if remaining_tokens - tokens_used < 0:
-                    break
-                remaining_tokens -= tokens_used
-                relevant_docs.append(doc)
-            return relevant_docs
-    
     def destroy(self):
         """Destroys all stored messages and embeddings."""
         with self._lock:
-            self._embeddings = []
+            self._embeddings = numpy.empty((0, 0), dtype=numpy.float32)
+            self._token_counts = numpy.empty(0, dtype=numpy.int32)
+            self._size = 0
             self._params = []
+            self._index = BM25Index()
+            self._query_embeddings = OrderedDict()
+
+    async def _embed_query(self, text: str) -> numpy.ndarray:
+        """Returns the normalized embedding of the given query, reusing
+        it if the same query was embedded recently."""
+        with self._lock:
+            embedding = self._query_embeddings.get(text)
+            if embedding is not None:
+                self._query_embeddings.move_to_end(text)
+        if embedding is not None:
+            _query_embedding_hits.inc()
+            return embedding
+        _query_embedding_misses.inc()
+
+        embedding = _normalize(numpy.array(
+            (await self._batcher.embed([text]))[0], dtype=numpy.float32))
+        with self._lock:
+            self._query_embeddings[text] = embedding
+            if len(self._query_embeddings) > self._query_cache_size:
+                self._query_embeddings.popitem(last=False)
+        return embedding
+
+    def _score(self, content: str, query: numpy.ndarray | None) \
+            -> tuple[numpy.ndarray | None, numpy.ndarray, list[ChatCompletionMessageParam]]:
+        """Scores every stored param against the given query content and
+        normalized query embedding, according to the retrieval mode.
+        Returns the scores along with a consistent snapshot of token counts
+        and params. Without an embedding, scores are None if no stored
+        param shares a word with the query."""
+        # Rows and params are only ever appended (or replaced wholesale on
+        # destroy), so a view of the populated rows and a reference to the
+        # params list form a consistent snapshot.
+        with self._lock:
+            embeddings = self._embeddings[:self._size]
+            token_counts = self._token_counts[:self._size]
+            params = self._params
+            lexical = None
+            if self._retrieval != Retrieval.VECTOR:
+                lexical = self._index.scores(content)
+
+        if query is None:
+            if not lexical.any():
+                return None, token_counts, params
+            return lexical, token_counts, params
+
+        # Since all rows are normalized, a single matrix-vector product
+        # gives us the cosine similarity of every stored param.
+        sims = embeddings @ query
+        if self._retrieval != Retrieval.HYBRID or not len(sims):
+            return sims, token_counts, params
+
+        # Scale both scores to [0, 1] before blending, since BM25 scores
+        # are unbounded and cosine similarities bunch up.
+        return (1 - self._lexical_weight) * _min_max(sims) + \
+            self._lexical_weight * _min_max(lexical), token_counts, params
+
+    def _append(self, params: list[ChatCompletionMessageParam],
+                vectors: numpy.ndarray, token_counts: list[int]):
+        """Appends the given params with their normalized embeddings and
+        token counts. Must be called with the lock held."""
+        self._reserve(self._size + len(vectors), vectors.shape[1])
+        self._embeddings[self._size:self._size + len(vectors)] = vectors
+        self._token_counts[self._size:self._size +
+                           len(vectors)] = token_counts
+        self._size += len(vectors)
+        self._params.extend(params)
+        self._index.add([p.get("content") for p in params])
 
-    def _cosine_similarity(self, a, b):
-        return numpy.dot(a, b) / (numpy.linalg.norm(a) * numpy.linalg.norm(b))
+    def _reserve(self, capacity: int, dims: int):
+        """Ensures the store can hold at least the given number of rows,
+        growing it geometrically so that appends are amortized O(1)."""
+        if capacity <= len(self._token_counts):
+            return
+        new_capacity = max(self._initial_capacity, len(self._token_counts))
+        while new_capacity < capacity:
+            new_capacity *= 2
+        grown_counts = numpy.empty(new_capacity, dtype=numpy.int32)
+        grown_counts[:self._size] = self._token_counts[:self._size]
+        self._embeddings = self._grow_embeddings(new_capacity, dims)
+        self._token_counts = grown_counts
+
+    def _grow_embeddings(self, capacity: int, dims: int) -> numpy.ndarray:
+        """Returns an embedding matrix with the given number of rows, holding
+        the currently stored embeddings."""
+        grown = numpy.empty((capacity, dims), dtype=numpy.float32)
+        if self._size:
+            grown[:self._size] = self._embeddings[:self._size]
+        return grown
+
+    def _rank(self, sims: numpy.ndarray):
+        """Yields param indices in order of descending similarity. Only the top
+        k are partitioned and sorted up front; the full ordering is computed
+        only if the caller consumes more than that."""
+        n = len(sims)
+        k = min(self._top_k, n)
+        top = numpy.argpartition(-sims, k - 1)[:k]
+        top = top[numpy.argsort(-sims[top], kind="stable")]
+        yield from top.tolist()
+        if k == n:
+            return
+
+        seen = set(top.tolist())
+        for i in numpy.argsort(-sims, kind="stable").tolist():
+            if i not in seen:
+                yield i
+
+
+def _min_max(scores: numpy.ndarray) -> numpy.ndarray:
+    """Scales the given scores linearly to the range [0, 1]."""
+    lo, hi = scores.min(), scores.max()
+    if hi == lo:
+        return numpy.zeros_like(scores)
+    return (scores - lo) / (hi - lo)
+
+
+def _normalize(vectors: numpy.ndarray) -> numpy.ndarray:
+    """Scales the given vector (or each row of the given matrix) to unit length."""
+    norms = numpy.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name="gpt-4-1106-preview") -> tiktoken.Encoding:
+    """Returns the (memoized) tokenizer for the given model."""
+    return tiktoken.encoding_for_model(model_name)
 
 
 def count_tokens(input: str, model_name="gpt-4-1106-preview") -> int:
     """Count token usage for given input string."""
-    encoding = tiktoken.encoding_for_model(model_name)
-    return len(encoding.encode(input))
+    return len(get_encoding(model_name).encode(input))
+
+
+@functools.lru_cache(maxsize=None)
+def _part_spec_token_count(model_name: str) -> int:
+    """Returns an upper bound on the token count of the part spec chunk()
+    prepends to each chunk of a multi-part input."""
+    return count_tokens('[Part 999/999]: ', model_name=model_name)
+
+
+# Whitespace that ends a sentence or a speaker turn. Clean transcripts
+# separate speaker turns with blank lines.
+_sentence_break = re.compile(r'(?<=[.!?])[ \t]+|\s*\n\s*')
 
 
 def chunk(input: str, target_chunk_size=500, prefix: str = "",
-          model_name="gpt-4-1106-preview") -> list[str]:
-    """Chunk given input string."""
-    prefix_token_count = count_tokens(prefix, model_name=model_name)
-    part_spec = f'[Part x/y]'
-    part_spec_token_count = count_tokens(part_spec, model_name=model_name)
-
-    chunks = textwrap.wrap(
-        input,
-        target_chunk_size -
-        prefix_token_count -
-        part_spec_token_count)
-    num_chunks = len(chunks)
+          model_name="gpt-4-1106-preview", overlap: int = 0) -> list[str]:
+    """Chunk given input string into pieces of at most target_chunk_size
+    tokens (including prefix and part spec), preferring to split between
+    speaker turns, then between sentences. Consecutive chunks share up to
+    `overlap` tokens."""
+    encoding = get_encoding(model_name)
+    tokens = encoding.encode(input)
+    budget = target_chunk_size
+    if prefix:
+        budget -= count_tokens(prefix, model_name=model_name)
+    if len(tokens) > budget:
+        budget -= _part_spec_token_count(model_name)
+    if budget < target_chunk_size:
+        # Tokens can merge across the seam between prefix and content.
+        budget -= 1
+    if budget <= overlap:
+        raise ValueError(
+            f"Chunk size {target_chunk_size} leaves no room for content")
+
+    turn_starts, sentence_starts = _split_points(encoding, tokens, input)
+    all_starts = sorted(turn_starts + sentence_starts)
+
+    pieces = []
+    start = 0
+    while start < len(tokens):
+        end = start + budget
+        if end < len(tokens):
+            # Don't produce chunks smaller than half the budget just to
+            # land on a boundary.
+            lo = start + budget // 2
+            end = _last_in_range(turn_starts, lo, end) or \
+                _last_in_range(sentence_starts, lo, end) or end
+        piece = encoding.decode(tokens[start:end]).strip()
+        if piece:
+            pieces.append(piece)
+        if end >= len(tokens):
+            break
+        # Start the overlap at a sentence where possible.
+        overlap_start = end - overlap
+        i = bisect.bisect_left(all_starts, overlap_start)
+        if overlap and i < len(all_starts) and all_starts[i] < end:
+            overlap_start = all_starts[i]
+        start = max(overlap_start, start + 1)
+
+    num_chunks = len(pieces)
     final_chunks = []
-    for i, chunk in enumerate(chunks):
+    for i, piece in enumerate(pieces):
         if num_chunks > 1:
-            chunk = f'{prefix}[Part {i+1}/{len(chunks)}]: {chunk}'
+            piece = f'{prefix}[Part {i+1}/{num_chunks}]: {piece}'
         else:
-            chunk = f'{prefix}{chunk}'
-        final_chunks.append(chunk)
+            piece = f'{prefix}{piece}'
+        final_chunks.append(piece)
     return final_chunks
+
+
+def _split_points(encoding: tiktoken.Encoding, tokens: list[int],
+                  input: str) -> tuple[list[int], list[int]]:
+    """Returns the sorted token indices at which a speaker turn or a
+    sentence starts in the given encoded input."""
+    # Map byte offsets of token starts back to token indices.
+    token_at_offset = {}
+    offset = 0
+    for i, token_bytes in enumerate(encoding.decode_tokens_bytes(tokens)):
+        token_at_offset[offset] = i
+        offset += len(token_bytes)
+
+    turn_starts = []
+    sentence_starts = []
+    char_pos = byte_pos = 0
+    for m in _sentence_break.finditer(input):
+        is_turn = "\n" in m.group()
+        for pos in (m.start(), m.end()):
+            byte_pos += len(input[char_pos:pos].encode())
+            char_pos = pos
+            i = token_at_offset.get(byte_pos)
+            if i:
+                (turn_starts if is_turn else sentence_starts).append(i)
+    return sorted(set(turn_starts)), sorted(set(sentence_starts))
+
+
+def _last_in_range(sorted_values: list[int], lo: int, hi: int) -> int | None:
+    """Returns the largest value v in sorted_values with lo < v <= hi."""
+    i = bisect.bisect_right(sorted_values, hi)
+    if i and sorted_values[i - 1] > lo:
+        return sorted_values[i - 1]
+    return None
@@ -0,0 +1,21 @@
+"""Module defining a context store base class, which new stores can implement"""
+from abc import ABC, abstractmethod
+
+from openai.types.chat import ChatCompletionMessageParam, ChatCompletionUserMessageParam
+
+
+class Store(ABC):
+    """Abstract class defining methods that should be implemented by any context store"""
+
+    @abstractmethod
+    async def add(self, params: list[ChatCompletionMessageParam]):
+        """Stores messages and embeddings for context generation."""
+
+    @abstractmethod
+    async def gather_context(self, input: ChatCompletionUserMessageParam,
+                             max_tokens: int = 120000) -> list[ChatCompletionMessageParam]:
+        """Queries store for most contextually relevant params."""
+
+    @abstractmethod
+    def destroy(self):
+        """Releases the store's resources."""
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from openai.types.chat import ChatCompletionUserMessageParam
+
+from server.bench.fakes import FakeOpenAI
+from server.store.file import FileStore
+from server.store.memory import Retrieval
+
+
+def user_msg(content: str) -> ChatCompletionUserMessageParam:
+    return ChatCompletionUserMessageParam(role="user", content=content)
+
+
+class FileStoreTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir_path = os.path.join(self._tmp.name, "room")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    async def test_index_survives_restart(self):
+        store = FileStore(FakeOpenAI(dims=512), self.dir_path)
+        await store.add([user_msg("the budget for next quarter"),
+                         user_msg("lunch options near the office")])
+        want = await store.gather_context(user_msg("lunch"), 4096)
+        store.destroy()
+
+        reloaded = FileStore(FakeOpenAI(dims=512), self.dir_path)
+        got = await reloaded.gather_context(user_msg("lunch"), 4096)
+        self.assertEqual(got, want)
+        self.assertIn("lunch options", got[0]["content"])
+
+    async def test_word_index_survives_restart(self):
+        store = FileStore(FakeOpenAI(dims=512), self.dir_path)
+        await store.add([user_msg("the budget for next quarter"),
+                         user_msg("lunch options near the office")])
+        store.destroy()
+
+        reloaded = FileStore(FakeOpenAI(dims=512), self.dir_path,
+                             retrieval=Retrieval.LEXICAL)
+        got = await reloaded.gather_context(user_msg("lunch"), 4096)
+        self.assertIn("lunch options", got[0]["content"])
+        self.assertEqual(reloaded._client.embeddings.calls, 0)
+
+    async def test_appends_after_restart_and_growth(self):
+        store = FileStore(FakeOpenAI(dims=512), self.dir_path)
+        store._initial_capacity = 2
+        await store.add([user_msg(f"first {i}") for i in range(3)])
+        store.destroy()
+
+        reloaded = FileStore(FakeOpenAI(dims=512), self.dir_path)
+        reloaded._initial_capacity = 2
+        await reloaded.add([user_msg(f"second {i}") for i in range(6)])
+        reloaded.destroy()
+
+        final = FileStore(FakeOpenAI(dims=512), self.dir_path)
+        self.assertEqual(final._size, 9)
+        got = await final.gather_context(user_msg("second"), 120000)
+        self.assertEqual(len(got), 9)
+        self.assertIn("second", got[0]["content"])
+
+    async def test_torn_log_line_is_dropped(self):
+        store = FileStore(FakeOpenAI(dims=512), self.dir_path)
+        await store.add([user_msg("kept")])
+        store.destroy()
+        with open(os.path.join(self.dir_path, "params.jsonl"), "a",
+                  encoding="utf-8") as f:
+            f.write('{"role": "user", "cont')
+
+        reloaded = FileStore(FakeOpenAI(dims=512), self.dir_path)
+        self.assertEqual(reloaded._size, 1)
+        await reloaded.add([user_msg("added")])
+        self.assertEqual(FileStore(FakeOpenAI(dims=512), self.dir_path)._size, 2)
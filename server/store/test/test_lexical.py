@@ -0,0 +1,33 @@
+import unittest
+
+from server.store.lexical import BM25Index, tokenize
+
+
+class BM25IndexTests(unittest.TestCase):
+    def test_tokenize(self):
+        self.assertEqual(tokenize("Hello, World! It's 5pm."),
+                         ["hello", "world", "it", "s", "5pm"])
+
+    def test_scores_rank_matching_documents(self):
+        index = BM25Index()
+        index.add(["the budget is tight", "lunch near the office"])
+        index.add(["budget budget review"])
+
+        scores = index.scores("Budget review")
+        self.assertEqual(len(scores), 3)
+        self.assertEqual(scores[1], 0)
+        self.assertGreater(scores[2], scores[0])
+        self.assertGreater(scores[0], 0)
+
+    def test_rare_terms_weigh_more(self):
+        index = BM25Index()
+        index.add(["the plan", "the plan", "the launch"])
+
+        scores = index.scores("the launch")
+        self.assertGreater(scores[2], scores[0])
+
+    def test_empty_index(self):
+        index = BM25Index()
+        self.assertEqual(len(index.scores("anything")), 0)
+        index.add([""])
+        self.assertEqual(index.scores("anything").tolist(), [0])
@@ -0,0 +1,179 @@
+import asyncio
+import time
+import unittest
+
+from openai.types.chat import ChatCompletionUserMessageParam
+
+from server.bench.fakes import FakeOpenAI
+from server.store.memory import MemoryStore, Retrieval, chunk, count_tokens
+
+
+def user_msg(content: str) -> ChatCompletionUserMessageParam:
+    return ChatCompletionUserMessageParam(role="user", content=content)
+
+
+class MemoryStoreTests(unittest.IsolatedAsyncioTestCase):
+    async def test_gather_context_ranks_by_similarity(self):
+        store = MemoryStore(FakeOpenAI(dims=512))
+        await store.add([user_msg("the budget for next quarter"),
+                         user_msg("lunch options near the office"),
+                         user_msg("hiring plan for the design team")])
+
+        got = await store.gather_context(user_msg("what about lunch"), 4096)
+        self.assertEqual(len(got), 3)
+        self.assertIn("lunch options", got[0]["content"])
+
+    async def test_gather_context_respects_token_budget(self):
+        store = MemoryStore(FakeOpenAI(dims=64))
+        await store.add([user_msg(f"item number {i}") for i in range(10)])
+
+        got = await store.gather_context(user_msg("item"), 30)
+        self.assertGreater(len(got), 0)
+        self.assertLess(len(got), 10)
+
+    async def test_add_grows_past_initial_capacity(self):
+        store = MemoryStore(FakeOpenAI(dims=16))
+        store._initial_capacity = 4
+        store._top_k = 2
+        for i in range(3):
+            await store.add([user_msg(f"batch {i} line {j}") for j in range(5)])
+
+        self.assertEqual(store._size, 15)
+        got = await store.gather_context(user_msg("batch"), 120000)
+        self.assertEqual(len(got), 15)
+        self.assertEqual(len({d["content"] for d in got}), 15)
+
+    async def test_add_stores_token_counts(self):
+        store = MemoryStore(FakeOpenAI(dims=16))
+        await store.add([user_msg("one two three"), user_msg("four")])
+
+        want = [count_tokens(p["content"]) for p in store._params]
+        self.assertEqual(store._token_counts[:store._size].tolist(), want)
+
+    async def test_gather_context_empty_store(self):
+        store = MemoryStore(FakeOpenAI(dims=16))
+        self.assertEqual(await store.gather_context(user_msg("anything")), [])
+
+    async def test_repeated_queries_are_embedded_once(self):
+        store = MemoryStore(FakeOpenAI(dims=64))
+        await store.add([user_msg("the budget for next quarter")])
+        calls = store._client.embeddings.calls
+
+        for _ in range(3):
+            await store.gather_context(user_msg("what about the budget"), 4096)
+        await store.gather_context(user_msg("what about hiring"), 4096)
+        self.assertEqual(store._client.embeddings.calls, calls + 2)
+
+
+class MemoryStoreRetrievalTests(unittest.IsolatedAsyncioTestCase):
+    async def add_meeting(self, store: MemoryStore):
+        await store.add([user_msg("the budget for next quarter is tight"),
+                         user_msg("lunch options near the office"),
+                         user_msg("hiring plan for the design team")])
+
+    async def test_lexical_retrieval_skips_embedding(self):
+        store = MemoryStore(FakeOpenAI(dims=512), retrieval=Retrieval.LEXICAL)
+        await self.add_meeting(store)
+        calls = store._client.embeddings.calls
+
+        got = await store.gather_context(user_msg("who is hiring designers"), 4096)
+        self.assertEqual(len(got), 3)
+        self.assertIn("hiring plan", got[0]["content"])
+        self.assertEqual(store._client.embeddings.calls, calls)
+
+    async def test_lexical_retrieval_falls_back_to_embeddings(self):
+        store = MemoryStore(FakeOpenAI(dims=512), retrieval="lexical")
+        await self.add_meeting(store)
+        calls = store._client.embeddings.calls
+
+        got = await store.gather_context(user_msg("xyz"), 4096)
+        self.assertEqual(len(got), 3)
+        self.assertEqual(store._client.embeddings.calls, calls + 1)
+
+    async def test_hybrid_retrieval_blends_scores(self):
+        store = MemoryStore(FakeOpenAI(dims=512), retrieval=Retrieval.HYBRID)
+        await self.add_meeting(store)
+
+        got = await store.gather_context(user_msg("what about lunch"), 4096)
+        self.assertEqual(len(got), 3)
+        self.assertIn("lunch options", got[0]["content"])
+
+    async def test_destroy_clears_index(self):
+        store = MemoryStore(FakeOpenAI(dims=16), retrieval=Retrieval.LEXICAL)
+        await self.add_meeting(store)
+        store.destroy()
+        self.assertEqual(len(store._index), 0)
+        self.assertEqual(await store.gather_context(user_msg("budget")), [])
+
+
+def meeting_transcript(turns: int) -> str:
+    speakers = ["Alice", "Bob", "Carol"]
+    return "\n\n".join(
+        f"{speakers[i % 3]}: We covered agenda item {i}. "
+        f"The follow-up for item {i} is owned by {speakers[(i + 1) % 3]}, "
+        "who will report back next week!"
+        for i in range(turns))
+
+
+class ChunkTests(unittest.TestCase):
+    def test_single_chunk_has_no_part_spec(self):
+        got = chunk("A short line.", target_chunk_size=50, prefix="[T]: ")
+        self.assertEqual(got, ["[T]: A short line."])
+
+    def test_chunk_size_distribution(self):
+        target = 120
+        chunks = chunk(meeting_transcript(200), target_chunk_size=target,
+                       prefix="[Timestamp 1700000000.0]: ")
+        sizes = [count_tokens(c) for c in chunks]
+
+        self.assertGreater(len(chunks), 1)
+        self.assertLessEqual(max(sizes), target)
+        # All but the last chunk should be close to the target size.
+        self.assertGreaterEqual(min(sizes[:-1]), target // 2)
+        self.assertGreaterEqual(sum(sizes[:-1]) / len(sizes[:-1]),
+                                0.8 * target)
+
+    def test_chunks_split_on_speaker_turns(self):
+        chunks = chunk(meeting_transcript(50), target_chunk_size=150)
+        for c in chunks:
+            body = c.split("]: ", 1)[1]
+            self.assertRegex(body, r"^(Alice|Bob|Carol): ")
+            self.assertTrue(body.endswith("next week!"))
+
+    def test_chunks_overlap(self):
+        text = meeting_transcript(50)
+        plain = chunk(text, target_chunk_size=150)
+        overlapping = chunk(text, target_chunk_size=150, overlap=40)
+
+        self.assertGreater(len(overlapping), len(plain))
+        for prev, cur in zip(overlapping, overlapping[1:]):
+            first_sentence = cur.split("]: ", 1)[1].split(". ")[0]
+            self.assertIn(first_sentence, prev)
+
+    def test_chunk_without_boundaries(self):
+        text = "x" * 5000
+        chunks = chunk(text, target_chunk_size=100)
+        self.assertTrue(all(count_tokens(c) <= 100 for c in chunks))
+        joined = "".join(c.split("]: ", 1)[1] for c in chunks)
+        self.assertEqual(joined, text)
+
+
+class MemoryStoreConcurrencyTests(unittest.IsolatedAsyncioTestCase):
+    async def test_queries_do_not_serialize_on_embedding_calls(self):
+        latency = 0.3
+        store = MemoryStore(FakeOpenAI(dims=64))
+        await store.add([user_msg(f"line {i}") for i in range(20)])
+        store._client.embeddings.latency = latency
+
+        queries = [store.gather_context(user_msg("line"), 4096)
+                   for _ in range(3)]
+        start = time.perf_counter()
+        *results, _ = await asyncio.gather(
+            *queries, store.add([user_msg("late line")]))
+        elapsed = time.perf_counter() - start
+
+        # Serialized calls would take at least 4 * latency.
+        self.assertLess(elapsed, 2 * latency)
+        for got in results:
+            self.assertGreaterEqual(len(got), 20)
+        self.assertEqual(store._size, 21)
@@ -0,0 +1,57 @@
+"""This module contains tests for the headless session config"""
+
+import os
+import unittest
+from unittest import mock
+
+from server.config import BotConfig, get_headless_config
+
+
+class HeadlessConfigTest(unittest.TestCase):
+    @mock.patch.dict(os.environ, {"STORE_DIR_PATH": "/tmp/stores"})
+    @mock.patch("sys.argv", ["main.py", "--room_url", "https://example.daily.co/room"])
+    def test_store_dir_from_env(self):
+        c = get_headless_config()
+        self.assertEqual(c.store_dir_path, "/tmp/stores")
+        self.assertEqual(
+            os.path.dirname(c.get_store_dir_path(c.daily_room_url)),
+            "/tmp/stores")
+
+    @mock.patch.dict(os.environ, {"STORE_DIR_PATH": "/tmp/stores"})
+    @mock.patch("sys.argv", ["main.py", "--store_dir_name", "/tmp/other"])
+    def test_store_dir_flag_overrides_env(self):
+        c = get_headless_config()
+        self.assertEqual(c.store_dir_path, "/tmp/other")
+
+    @mock.patch.dict(os.environ, {"RETRIEVAL": "hybrid"})
+    @mock.patch("sys.argv", ["main.py"])
+    def test_retrieval_from_env(self):
+        c = get_headless_config()
+        self.assertEqual(c.retrieval, "hybrid")
+
+    @mock.patch.dict(os.environ, {"RETRIEVAL": "bm25"})
+    @mock.patch("sys.argv", ["main.py"])
+    def test_unknown_retrieval_from_env_fails(self):
+        with mock.patch("sys.stderr"), self.assertRaises(SystemExit):
+            get_headless_config()
+
+
+class StoreDirTest(unittest.TestCase):
+    def test_rooms_with_the_same_name_get_separate_stores(self):
+        c = BotConfig("fake_key", None, store_dir_path="/tmp/stores")
+        a = c.get_store_dir_path("https://a.daily.co/standup")
+        b = c.get_store_dir_path("https://b.daily.co/standup")
+        self.assertNotEqual(a, b)
+        for path in (a, b):
+            self.assertEqual(os.path.dirname(path), "/tmp/stores")
+            self.assertTrue(os.path.basename(path).startswith("standup-"))
+
+    def test_room_keeps_its_store(self):
+        c = BotConfig("fake_key", None, store_dir_path="/tmp/stores")
+        self.assertEqual(c.get_store_dir_path("https://a.daily.co/standup"),
+                         c.get_store_dir_path("https://A.daily.co/standup/"))
+
+    def test_no_store_dir_keeps_stores_in_memory(self):
+        c = BotConfig("fake_key", None)
+        self.assertIsNone(
+            c.get_store_dir_path("https://a.daily.co/standup"))
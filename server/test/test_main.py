@@ -0,0 +1,61 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+from server import main
+from server.call.operator import CapacityError
+
+
+class CreateSessionTests(unittest.TestCase):
+    def post_session(self):
+        async def post():
+            client = main.app.test_client()
+            return await client.post("/session", json={
+                "room_url": "https://example.daily.co/room",
+                "openai_api_key": "fake_key",
+            })
+        return asyncio.run(post())
+
+    @mock.patch.object(main, "probe_api_key", mock.AsyncMock(return_value=True))
+    def test_full_server_asks_to_retry(self):
+        operator = mock.Mock()
+        operator.start_session.side_effect = CapacityError("full", 12)
+        with mock.patch.object(main, "operator", operator):
+            res = self.post_session()
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers["Retry-After"], "12")
+
+    @mock.patch.object(main, "probe_api_key", mock.AsyncMock(return_value=True))
+    def test_session_id_is_returned(self):
+        operator = mock.Mock()
+        operator.start_session.return_value = ("abc", True)
+        with mock.patch.object(main, "operator", operator):
+            res = self.post_session()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(asyncio.run(res.get_json())["session_id"], "abc")
+
+
+class InitTests(unittest.TestCase):
+    @mock.patch.dict(os.environ, {"RETRIEVAL": "bm25"})
+    def test_unknown_retrieval_fails_startup(self):
+        with mock.patch.object(main, "Daily") as daily, \
+                self.assertRaises(ValueError):
+            asyncio.run(main.init())
+        daily.init.assert_not_called()
+
+
+class MetricsRouteTests(unittest.TestCase):
+    def test_metrics_are_exposed(self):
+        operator = mock.Mock()
+        operator.collect_metrics.return_value = []
+
+        async def get():
+            return await main.app.test_client().get("/metrics")
+        with mock.patch.object(main, "operator", operator):
+            res = asyncio.run(get())
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith("text/plain"))
@@ -0,0 +1,100 @@
+import unittest
+from unittest import mock
+
+from server import metrics
+from server.bench.fakes import FakeCallClient
+from server.call.operator import Operator
+from server.config import BotConfig, Capacity
+
+
+class MetricsTests(unittest.TestCase):
+    def test_counter_and_gauge_are_rendered(self):
+        requests = metrics.Counter("requests", "Requests", ("kind",))
+        requests.labels(kind="a").inc()
+        requests.labels(kind="a").inc(2)
+        queued = metrics.Gauge("queued", 'Queued "items"')
+        queued.set_function(lambda: 7)
+
+        text = metrics.render([requests.collect(), queued.collect()])
+        self.assertEqual(text, "\n".join([
+            "# HELP requests Requests",
+            "# TYPE requests counter",
+            'requests_total{kind="a"} 3',
+            '# HELP queued Queued "items"',
+            "# TYPE queued gauge",
+            "queued 7",
+        ]) + "\n")
+
+    def test_histogram_buckets_are_cumulative(self):
+        latency = metrics.Histogram("latency", "Latency", buckets=(0.1, 1))
+        for value in [0.05, 0.1, 0.5, 2]:
+            latency.observe(value)
+
+        samples = {(n, l.get("le")): v
+                   for n, l, v in latency.collect().samples}
+        self.assertEqual(samples[("latency_bucket", "0.1")], 2)
+        self.assertEqual(samples[("latency_bucket", "1.0")], 3)
+        self.assertEqual(samples[("latency_bucket", "+Inf")], 4)
+        self.assertEqual(samples[("latency_count", None)], 4)
+        self.assertAlmostEqual(samples[("latency_sum", None)], 2.65)
+
+    def test_label_values_are_escaped(self):
+        g = metrics.Gauge("g", "G", ("room",))
+        g.labels(room='a"b\\c').set(1)
+        self.assertIn('g{room="a\\"b\\\\c"} 1', metrics.render([g.collect()]))
+
+    def test_merge_labels_other_samples(self):
+        g = metrics.Gauge("g", "G")
+        g.set(1)
+        merged = metrics.merge([g.collect()], [g.collect()], {"worker": "0"})
+        text = metrics.render(merged)
+        self.assertEqual(text.count("# TYPE g gauge"), 1)
+        self.assertIn('g{worker="0"} 1', text)
+
+
+class SessionMetricsTests(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("server.call.session.CallClient", FakeCallClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.operator = Operator(Capacity())
+        self.addCleanup(self.operator.shutdown)
+
+    def render(self) -> str:
+        return metrics.render(self.operator.collect_metrics())
+
+    def test_session_backlog_is_exposed_while_session_runs(self):
+        session = self.operator.create_session(
+            BotConfig("fake_key", None, "https://example.daily.co/metrics-room"))
+        for i in range(3):
+            session.on_transcription_message(
+                {"participantId": "participant-0", "text": f"line {i}"})
+
+        text = self.render()
+        labels = f'session_id="{session.session_id}",' \
+            'room_url="https://example.daily.co/metrics-room"'
+        self.assertIn(f'session_transcript_backlog{{{labels}}} 3', text)
+        self.assertIn("operator_active_sessions ", text)
+        self.assertIn("process_threads ", text)
+
+        session.shutdown()
+        self.assertNotIn(labels, self.render())
+
+    def test_rooms_with_the_same_name_keep_separate_series(self):
+        first = self.operator.create_session(
+            BotConfig("fake_key", None, "https://one.daily.co/standup"))
+        second = self.operator.create_session(
+            BotConfig("fake_key", None, "https://two.daily.co/standup"))
+        first.on_transcription_message(
+            {"participantId": "participant-0", "text": "line"})
+
+        text = self.render()
+        self.assertIn(f'session_id="{first.session_id}",'
+                      'room_url="https://one.daily.co/standup"} 1', text)
+        self.assertIn(f'session_id="{second.session_id}",'
+                      'room_url="https://two.daily.co/standup"} 0', text)
+
+        first.shutdown()
+        text = self.render()
+        self.assertNotIn(first.session_id, text)
+        self.assertIn(second.session_id, text)